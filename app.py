@@ -1,6 +1,9 @@
 import streamlit as st
-import datetime
+import altair as alt
+import hashlib
+import json
 import pandas as pd
+import time
 import uuid
 from modules.database import (
     init_gemini,
@@ -28,9 +31,16 @@ except ImportError:
         get_instance_ids_by_names_cached = getattr(_db, "get_instance_ids_by_names_cached", None)
     except Exception:
         get_instance_ids_by_names_cached = None
-from modules.agent import get_agent_response
-from modules.pdf_generator import generate_pdf_report
+from modules.agent import get_agent_response, scope_instruction
+from modules.schema import get_schema_registry
+from modules.pdf_generator import generate_pdf_report, report_cache_key
 from modules.visualizer import render_visualizer
+from modules.admin import render_admin_page
+from modules.chat_cache import ChatHistoryCache
+from modules.jobs import find_job, get_job, mark_attached, submit_job, update_job_progress
+from modules.memory_monitor import register_session, start_memory_monitor
+from modules.precompute import default_date_range, start_precompute_scheduler
+from modules.render_costs import measure_render, measured_fragment, record_payload, render_cost_table
 
 # Initialize Clients (after auth gate)
 client = None
@@ -72,6 +82,19 @@ def _get_auth_users() -> dict[str, str]:
     return users
 
 
+def _get_admin_users() -> set[str]:
+    """Return usernames allowed to open the usage page.
+
+    ADMIN_USERS may be a TOML list or a comma-separated string.
+    """
+    admins = st.secrets.get("ADMIN_USERS")
+    if isinstance(admins, str):
+        return {a.strip() for a in admins.split(",") if a.strip()}
+    if isinstance(admins, (list, tuple)):
+        return {a for a in admins if isinstance(a, str) and a}
+    return set()
+
+
 def _require_auth():
     if "is_authenticated" not in st.session_state:
         st.session_state.is_authenticated = False
@@ -113,6 +136,13 @@ def _scope_from_selection(selected_advertisers: list[str], selected_instance_ids
     if not selected_advertisers:
         return {"mode": "global"}
 
+    if len(selected_advertisers) > 1:
+        return {
+            "mode": "multi",
+            "advertiser_names": list(selected_advertisers),
+            "amc_instance_ids": list(selected_instance_ids),
+        }
+
     scope = {
         "mode": "instance",
         "advertiser_name": selected_advertisers[0],
@@ -124,20 +154,25 @@ def _scope_from_selection(selected_advertisers: list[str], selected_instance_ids
 
 
 def _ensure_session_state():
-    if "chat_history_cache" not in st.session_state:
-        st.session_state.chat_history_cache = {}
+    if not isinstance(st.session_state.get("chat_history_cache"), ChatHistoryCache):
+        # Sessions from before the byte budget hold a plain dict; carry its chats over.
+        previous = st.session_state.get("chat_history_cache") or {}
+        st.session_state.chat_history_cache = ChatHistoryCache()
+        for cached_chat_id, cached_messages in previous.items():
+            st.session_state.chat_history_cache.put(cached_chat_id, cached_messages)
+    if "browser_session_id" not in st.session_state:
+        # Identifies this browser session to the memory monitor.
+        st.session_state.browser_session_id = uuid.uuid4().hex[:12]
     if "chat_persisted" not in st.session_state:
         st.session_state.chat_persisted = {}
     if "chat_titles" not in st.session_state:
         st.session_state.chat_titles = {}
     if "chat_scope_lock" not in st.session_state:
         st.session_state.chat_scope_lock = {}
-    if "date_range" not in st.session_state:
-        today = datetime.date.today()
-        last_30 = today - datetime.timedelta(days=30)
-        st.session_state.date_range = (last_30, today)
-    if "show_date_dialog" not in st.session_state:
-        st.session_state.show_date_dialog = False
+    if not st.session_state.get("date_range_custom"):
+        # Re-derived every run until the user picks a range, so long-lived sessions
+        # roll over at midnight like the precomputed quick actions do.
+        st.session_state.date_range = default_date_range()
 
 
 def _lock_chat_scope(chat_id: str, scope: dict):
@@ -215,6 +250,375 @@ def _persist_message_if_needed(
         data_snapshot=data_snapshot,
     )
 
+def _render_timings_waterfall(timings: dict | None):
+    """Draw the last request's trace spans as a waterfall (one bar per span)."""
+    if not isinstance(timings, dict) or not timings.get("spans"):
+        st.caption("No request traced yet.")
+        return
+
+    spans = timings["spans"]
+    depth_by_id: dict[str, int] = {}
+    rows = []
+    for span in spans:
+        depth = depth_by_id.get(span.get("parent_id"), -1) + 1
+        depth_by_id[span["span_id"]] = depth
+        rows.append(
+            {
+                "stage": f"{'· ' * depth}{span['name']}",
+                "start_ms": span["start_ms"],
+                "end_ms": span["start_ms"] + span["duration_ms"],
+                "duration_ms": span["duration_ms"],
+                "thread": span.get("thread"),
+            }
+        )
+    df_spans = pd.DataFrame(rows)
+
+    st.caption(f"Total: {timings.get('total_ms', 0):.0f} ms")
+    chart = (
+        alt.Chart(df_spans)
+        .mark_bar()
+        .encode(
+            x=alt.X("start_ms", title="ms"),
+            x2="end_ms",
+            y=alt.Y("stage", sort=None, title=None),
+            tooltip=["stage", "duration_ms", "start_ms", "thread"],
+        )
+    )
+    st.altair_chart(chart, use_container_width=True)
+
+    jsonl = "\n".join(json.dumps(span, default=str) for span in spans)
+    st.download_button(
+        "Export spans (JSON lines)",
+        data=jsonl.encode("utf-8"),
+        file_name="agent_trace.jsonl",
+        mime="application/x-ndjson",
+        use_container_width=True,
+    )
+
+
+@st.dialog("Choose a date range")
+def _date_range_dialog():
+    new_range = st.date_input(
+        "Date Range",
+        st.session_state.date_range,
+        format="YYYY-MM-DD",
+    )
+
+    c1, c2 = st.columns(2)
+    apply_clicked = c1.button("Apply", type="primary", use_container_width=True)
+    cancel_clicked = c2.button("Cancel", use_container_width=True)
+
+    if apply_clicked:
+        if isinstance(new_range, (tuple, list)) and len(new_range) == 2:
+            st.session_state.date_range = (new_range[0], new_range[1])
+            st.session_state.date_range_custom = True
+        st.rerun()
+
+    if cancel_clicked:
+        st.rerun()
+
+
+@measured_fragment("sidebar.filters")
+def _render_filters():
+    with st.expander("Filters", expanded=False):
+        marketplaces = ["US", "UK", "DE", "FR", "IT", "ES", "CA", "JP", "MX", "BR", "AU", "IN", "NL"]
+        marketplace_labels = [
+            f"{code} - {MARKETPLACE_NAMES.get(code, '')}" for code in marketplaces
+        ]
+        st.selectbox(
+            "Marketplace",
+            marketplace_labels,
+            index=0,
+            key="marketplace",
+        )
+
+        # Date range picker lives in a dialog (prevents clipping inside sidebar)
+        current_range = st.session_state.date_range
+        if isinstance(current_range, (tuple, list)) and len(current_range) == 2:
+            st.caption(f"Date Range: {current_range[0]} → {current_range[1]}")
+        else:
+            st.caption("Date Range: not set")
+
+        if st.button("Change Date Range", use_container_width=True):
+            _date_range_dialog()
+
+
+def _chat_context(chat_id: str, advertisers: list[str]):
+    """Advertisers, instance ids and system prompt for `chat_id`, read from session state.
+
+    Used by the sidebar fragment and by the full-page run, so both see the same scope.
+    """
+    locked_scope = st.session_state.chat_scope_lock.get(chat_id)
+    if locked_scope and isinstance(locked_scope, dict):
+        locked_mode = locked_scope.get("mode")
+        if locked_mode == "multi":
+            locked_names = locked_scope.get("advertiser_names") or []
+        elif locked_mode == "instance":
+            locked_names = [locked_scope.get("advertiser_name")]
+        else:
+            locked_names = []
+        selected_advertisers = [str(name) for name in locked_names if name in advertisers]
+    else:
+        selected_advertisers = [a for a in st.session_state.get(f"scope_select_{chat_id}") or [] if a in advertisers]
+
+    # Resolve selected instance IDs (used to scope all AMC queries)
+    selected_instance_ids = []
+    if selected_advertisers and callable(get_instance_ids_by_names_cached):
+        resolved_ids = get_instance_ids_by_names_cached(tuple(selected_advertisers))
+        if isinstance(resolved_ids, (list, tuple, set)):
+            resolved_ids_list = list(resolved_ids)
+        else:
+            resolved_ids_list = []
+        selected_instance_ids = [int(x) for x in resolved_ids_list if isinstance(x, int)]
+
+    system_instruction = scope_instruction(selected_advertisers)
+    custom_instructions = st.session_state.get("custom_instructions")
+    if custom_instructions and custom_instructions.strip():
+        system_instruction += f"\n\nADDITIONAL USER INSTRUCTIONS:\n{custom_instructions.strip()}"
+    return selected_advertisers, selected_instance_ids, system_instruction
+
+
+@measured_fragment("sidebar.context")
+def _render_context(chat_id: str, advertisers: list[str]):
+    locked_scope = st.session_state.chat_scope_lock.get(chat_id)
+    with st.expander("Context", expanded=True):
+        if locked_scope and isinstance(locked_scope, dict):
+            st.multiselect(
+                "Advertisers (locked)",
+                advertisers,
+                default=_chat_context(chat_id, advertisers)[0],
+                placeholder="🌎 Global",
+                disabled=True,
+            )
+        else:
+            st.multiselect(
+                "Advertisers (empty = Global)",
+                advertisers,
+                placeholder="🌎 Global",
+                key=f"scope_select_{chat_id}",
+                help="Pick several advertisers to compare them side by side.",
+            )
+
+    # Logic & Context Handling
+    selected_advertisers = _chat_context(chat_id, advertisers)[0]
+    if not selected_advertisers:
+        st.caption("Context: Global")
+    else:
+        st.caption(f"Context: {', '.join(selected_advertisers)}")
+
+
+@measured_fragment("sidebar.advanced")
+def _render_advanced(chat_id: str, advertisers: list[str]):
+    with st.expander("Advanced", expanded=False):
+        st.caption("Technical details")
+
+        # --- Custom Instructions ---
+        st.text_area(
+            "Custom System Instructions",
+            help="Add specific rules, persona details, or constraints for the AI agent.",
+            key="custom_instructions"
+        )
+
+        with st.expander("System prompt", expanded=False):
+            st.code(_chat_context(chat_id, advertisers)[2], language="text")
+            last_prompt_stats = st.session_state.get("last_prompt_stats")
+            if isinstance(last_prompt_stats, dict):
+                st.caption(
+                    f"Last request: {last_prompt_stats.get('pruned_chars')} chars "
+                    f"(~{last_prompt_stats.get('pruned_tokens_est')} tokens), "
+                    f"{len(last_prompt_stats.get('tables') or [])}/{last_prompt_stats.get('tables_total')} tables, "
+                    f"{last_prompt_stats.get('reduction_pct')}% smaller than the full schema."
+                )
+
+        with st.expander("Latency breakdown", expanded=False):
+            _render_timings_waterfall(st.session_state.get("last_timings"))
+
+        with st.expander("Render cost", expanded=False):
+            st.caption("Time spent drawing each page area in this session (fragments rerun on their own).")
+            st.dataframe(render_cost_table(), use_container_width=True, hide_index=True)
+
+        with st.expander("Session memory", expanded=False):
+            cache_stats = st.session_state.chat_history_cache.stats()
+            st.caption(
+                f"Chat history cache: {cache_stats['chats']} chats, "
+                f"{cache_stats['bytes'] / 1e6:.1f} / {cache_stats['max_bytes'] / 1e6:.0f} MB, "
+                f"{cache_stats['evictions']} evicted."
+            )
+            st.dataframe(st.session_state.chat_history_cache.sizes(), use_container_width=True, hide_index=True)
+
+        with st.expander("Database schema", expanded=False):
+            schema_info = {
+                name: {"columns": info.get("columns", []), "description": info.get("description", "")}
+                for name, info in get_schema_registry().items()
+            }
+            st.json(schema_info)
+
+        if st.button("🗑️ Clear current chat"):
+            st.warning("Delete functionality not yet implemented in DB.")
+
+
+@measured_fragment("main.chat_title")
+def _render_chat_title(chat_id: str):
+    default_title = st.session_state.chat_titles.get(chat_id)
+    if not isinstance(default_title, str) or not default_title.strip():
+        default_title = "New chat" if not st.session_state.chat_persisted.get(chat_id, True) else "Chat"
+    default_title = default_title.strip()
+
+    st.markdown(f"### {default_title}")
+    with st.expander("Rename chat", expanded=False):
+        with st.form(key=f"rename_chat_form_{chat_id}"):
+            new_title = st.text_input("Name", value=default_title)
+            submitted = st.form_submit_button("Save")
+        if submitted:
+            new_title_clean = (new_title or "").strip()
+            if not new_title_clean:
+                st.warning("Chat name cannot be empty.")
+            else:
+                st.session_state.chat_titles[chat_id] = new_title_clean
+                if st.session_state.chat_persisted.get(chat_id, False):
+                    update_chat_title(supabase, chat_id, new_title_clean)
+                    for fn in (get_all_sessions_cached, load_chat_history_cached):
+                        try:
+                            clear_fn = getattr(fn, "clear", None)
+                            if callable(clear_fn):
+                                clear_fn()
+                        except Exception:
+                            pass
+                # The sidebar chat list picks up the new name on the next full run.
+                st.rerun(scope="fragment")
+
+
+# Messages at the end of the transcript drawn with their table and chart; older
+# ones collapse to text plus a one-line summary until expanded.
+TRANSCRIPT_EXPANDED_MESSAGES = 6
+
+
+def _artifact_summary(message: dict) -> str:
+    """One-line description of a message's table/chart, shown while it is collapsed."""
+    parts = []
+    data = message.get("data")
+    if isinstance(data, pd.DataFrame):
+        parts.append(f"table {len(data):,} rows × {len(data.columns)} cols")
+    chart_config = message.get("chart_config")
+    if isinstance(chart_config, dict) and chart_config.get("type") in ("bar", "line"):
+        parts.append(f"{chart_config['type']} chart of {chart_config.get('y')} by {chart_config.get('x')}")
+    if message.get("sql"):
+        parts.append("SQL")
+    return "📎 " + ", ".join(parts) if parts else ""
+
+
+def _render_artifacts(message: dict) -> int:
+    """Draw a message's SQL, table and chart; returns the approximate bytes sent to the browser."""
+    payload = 0
+    if message.get("sql"):
+        with st.expander("View Generated SQL"):
+            st.code(message["sql"], language="sql")
+        payload += len(message["sql"])
+
+    data = message.get("data")
+    if data is None:
+        return payload
+
+    st.dataframe(data)
+    data_bytes = int(data.memory_usage(deep=True).sum()) if isinstance(data, pd.DataFrame) else 0
+    payload += data_bytes
+
+    # Dynamic Chart Rendering
+    try:
+        chart_config = message.get("chart_config")
+        if chart_config:
+            if chart_config.get("type") == "bar":
+                st.bar_chart(data, x=chart_config.get("x"), y=chart_config.get("y"), color=chart_config.get("color"))
+                payload += data_bytes
+            elif chart_config.get("type") == "line":
+                # Fallback check for columns
+                if chart_config.get("x") in data.columns and chart_config.get("y") in data.columns:
+                    st.line_chart(data, x=chart_config.get("x"), y=chart_config.get("y"), color=chart_config.get("color"))
+                    payload += data_bytes
+    except Exception as e:
+        st.warning(f"Could not render chart: {e}")
+    return payload
+
+
+@measured_fragment("main.pdf_build", run_every=1.0)
+def _poll_pdf_job(job_id: str):
+    job = get_job(job_id)
+    if job is None or job["status"] in ("done", "failed"):
+        st.rerun()
+    st.caption("⏳ Building PDF report...")
+
+
+@measured_fragment("main.pdf_download")
+def _render_pdf_download(user_query: str, insight_text: str, df: pd.DataFrame, chart_config: dict | None):
+    """Download button for a report that is built in the background on first request.
+
+    Builds are keyed by the report's content, so the same answer is only rendered once
+    per server process (while the job store keeps it).
+    """
+    job_key = f"pdf:{report_cache_key(user_query, insight_text, df, chart_config)}"
+    job_id = find_job(job_key)
+    job = get_job(job_id) if job_id else None
+
+    if job is None or job["status"] == "failed":
+        if job is not None:
+            st.error(f"Could not generate PDF: {job['error']}")
+        if st.button("📄 Prepare PDF Report"):
+            submit_job(
+                job_key, generate_pdf_report, user_query, insight_text, df, chart_config,
+                owner=st.session_state.get("auth_user"), pool="report",
+            )
+            st.rerun(scope="fragment")
+        return
+
+    if job["status"] != "done":
+        _poll_pdf_job(job_id)
+        return
+
+    st.download_button(
+        label="📄 Download Professional PDF Report",
+        data=job["result"],
+        file_name="amc_insight_report.pdf",
+        mime="application/pdf"
+    )
+
+
+@measured_fragment("main.transcript")
+def _render_transcript(chat_id: str):
+    current_messages = st.session_state.messages
+    first_expanded = max(0, len(current_messages) - TRANSCRIPT_EXPANDED_MESSAGES)
+    payload = 0
+    for message_index, message in enumerate(current_messages):
+        with st.chat_message(message["role"]):
+            st.markdown(message["content"])
+            payload += len(message.get("content") or "")
+
+            # Older answers: summary only, tables and charts on demand.
+            summary = _artifact_summary(message)
+            if message_index < first_expanded and summary:
+                if not st.toggle(summary, key=f"expand_{chat_id}_{message_index}"):
+                    continue
+
+            payload += _render_artifacts(message)
+
+            # PDF Download Button (latest answer only), built only when asked for
+            if (
+                message.get("data") is not None
+                and message["role"] == "assistant"
+                and message_index == len(current_messages) - 1
+                and message_index > 0
+            ):
+                _render_pdf_download(
+                    current_messages[message_index - 1]["content"], message["content"], message["data"],
+                    message.get("chart_config"),
+                )
+
+    record_payload("main.transcript", payload)
+    print(
+        f"Transcript render: {len(current_messages)} messages, "
+        f"{len(current_messages) - first_expanded} expanded, ~{payload / 1024:.0f} KB payload"
+    )
+
+
 _ensure_session_state()
 
 # Auth gate (protect the entire app, including DB/API clients)
@@ -223,6 +627,12 @@ _require_auth()
 # Initialize Clients
 client = init_gemini()
 supabase = init_supabase()
+if supabase:
+    start_precompute_scheduler()
+start_memory_monitor()
+register_session(
+    st.session_state.browser_session_id, st.session_state.get("auth_user"), st.session_state.chat_history_cache
+)
 
 # Defaults (avoid undefined variables)
 advertisers: list[str] = []
@@ -321,72 +731,19 @@ with st.sidebar:
             st.session_state.auth_user = None
             st.rerun()
 
-    page = st.radio("Go to", ["AMC Assistant", "Data Visualizer"], label_visibility="collapsed")
+    pages = ["AMC Assistant", "Data Visualizer"]
+    if st.session_state.get("auth_user") in _get_admin_users():
+        pages.append("Usage")
+    page = st.radio("Go to", pages, label_visibility="collapsed")
 
     # --- Common Settings (Date + Marketplace) ---
     advertisers = get_advertisers_cached()
 
-    with st.expander("Filters", expanded=False):
-        marketplaces = ["US", "UK", "DE", "FR", "IT", "ES", "CA", "JP", "MX", "BR", "AU", "IN", "NL"]
-        marketplace_labels = [
-            f"{code} - {MARKETPLACE_NAMES.get(code, '')}" for code in marketplaces
-        ]
-        selected_marketplace_label = st.selectbox(
-            "Marketplace",
-            marketplace_labels,
-            index=0,
-        )
-        selected_marketplace = (
-            selected_marketplace_label.split(" - ")[0]
-            if isinstance(selected_marketplace_label, str) and selected_marketplace_label.strip()
-            else marketplaces[0]
-        )
-
-        # Date range picker lives in a dialog (prevents clipping inside sidebar)
-        current_range = st.session_state.date_range
-        if isinstance(current_range, (tuple, list)) and len(current_range) == 2:
-            st.caption(f"Date Range: {current_range[0]} → {current_range[1]}")
-        else:
-            st.caption("Date Range: not set")
-
-        if st.button("Change Date Range", use_container_width=True):
-            st.session_state.show_date_dialog = True
+    _render_filters()
 
     # Always expose date_range as a local variable used later in the app.
     date_range = st.session_state.date_range
 
-    # Date Range dialog (modal; avoids sidebar clipping)
-    if st.session_state.get("show_date_dialog"):
-        if hasattr(st, "dialog"):
-            @st.dialog("Choose a date range")
-            def _date_range_dialog():
-                new_range = st.date_input(
-                    "Date Range",
-                    st.session_state.date_range,
-                    format="YYYY-MM-DD",
-                )
-
-                c1, c2 = st.columns(2)
-                apply_clicked = c1.button("Apply", type="primary", use_container_width=True)
-                cancel_clicked = c2.button("Cancel", use_container_width=True)
-
-                if apply_clicked:
-                    if isinstance(new_range, (tuple, list)) and len(new_range) == 2:
-                        st.session_state.date_range = (new_range[0], new_range[1])
-                    st.session_state.show_date_dialog = False
-                    st.rerun()
-
-                if cancel_clicked:
-                    st.session_state.show_date_dialog = False
-                    st.rerun()
-
-            _date_range_dialog()
-        else:
-            st.warning(
-                "Your Streamlit version does not support st.dialog. Please update Streamlit or move the Date Range control outside the sidebar."
-            )
-            st.session_state.show_date_dialog = False
-
     # --- Assistant Specific Settings ---
     if page == "AMC Assistant":
         # Auto-create a new (draft) chat on first entry.
@@ -402,58 +759,60 @@ with st.sidebar:
             st.session_state.draft_chat_id = _new_chat_id()
             st.session_state.chat_persisted[st.session_state.draft_chat_id] = False
 
-        # DB sessions
-        db_sessions = get_all_sessions_cached() or get_all_sessions(supabase)
-        db_sessions = db_sessions or []
-        for sid in db_sessions:
-            st.session_state.chat_persisted[sid] = True
+        # Chat list lookups run on full reruns only; fragments below skip them.
+        with measure_render("sidebar.chats"):
+            # DB sessions
+            db_sessions = get_all_sessions_cached() or get_all_sessions(supabase)
+            db_sessions = db_sessions or []
+            for sid in db_sessions:
+                st.session_state.chat_persisted[sid] = True
 
-        # Combined list (draft first)
-        all_sessions = [st.session_state.draft_chat_id] + [s for s in db_sessions if s != st.session_state.draft_chat_id]
-        st.session_state.all_sessions = all_sessions
+            # Combined list (draft first)
+            all_sessions = [st.session_state.draft_chat_id] + [s for s in db_sessions if s != st.session_state.draft_chat_id]
+            st.session_state.all_sessions = all_sessions
 
-        if "current_chat_id" not in st.session_state:
-            st.session_state.current_chat_id = st.session_state.draft_chat_id
-
-        with st.expander("Chats", expanded=True):
-            if st.button("➕ New chat"):
-                st.session_state.draft_chat_id = _new_chat_id()
-                st.session_state.chat_persisted[st.session_state.draft_chat_id] = False
+            if "current_chat_id" not in st.session_state:
                 st.session_state.current_chat_id = st.session_state.draft_chat_id
-                st.session_state.messages = []
-                st.session_state.last_loaded_chat_id = st.session_state.current_chat_id
-                st.rerun()
-
-            def _format_chat_option(option_id: str) -> str:
-                # 1. Draft
-                if option_id == st.session_state.draft_chat_id:
-                    return "➕ New Chat (Draft)"
+
+            with st.expander("Chats", expanded=True):
+                if st.button("➕ New chat"):
+                    st.session_state.draft_chat_id = _new_chat_id()
+                    st.session_state.chat_persisted[st.session_state.draft_chat_id] = False
+                    st.session_state.current_chat_id = st.session_state.draft_chat_id
+                    st.session_state.messages = []
+                    st.session_state.last_loaded_chat_id = st.session_state.current_chat_id
+                    st.rerun()
+
+                def _format_chat_option(option_id: str) -> str:
+                    # 1. Draft
+                    if option_id == st.session_state.draft_chat_id:
+                        return "➕ New Chat (Draft)"
                 
-                # 2. Known Title (from session state)
-                title = st.session_state.chat_titles.get(option_id)
-                if title:
-                    return title
+                    # 2. Known Title (from session state)
+                    title = st.session_state.chat_titles.get(option_id)
+                    if title:
+                        return title
                 
-                # 3. Fallback
-                return f"Chat {option_id[:6]}..."
-
-            selected_chat_id = st.selectbox(
-                "Chat",
-                st.session_state.all_sessions,
-                index=(
-                    st.session_state.all_sessions.index(st.session_state.current_chat_id)
-                    if st.session_state.current_chat_id in st.session_state.all_sessions
-                    else 0
-                ),
-                format_func=_format_chat_option,
-                label_visibility="collapsed",
-            )
+                    # 3. Fallback
+                    return f"Chat {option_id[:6]}..."
+
+                selected_chat_id = st.selectbox(
+                    "Chat",
+                    st.session_state.all_sessions,
+                    index=(
+                        st.session_state.all_sessions.index(st.session_state.current_chat_id)
+                        if st.session_state.current_chat_id in st.session_state.all_sessions
+                        else 0
+                    ),
+                    format_func=_format_chat_option,
+                    label_visibility="collapsed",
+                )
         
         if selected_chat_id != st.session_state.current_chat_id:
             st.session_state.current_chat_id = selected_chat_id
             # No explicit rerun needed: widget interaction already reruns the script.
         
-        # --- Per-chat scope selection (Global OR Single Advertiser). Locked after first question. ---
+        # --- Per-chat scope selection (Global, one or several advertisers). Locked after first question. ---
         chat_id = st.session_state.current_chat_id
         locked_scope = st.session_state.chat_scope_lock.get(chat_id)
 
@@ -466,60 +825,8 @@ with st.sidebar:
             st.session_state.chat_scope_lock[chat_id] = {"mode": "global", "legacy": True}
             locked_scope = st.session_state.chat_scope_lock.get(chat_id)
 
-        scope_options = ["🌎 Global"] + advertisers
-
-        with st.expander("Context", expanded=True):
-            if locked_scope and isinstance(locked_scope, dict):
-                locked_mode = locked_scope.get("mode")
-                if locked_mode == "instance" and locked_scope.get("advertiser_name") in advertisers:
-                    selected_scope_label = str(locked_scope.get("advertiser_name"))
-                else:
-                    selected_scope_label = "🌎 Global"
-
-                st.selectbox(
-                    "Advertiser (locked)",
-                    scope_options,
-                    index=scope_options.index(
-                        selected_scope_label if isinstance(selected_scope_label, str) else "🌎 Global"
-                    ),
-                    disabled=True,
-                )
-            else:
-                selected_scope_label = st.selectbox(
-                    "Advertiser (Global = All)",
-                    scope_options,
-                    index=0,
-                    key=f"scope_select_{chat_id}",
-                )
-
-        if not isinstance(selected_scope_label, str) or selected_scope_label == "🌎 Global":
-            selected_advertisers = []
-        else:
-            selected_advertisers = [selected_scope_label]
-
-        # Resolve selected instance IDs (used to scope all AMC queries)
-        selected_instance_ids = []
-        if selected_advertisers and callable(get_instance_ids_by_names_cached):
-            resolved_ids = get_instance_ids_by_names_cached(tuple(selected_advertisers))
-            if isinstance(resolved_ids, (list, tuple, set)):
-                resolved_ids_list = list(resolved_ids)
-            else:
-                resolved_ids_list = []
-            selected_instance_ids = [int(x) for x in resolved_ids_list if isinstance(x, int)]
-        
-        # Logic & Context Handling
-        if not selected_advertisers:
-            st.caption("Context: Global")
-            system_instruction = (
-                "You have access to data for ALL advertisers. "
-                "Do not filter by advertiser unless specifically asked in the user's question."
-            )
-        else:
-            st.caption(f"Context: {', '.join(selected_advertisers)}")
-            system_instruction = (
-                f"SCOPE RESTRICTION: You are strictly limited to the following AMC instances: {selected_advertisers}. "
-                "You MUST scope every query to these instances using `amc_query_execution.amc_instance_id` (or a join to `amc_instance`)."
-            )
+        _render_context(chat_id, advertisers)
+        selected_advertisers, selected_instance_ids, system_instruction = _chat_context(chat_id, advertisers)
 
         with st.expander("Quick actions", expanded=False):
             quick_prompts = [
@@ -541,7 +848,7 @@ with st.sidebar:
                         st.session_state.messages = []
                     scope = _scope_from_selection(selected_advertisers, selected_instance_ids)
                     _lock_chat_scope(st.session_state.current_chat_id, scope)
-                    st.session_state.messages.append({"role": "user", "content": qp})
+                    st.session_state.messages.append({"role": "user", "content": qp, "id": uuid.uuid4().hex})
                     _persist_message_if_needed(
                         st.session_state.current_chat_id,
                         "user",
@@ -550,62 +857,7 @@ with st.sidebar:
                     )
                     st.rerun()
 
-        with st.expander("Advanced", expanded=False):
-            st.caption("Technical details")
-            
-            # --- Custom Instructions ---
-            custom_instructions = st.text_area(
-                "Custom System Instructions",
-                help="Add specific rules, persona details, or constraints for the AI agent.",
-                key="custom_instructions"
-            )
-            
-            if custom_instructions and custom_instructions.strip():
-                system_instruction += f"\n\nADDITIONAL USER INSTRUCTIONS:\n{custom_instructions.strip()}"
-
-            with st.expander("System prompt", expanded=False):
-                st.code(system_instruction, language="text")
-
-            with st.expander("Database schema", expanded=False):
-                schema_info = {
-                "amc_instance": {
-                    "columns": ["amc_instance_id", "company_id", "region_id", "name", "instance_id"],
-                    "description": "Registry of AMC Instances (Advertisers)."
-                },
-                "amc_query_execution": {
-                    "columns": ["amc_query_execution_id", "created_at", "amc_instance_id"],
-                    "description": "Log of executed AMC queries."
-                },
-                "amc_asin_cross_purchase": {
-                    "columns": ["lead_asin", "follow_up_asin", "cross_purchased_count", "avg_days_between_purchases", "amc_query_execution_id"],
-                    "description": "Products purchased together (Lead -> Follow-up)."
-                },
-                "amc_campaign_ntb_metrics": {
-                    "columns": ["campaign_id", "new_to_brand_purchases", "ntb_purchases_percent", "amc_query_execution_id"],
-                    "description": "New-To-Brand metrics by campaign."
-                },
-                
-                "amc_time_to_conversion": {
-                    "columns": ["time_to_conversion_bucket", "purchases", "campaign_id", "amc_query_execution_id"],
-                    "description": "Distribution of days to conversion."
-                },
-                "amc_lifestyle": {
-                    "columns": ["amc_lifestyle_id", "name"],
-                    "description": "Lifestyle segment definitions."
-                },
-                "amc_lifestyle_size": {
-                    "columns": ["size", "amc_lifestyle_id", "amc_query_execution_id"],
-                    "description": "Size of lifestyle segments."
-                },
-                "amc_ntb_gateaway": {
-                    "columns": ["asin", "users_with_purchases", "ntb_users", "amc_query_execution_id"],
-                    "description": "Gateway ASINs driving NTB users."
-                }
-                }
-                st.json(schema_info)
-
-            if st.button("🗑️ Clear current chat"):
-                st.warning("Delete functionality not yet implemented in DB.")
+        _render_advanced(chat_id, advertisers)
     
     else:
         # Visualizer Specific Sidebar
@@ -621,6 +873,10 @@ if page == "Data Visualizer":
     render_visualizer(supabase, advertisers)
     st.stop()
 
+if page == "Usage":
+    render_admin_page(supabase)
+    st.stop()
+
 # ---------------------------------------------------------
 # AMC ASSISTANT CONTENT
 # ---------------------------------------------------------
@@ -639,11 +895,16 @@ if "messages" not in st.session_state or st.session_state.get("last_loaded_chat_
             st.session_state.messages = []
             st.session_state.chat_history_cache[chat_id] = []
             st.session_state.last_loaded_chat_id = chat_id
-        elif chat_id in st.session_state.chat_history_cache:
-            st.session_state.messages = st.session_state.chat_history_cache[chat_id]
+        # One lookup: a membership test followed by `[]` could race the memory monitor's eviction.
+        elif (cached_messages := st.session_state.chat_history_cache.get(chat_id)) is not None:
+            st.session_state.messages = cached_messages
             st.session_state.last_loaded_chat_id = chat_id
         else:
-            raw_history = load_chat_history_cached(chat_id) or load_chat_history(supabase, chat_id)
+            if st.session_state.chat_history_cache.was_evicted(chat_id):
+                # Dropped for space: the cached DB read may predate messages sent since.
+                raw_history = load_chat_history(supabase, chat_id)
+            else:
+                raw_history = load_chat_history_cached(chat_id) or load_chat_history(supabase, chat_id)
             processed_history = []
             for msg in raw_history:
                 if not isinstance(msg, dict):
@@ -694,58 +955,10 @@ current_messages = st.session_state.messages
 
 # Chat title (shown above messages)
 chat_id = st.session_state.current_chat_id
-default_title = st.session_state.chat_titles.get(chat_id)
-if not isinstance(default_title, str) or not default_title.strip():
-    default_title = "New chat" if not st.session_state.chat_persisted.get(chat_id, True) else "Chat"
-default_title = default_title.strip()
-
-st.markdown(f"### {default_title}")
-with st.expander("Rename chat", expanded=False):
-    with st.form(key=f"rename_chat_form_{chat_id}"):
-        new_title = st.text_input("Name", value=default_title)
-        submitted = st.form_submit_button("Save")
-    if submitted:
-        new_title_clean = (new_title or "").strip()
-        if not new_title_clean:
-            st.warning("Chat name cannot be empty.")
-        else:
-            st.session_state.chat_titles[chat_id] = new_title_clean
-            if st.session_state.chat_persisted.get(chat_id, False):
-                update_chat_title(supabase, chat_id, new_title_clean)
-                for fn in (get_all_sessions_cached, load_chat_history_cached):
-                    try:
-                        clear_fn = getattr(fn, "clear", None)
-                        if callable(clear_fn):
-                            clear_fn()
-                    except Exception:
-                        pass
-            st.rerun()
+_render_chat_title(chat_id)
 
 # 2. Mostrar los mensajes del historial al recargar la app
-for message in current_messages:
-    with st.chat_message(message["role"]):
-        st.markdown(message["content"])
-        
-        # Render rich content if available
-        if message.get("sql"):
-            with st.expander("View Generated SQL"):
-                st.code(message["sql"], language="sql")
-        
-        if message.get("data") is not None:
-            st.dataframe(message["data"])
-            
-            # Dynamic Chart Rendering
-            try:
-                chart_config = message.get("chart_config")
-                if chart_config:
-                    if chart_config.get("type") == "bar":
-                        st.bar_chart(message["data"], x=chart_config.get("x"), y=chart_config.get("y"))
-                    elif chart_config.get("type") == "line":
-                        # Fallback check for columns
-                        if chart_config.get("x") in message["data"].columns and chart_config.get("y") in message["data"].columns:
-                            st.line_chart(message["data"], x=chart_config.get("x"), y=chart_config.get("y"))
-            except Exception as e:
-                st.warning(f"Could not render chart: {e}")
+_render_transcript(chat_id)
 
 # Starter Prompts (Only if chat is empty)
 if not current_messages:
@@ -799,7 +1012,7 @@ if not current_messages:
         # Add user message to local state
         scope = _scope_from_selection(selected_advertisers, selected_instance_ids)
         _lock_chat_scope(st.session_state.current_chat_id, scope)
-        st.session_state.messages.append({"role": "user", "content": prompt_to_run})
+        st.session_state.messages.append({"role": "user", "content": prompt_to_run, "id": uuid.uuid4().hex})
         _persist_message_if_needed(
             st.session_state.current_chat_id,
             "user",
@@ -816,7 +1029,7 @@ if prompt := st.chat_input("Type your message here..."):
         st.markdown(prompt)
     
     # Update local state
-    st.session_state.messages.append({"role": "user", "content": prompt})
+    st.session_state.messages.append({"role": "user", "content": prompt, "id": uuid.uuid4().hex})
     
     # Guardar mensaje del usuario en historial
     scope = _scope_from_selection(selected_advertisers, selected_instance_ids)
@@ -829,71 +1042,22 @@ if prompt := st.chat_input("Type your message here..."):
     )
     st.rerun()
 
-# Process Response (if last message is user)
-if st.session_state.messages and st.session_state.messages[-1]["role"] == "user":
-    last_user_msg = st.session_state.messages[-1]["content"]
-    
-    # B. Generar respuesta de la IA (Simulación)
-    with st.chat_message("assistant"):
-        # Call Mock Agent
-        # Pass history excluding the current new message
-        history_to_pass = st.session_state.messages[:-1]
-        response_obj = get_agent_response(
-            client,
-            supabase,
-            system_instruction,
-            last_user_msg,
-            selected_advertisers,
-            date_range,
-            chat_history=history_to_pass,
-            selected_instance_ids=selected_instance_ids,
-        )
-        
-        # Display Text
-        st.markdown(response_obj["text"])
-        
-        # Display SQL
-        if response_obj["sql"]:
-            with st.expander("View Generated SQL"):
-                st.code(response_obj["sql"], language="sql")
-            
-        # Display Data
-        if response_obj["data"] is not None:
-            st.dataframe(response_obj["data"])
-            
-            # Dynamic Chart Rendering
-            try:
-                chart_config = response_obj.get("chart_config")
-                if chart_config:
-                    if chart_config.get("type") == "bar":
-                        st.bar_chart(response_obj["data"], x=chart_config.get("x"), y=chart_config.get("y"))
-                    elif chart_config.get("type") == "line":
-                        if chart_config.get("x") in response_obj["data"].columns and chart_config.get("y") in response_obj["data"].columns:
-                            st.line_chart(response_obj["data"], x=chart_config.get("x"), y=chart_config.get("y"))
-            except Exception as e:
-                st.warning(f"Could not render chart: {e}")
-            
-            # PDF Download Button
-            try:
-                pdf_bytes = generate_pdf_report(last_user_msg, response_obj["text"], response_obj["data"])
-                st.download_button(
-                    label="📄 Download Professional PDF Report",
-                    data=pdf_bytes,
-                    file_name="amc_insight_report.pdf",
-                    mime="application/pdf"
-                )
-            except Exception as e:
-                st.error(f"Could not generate PDF: {e}")
-    
-    # Guardar respuesta completa en historial
-    data_to_save = None
-    if response_obj["data"] is not None:
-        try:
-            data_to_save = response_obj["data"].to_dict(orient="records")
-        except:
-            pass
+def _attach_job_result(chat_id: str, job: dict):
+    """Append a finished job's answer to the chat; only the session that claims the job saves it."""
+    if not st.session_state.messages or st.session_state.messages[-1]["role"] != "user":
+        return
+    claimed = mark_attached(job["id"])
+
+    if job["status"] == "failed":
+        response_obj = {"text": f"⚠️ The request failed: {job['error']}", "sql": None, "data": None, "chart_config": None}
+    else:
+        response_obj = job["result"]
+
+    if response_obj.get("prompt_stats"):
+        st.session_state.last_prompt_stats = response_obj["prompt_stats"]
+    if response_obj.get("timings"):
+        st.session_state.last_timings = response_obj["timings"]
 
-    # Append to local state to prevent re-execution loop
     st.session_state.messages.append({
         "role": "assistant",
         "content": response_obj["text"],
@@ -901,16 +1065,100 @@ if st.session_state.messages and st.session_state.messages[-1]["role"] == "user"
         "data": response_obj["data"],
         "chart_config": response_obj.get("chart_config")
     })
+    # Re-measure this chat now that it holds another answer (may evict older chats).
+    st.session_state.chat_history_cache.put(chat_id, st.session_state.messages)
+    if not claimed:
+        # Another tab of this chat already saved it.
+        return
+
+    # Guardar respuesta completa en historial
+    data_to_save = None
+    if response_obj["data"] is not None:
+        try:
+            data_to_save = response_obj["data"].to_dict(orient="records")
+        except:
+            pass
 
     save_chat_message(
         supabase,
-        st.session_state.current_chat_id,
+        chat_id,
         "assistant",
         response_obj["text"],
         sql_query=response_obj["sql"],
         chart_config=response_obj.get("chart_config"),
         data_snapshot=data_to_save,
     )
-    
-    # Force reload to update UI with new message
-    st.rerun()
+
+
+@measured_fragment("main.pending_answer", run_every=1.0)
+def _render_pending_answer(chat_id: str, job_id: str):
+    """Poll the background job; only this bubble reruns until the answer is attached."""
+    job = get_job(job_id)
+    if job is None:
+        # Lost (server restart or pruned): the next run submits it again.
+        st.rerun()
+    if job["status"] in ("done", "failed"):
+        _attach_job_result(chat_id, job)
+        st.rerun()
+
+    progress = job["progress"]
+    elapsed = time.time() - job["submitted_at"]
+    position = progress.get("queue_position")
+    if position:
+        st.caption(f"⏳ Waiting for the model: position {position} in queue ({elapsed:.0f}s)")
+    else:
+        st.caption(f"Thinking... ({elapsed:.0f}s)")
+
+    # Multi-advertiser scenarios: show each advertiser's rows as soon as they arrive.
+    partials = progress.get("partials") or []
+    if partials:
+        st.caption(" · ".join(f"{advertiser}: {len(df)} rows" for advertiser, df in partials))
+        frames = [df.assign(advertiser=advertiser) for advertiser, df in partials if len(df)]
+        if frames:
+            st.dataframe(pd.concat(frames, ignore_index=True))
+
+
+# Process Response (if last message is user)
+if st.session_state.messages and st.session_state.messages[-1]["role"] == "user":
+    chat_id = st.session_state.current_chat_id
+    # One job per user message: reruns while it is pending never start it again.
+    # Messages reloaded from the database have no id; their content stands in, so a
+    # different question at the same position never picks up an earlier answer.
+    last_message = st.session_state.messages[-1]
+    message_id = last_message.get("id") or hashlib.sha256(str(last_message["content"]).encode("utf-8")).hexdigest()[:16]
+    job_key = f"{chat_id}:{len(st.session_state.messages) - 1}:{message_id}"
+    job_id = find_job(job_key)
+
+    if not job_id:
+        last_user_msg = last_message["content"]
+        partials = []
+
+        def _on_partial(advertiser, result, key=job_key, partials=partials):
+            df = result.get("data")
+            partials.append((advertiser, df if isinstance(df, pd.DataFrame) else pd.DataFrame()))
+            update_job_progress(find_job(key), partials=list(partials))
+
+        job_id = submit_job(
+            job_key,
+            get_agent_response,
+            client,
+            supabase,
+            system_instruction,
+            last_user_msg,
+            selected_advertisers,
+            date_range,
+            # Pass history excluding the current new message
+            chat_history=list(st.session_state.messages[:-1]),
+            selected_instance_ids=selected_instance_ids,
+            usage_context={
+                "auth_user": st.session_state.get("auth_user"),
+                "session_id": chat_id,
+                "scope": _scope_from_selection(selected_advertisers, selected_instance_ids),
+            },
+            on_partial=_on_partial if len(selected_advertisers) > 1 else None,
+            on_queue=lambda position, key=job_key: update_job_progress(find_job(key), queue_position=position),
+            owner=st.session_state.get("auth_user"),
+        )
+
+    with st.chat_message("assistant"):
+        _render_pending_answer(chat_id, job_id)
@@ -0,0 +1,206 @@
+"""End-to-end `get_agent_response` benchmark with recorded Gemini/PostgREST responses.
+
+Record fixtures once against the live services (needs `.streamlit/secrets.toml`):
+
+    python -m benchmarks.bench_agent record
+
+Replay the corpus with the recorded latencies and compare against a previous run:
+
+    python -m benchmarks.bench_agent replay --repeat 5
+    python -m benchmarks.bench_agent replay --baseline benchmarks/results/<commit>.json
+
+Replay results are written to `benchmarks/results/<commit>.json`.
+"""
+import argparse
+import datetime
+import json
+import re
+import statistics
+import subprocess
+from pathlib import Path
+
+import streamlit as st
+
+import modules.database as database
+import modules.local_engine as local_engine
+from benchmarks.replay import Cassette, ReplayGeminiClient, ReplayMiss, ReplaySupabaseClient
+from modules.agent import get_agent_response
+from modules.scenario_cache import invalidate_scenario_cache
+
+ROOT = Path(__file__).resolve().parent
+DEFAULT_CORPUS = ROOT / "corpus.json"
+DEFAULT_FIXTURES = ROOT / "fixtures"
+DEFAULT_RESULTS = ROOT / "results"
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True, cwd=ROOT
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def _fixture_path(fixtures: Path, item: dict) -> Path:
+    return fixtures / f"{re.sub(r'[^A-Za-z0-9_-]+', '_', item['id'])}.json"
+
+
+def _date_range(item: dict):
+    dates = item.get("date_range")
+    return tuple(datetime.date.fromisoformat(d) for d in dates) if dates else None
+
+
+def _run_question(gemini_client, supabase_client, item: dict) -> dict:
+    """One cold request: Streamlit caches and memoized scenarios are cleared first."""
+    st.cache_data.clear()
+    invalidate_scenario_cache()
+    # Cached helpers read the module-level client, so route them through the cassette too.
+    database._get_cached_supabase_client = lambda: supabase_client
+    return get_agent_response(
+        gemini_client,
+        supabase_client,
+        "",
+        item["question"],
+        item.get("advertisers") or [],
+        _date_range(item),
+        selected_instance_ids=item.get("instance_ids") or [],
+    )
+
+
+def record(corpus: list[dict], fixtures: Path) -> None:
+    live_gemini = database.init_gemini()
+    live_supabase = database.init_supabase()
+    if not live_gemini or not live_supabase:
+        raise SystemExit("Live Gemini and Supabase clients are required to record fixtures.")
+
+    for item in corpus:
+        cassette = Cassette()
+        result = _run_question(
+            ReplayGeminiClient(cassette, live_client=live_gemini),
+            ReplaySupabaseClient(cassette, live_client=live_supabase),
+            item,
+        )
+        cassette.save(_fixture_path(fixtures, item), question=item["question"], route=result["route"], commit=_git_commit())
+        print(f"recorded {item['id']:<24} {len(cassette.interactions):>3} calls  {result['timings']['total_ms']:>9.1f} ms")
+
+
+def _percentile(samples: list[float], q: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+def replay(corpus: list[dict], fixtures: Path, repeat: int, latency_scale: float) -> dict:
+    questions = {}
+    for item in corpus:
+        path = _fixture_path(fixtures, item)
+        if not path.exists():
+            print(f"skipped  {item['id']:<24} (no fixture, run `record` first)")
+            continue
+        samples, route, error = [], None, None
+        for _ in range(repeat):
+            cassette = Cassette.load(path)
+            try:
+                result = _run_question(
+                    ReplayGeminiClient(cassette, latency_scale=latency_scale),
+                    ReplaySupabaseClient(cassette, latency_scale=latency_scale),
+                    item,
+                )
+            except ReplayMiss as e:
+                cassette.misses.append(str(e))
+            if cassette.misses:
+                error = f"unrecorded call {cassette.misses[0]}"
+                break
+            route = result["route"]
+            samples.append(result["timings"]["total_ms"])
+        questions[item["id"]] = {"route": route, "samples_ms": samples, "error": error}
+
+    return {
+        "commit": _git_commit(),
+        "created_at": datetime.datetime.now().isoformat(timespec="seconds"),
+        "repeat": repeat,
+        "latency_scale": latency_scale,
+        "questions": questions,
+    }
+
+
+def summarize(run: dict) -> list[dict]:
+    """Per-question and per-route p50/p95 rows."""
+    rows = []
+    by_route: dict[str, list[float]] = {}
+    for qid, q in run["questions"].items():
+        if q["samples_ms"]:
+            by_route.setdefault(q["route"], []).extend(q["samples_ms"])
+            rows.append({"name": qid, "route": q["route"], "n": len(q["samples_ms"]),
+                         "p50": _percentile(q["samples_ms"], 0.5), "p95": _percentile(q["samples_ms"], 0.95),
+                         "mean": statistics.fmean(q["samples_ms"])})
+    for route, samples in sorted(by_route.items()):
+        rows.append({"name": f"[route] {route}", "route": route, "n": len(samples),
+                     "p50": _percentile(samples, 0.5), "p95": _percentile(samples, 0.95),
+                     "mean": statistics.fmean(samples)})
+    return rows
+
+
+def compare(run: dict, baseline: dict, threshold: float) -> list[str]:
+    """Questions whose p50 got slower than the baseline by more than `threshold` (fraction)."""
+    regressions = []
+    for qid, q in run["questions"].items():
+        base = baseline.get("questions", {}).get(qid)
+        if not q["samples_ms"] or not base or not base.get("samples_ms"):
+            continue
+        new_p50, old_p50 = _percentile(q["samples_ms"], 0.5), _percentile(base["samples_ms"], 0.5)
+        if old_p50 and (new_p50 - old_p50) / old_p50 > threshold:
+            regressions.append(f"{qid}: p50 {old_p50:.1f} -> {new_p50:.1f} ms (+{(new_p50 / old_p50 - 1):.0%})")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("mode", choices=["record", "replay"])
+    parser.add_argument("--corpus", type=Path, default=DEFAULT_CORPUS)
+    parser.add_argument("--fixtures", type=Path, default=DEFAULT_FIXTURES)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--latency-scale", type=float, default=1.0, help="0 disables injected latency")
+    parser.add_argument("--local-sql", action="store_true", help="allow the DuckDB engine (records whole-table reads)")
+    parser.add_argument("--out", type=Path, default=None)
+    parser.add_argument("--baseline", type=Path, default=None)
+    parser.add_argument("--threshold", type=float, default=0.10, help="p50 slowdown flagged as a regression")
+    args = parser.parse_args()
+
+    with open(args.corpus, encoding="utf-8") as fh:
+        corpus = json.load(fh)
+
+    if not args.local_sql:
+        # Keep cassettes to the requests a question makes, not table mirroring.
+        local_engine.local_engine_enabled = lambda: False
+
+    if args.mode == "record":
+        record(corpus, args.fixtures)
+        return
+
+    run = replay(corpus, args.fixtures, args.repeat, args.latency_scale)
+    print(f"\n{'name':<32} {'route':<20} {'n':>3} {'p50 ms':>9} {'p95 ms':>9} {'mean ms':>9}")
+    for row in summarize(run):
+        print(f"{row['name']:<32} {str(row['route']):<20} {row['n']:>3} {row['p50']:>9.1f} {row['p95']:>9.1f} {row['mean']:>9.1f}")
+    for qid, q in run["questions"].items():
+        if q["error"]:
+            print(f"! {qid}: {q['error']}")
+
+    out = args.out or DEFAULT_RESULTS / f"{run['commit']}.json"
+    out.parent.mkdir(parents=True, exist_ok=True)
+    with open(out, "w", encoding="utf-8") as fh:
+        json.dump(run, fh, indent=1)
+    print(f"\nWrote {out}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as fh:
+            regressions = compare(run, json.load(fh), args.threshold)
+        print("\nRegressions vs baseline:" if regressions else "\nNo regressions vs baseline.")
+        for line in regressions:
+            print(f"  {line}")
+        if regressions:
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""Compare `flatten_records` against the previous per-row flattening loop.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_flatten
+"""
+import random
+import time
+
+import pandas as pd
+
+from modules.flatten import flatten_records
+
+
+def legacy_flatten(rows):
+    """The one-level loop previously inlined in `get_agent_response`."""
+    flat_data = []
+    for item in rows:
+        flat_item = {}
+        for k, v in item.items():
+            if isinstance(v, dict):
+                for sub_k, sub_v in v.items():
+                    flat_item[f"{k}.{sub_k}"] = sub_v
+            else:
+                flat_item[k] = v
+        flat_data.append(flat_item)
+    return pd.DataFrame(flat_data)
+
+
+def make_rows(n: int, seed: int = 7):
+    """Rows shaped like `amc_lifestyle_size` with two embedded relations."""
+    rng = random.Random(seed)
+    return [
+        {
+            "size": rng.randint(100, 100_000),
+            "amc_lifestyle": {"name": f"Segment {rng.randint(1, 40)}"},
+            "amc_query_execution": {
+                "amc_instance_id": rng.randint(1, 25),
+                "start_date": "2026-01-01",
+                "end_date": "2026-01-31",
+            },
+        }
+        for _ in range(n)
+    ]
+
+
+def _best_of(fn, rows, repeat: int = 3) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn(rows)
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def main():
+    print(f"{'rows':>8}  {'legacy (s)':>11}  {'flatten (s)':>11}  {'speedup':>8}")
+    for n in (10_000, 100_000):
+        rows = make_rows(n)
+        legacy = _best_of(legacy_flatten, rows)
+        new = _best_of(flatten_records, rows)
+        print(f"{n:>8}  {legacy:>11.3f}  {new:>11.3f}  {legacy / new:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
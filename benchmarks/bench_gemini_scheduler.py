@@ -0,0 +1,106 @@
+"""Contention test for the Gemini scheduler against the fake model endpoint.
+
+One "spammer" fires many questions at once while several regular users ask a
+few each. Compares direct calls (no scheduler) with the process-wide scheduler:
+provider 429s, and how long regular users wait behind the spammer.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_gemini_scheduler
+    python -m benchmarks.bench_gemini_scheduler --spam 60 --users 5 --rpm 120 --concurrency 4
+"""
+import argparse
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import modules.model_router as model_router
+from benchmarks.fake_gemini import FakeGeminiClient
+from modules.gemini_scheduler import GeminiScheduler, requester_context
+
+
+class _Unlimited:
+    """Scheduler stand-in for the baseline: no queueing at all."""
+
+    def acquire(self, user, on_queue=None):
+        return 0.0
+
+    def release(self):
+        pass
+
+
+def _workload(spam: int, users: int, per_user: int) -> list[tuple[str, float]]:
+    """(user, start offset in seconds): the spammer bursts at t=0, others trickle in."""
+    jobs = [("spammer", 0.0) for _ in range(spam)]
+    for u in range(users):
+        jobs += [(f"user{u + 1}", 0.2 + 0.5 * i + 0.1 * u) for i in range(per_user)]
+    return jobs
+
+
+def run(scheduler, client, jobs) -> dict:
+    model_router.get_gemini_scheduler = lambda: scheduler
+    latencies: dict[str, list[float]] = {}
+    failures: dict[str, int] = {}
+    lock = threading.Lock()
+    t0 = time.monotonic()
+
+    def _one(user, offset):
+        time.sleep(max(0.0, t0 + offset - time.monotonic()))
+        started = time.monotonic()
+        with requester_context(user):
+            try:
+                model_router.generate_with_fallback(client, "lite", contents="question")
+                ok = True
+            except Exception:
+                ok = False
+        with lock:
+            key = "spammer" if user == "spammer" else "regular"
+            if ok:
+                latencies.setdefault(key, []).append(time.monotonic() - started)
+            else:
+                failures[key] = failures.get(key, 0) + 1
+
+    with ThreadPoolExecutor(max_workers=len(jobs)) as pool:
+        for user, offset in jobs:
+            pool.submit(_one, user, offset)
+    return {"latencies": latencies, "failures": failures, "elapsed": time.monotonic() - t0, "endpoint": dict(client.stats)}
+
+
+def _report(name: str, result: dict) -> None:
+    print(f"\n{name}: {result['elapsed']:.1f}s total, endpoint {result['endpoint']}")
+    for key in ("regular", "spammer"):
+        samples = sorted(result["latencies"].get(key, []))
+        failed = result["failures"].get(key, 0)
+        if samples:
+            p95 = samples[min(len(samples) - 1, int(round(0.95 * (len(samples) - 1))))]
+            print(f"  {key:<8} ok={len(samples):<4} failed={failed:<4} p50={statistics.median(samples):6.2f}s p95={p95:6.2f}s")
+        else:
+            print(f"  {key:<8} ok=0    failed={failed}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--spam", type=int, default=40)
+    parser.add_argument("--users", type=int, default=5)
+    parser.add_argument("--per-user", type=int, default=3)
+    parser.add_argument("--rpm", type=float, default=120, help="scheduler rate (and fake quota)")
+    parser.add_argument("--concurrency", type=int, default=4, help="scheduler concurrency (and fake quota)")
+    parser.add_argument("--latency", type=float, nargs=2, default=[0.3, 0.8])
+    args = parser.parse_args()
+
+    jobs = _workload(args.spam, args.users, args.per_user)
+    # Fallback tiers would retry 429s on another model; keep one tier to see the raw effect.
+    model_router.FALLBACK_TIERS = {tier: [] for tier in model_router.FALLBACK_TIERS}
+
+    def _client():
+        return FakeGeminiClient(latency_s=tuple(args.latency), quota_rpm=int(args.rpm), quota_concurrency=args.concurrency, seed=7)
+
+    _report("direct (no scheduler)", run(_Unlimited(), _client(), jobs))
+    scheduler = GeminiScheduler(rpm=args.rpm, burst=args.concurrency, max_concurrency=args.concurrency)
+    _report("scheduler", run(scheduler, _client(), jobs))
+    print(f"  scheduler status: {scheduler.status()}")
+
+
+if __name__ == "__main__":
+    main()
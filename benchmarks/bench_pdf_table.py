@@ -0,0 +1,84 @@
+"""Throughput of the PDF table renderer on large result sets.
+
+Builds a mixed-type DataFrame (dates, campaign names, integers, floats, a few
+missing values), renders it with `render_table` and reports pages per second,
+rows per second and peak Python memory while rendering. Also times a full
+`generate_pdf_report` (preview + appendix) at the same size.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_pdf_table
+    python -m benchmarks.bench_pdf_table --rows 1000 10000 20000
+"""
+import argparse
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+from fpdf import FPDF
+
+from modules.pdf_generator import PDF_APPENDIX_MAX_ROWS, generate_pdf_report, render_table
+
+
+def _frame(rows: int, seed: int = 7) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame(
+        {
+            "date": pd.Timestamp("2025-01-01") + pd.to_timedelta(rng.integers(0, 365, rows), unit="D"),
+            "campaign_name": np.char.add("Campaign ", rng.integers(1, 400, rows).astype(str)),
+            "impressions": rng.integers(0, 2_000_000, rows),
+            "clicks": rng.integers(0, 20_000, rows),
+            "spend": rng.gamma(2.0, 150.0, rows),
+            "sales": rng.gamma(2.0, 600.0, rows),
+        }
+    )
+    df.loc[rng.random(rows) < 0.02, "sales"] = np.nan
+    return df
+
+
+def _render(df: pd.DataFrame) -> tuple[int, int]:
+    pdf = FPDF()
+    pdf.add_page()
+    drawn = render_table(pdf, df)
+    return drawn, pdf.page_no()
+
+
+def bench_table(rows: int) -> dict:
+    df = _frame(rows)
+    started = time.perf_counter()
+    drawn, pages = _render(df)
+    elapsed = time.perf_counter() - started
+    # Separate pass: tracemalloc slows rendering down a lot.
+    tracemalloc.start()
+    _render(df)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"rows": drawn, "pages": pages, "seconds": elapsed, "peak_mb": peak / 1e6}
+
+
+def bench_report(rows: int) -> float:
+    df = _frame(rows)
+    started = time.perf_counter()
+    generate_pdf_report("Show Spend Trend", "Spend grew steadily over the year.", df)
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=[1_000, 10_000, PDF_APPENDIX_MAX_ROWS])
+    args = parser.parse_args()
+
+    print(f"{'rows':>8} {'pages':>6} {'table s':>8} {'pages/s':>8} {'rows/s':>9} {'peak MB':>8} {'report s':>9}")
+    for rows in args.rows:
+        table = bench_table(rows)
+        report_s = bench_report(rows)
+        print(
+            f"{table['rows']:>8,} {table['pages']:>6} {table['seconds']:>8.2f} "
+            f"{table['pages'] / table['seconds']:>8.1f} {table['rows'] / table['seconds']:>9,.0f} "
+            f"{table['peak_mb']:>8.1f} {report_s:>9.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""Load-test the built-in scenarios on synthetic AMC data in the local DuckDB engine.
+
+Generates `modules.synthetic` datasets at a few sizes, attaches them to the
+DuckDB mirror in place of Supabase, and times each quick-action scenario.
+Needs pandas, numpy and duckdb, but no Supabase or Gemini credentials.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_synthetic
+    python -m benchmarks.bench_synthetic --ads-rows 100000 1000000 5000000 --repeat 5
+"""
+import argparse
+import datetime
+import statistics
+import time
+
+import streamlit as st
+
+import modules.database as database
+import modules.local_engine as local_engine
+from modules.agent import run_scenario
+from modules.precompute import PRECOMPUTED_PROMPTS
+from modules.scenario_cache import invalidate_scenario_cache
+from modules.synthetic import generate_amc_dataset
+
+
+class OfflineSupabaseClient:
+    """Stands in for the Supabase client; any PostgREST call means a scenario left the local engine."""
+
+    def __init__(self):
+        self.calls: list[str] = []
+
+    def table(self, name: str):
+        self.calls.append(name)
+        raise RuntimeError(f"unexpected PostgREST call for {name!r}")
+
+
+def _run(client, prompt: str, instance_ids: list[int], date_range) -> tuple[float, int, str | None]:
+    invalidate_scenario_cache()
+    started = time.perf_counter()
+    result = run_scenario(client, prompt, [], date_range, instance_ids)
+    elapsed = (time.perf_counter() - started) * 1000
+    df = result.get("data")
+    text = str(result.get("text") or "")
+    return elapsed, 0 if df is None else len(df), text if text.startswith("⚠️") else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--ads-rows", type=int, nargs="+", default=[100_000, 1_000_000])
+    parser.add_argument("--executions", type=int, default=2_000)
+    parser.add_argument("--instances", type=int, default=25)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    if local_engine.duckdb is None:
+        raise SystemExit("duckdb is required: pip install duckdb")
+    # No live services: cached helpers see no client and the engine is always on.
+    database._get_cached_supabase_client = lambda: None
+    local_engine.local_engine_enabled = lambda: True
+    client = OfflineSupabaseClient()
+    date_range = (datetime.date(2025, 3, 1), datetime.date(2025, 5, 31))
+
+    for ads_rows in args.ads_rows:
+        started = time.perf_counter()
+        frames = generate_amc_dataset(n_instances=args.instances, n_executions=args.executions, ads_rows=ads_rows)
+        generated_ms = (time.perf_counter() - started) * 1000
+        started = time.perf_counter()
+        local_engine.attach_tables(frames)
+        attached_ms = (time.perf_counter() - started) * 1000
+        total_rows = sum(len(df) for df in frames.values())
+        print(f"\nads_report={ads_rows:,}  total rows={total_rows:,}  "
+              f"generate {generated_ms:,.0f} ms  attach {attached_ms:,.0f} ms")
+        print(f"{'scenario':<28} {'scope':<8} {'rows':>6} {'p50 ms':>9} {'max ms':>9}")
+
+        st.cache_data.clear()
+        for scope, instance_ids in (("global", []), ("1 adv", [1])):
+            for prompt in PRECOMPUTED_PROMPTS:
+                samples, rows, error = [], 0, None
+                for _ in range(args.repeat):
+                    elapsed, rows, error = _run(client, prompt, instance_ids, date_range)
+                    samples.append(elapsed)
+                print(f"{prompt:<28} {scope:<8} {rows:>6} {statistics.median(samples):>9.1f} {max(samples):>9.1f}")
+                if error:
+                    print(f"  ! {error.splitlines()[0]}")
+
+    if client.calls:
+        print(f"\n! {len(client.calls)} scenario queries fell back to PostgREST: {sorted(set(client.calls))}")
+
+
+if __name__ == "__main__":
+    main()
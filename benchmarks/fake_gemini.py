@@ -0,0 +1,85 @@
+"""Local stand-in for the Gemini API, for load tests of the scheduler and the agent.
+
+`FakeGeminiClient` exposes `models.generate_content` like `genai.Client`, answers
+with a valid agent response after a random latency, and enforces a provider-style
+quota (requests per minute and concurrent requests) by raising 429 errors, so
+contention behaves like the real service without spending tokens.
+"""
+import json
+import random
+import threading
+import time
+from collections import deque
+from types import SimpleNamespace
+
+
+class FakeQuotaError(RuntimeError):
+    """Mimics the provider's 429 RESOURCE_EXHAUSTED error."""
+
+
+class _FakeModels:
+    def __init__(self, owner: "FakeGeminiClient"):
+        self._owner = owner
+
+    def generate_content(self, model, config=None, contents=None, **kwargs):
+        return self._owner._generate(model, contents)
+
+
+class FakeGeminiClient:
+    """Drop-in for `genai.Client` with configurable latency, quota and error rate."""
+
+    def __init__(
+        self,
+        latency_s: tuple[float, float] = (0.5, 1.5),
+        quota_rpm: int | None = 60,
+        quota_concurrency: int | None = 8,
+        error_rate: float = 0.0,
+        seed: int | None = None,
+    ):
+        self.latency_s = latency_s
+        self.quota_rpm = quota_rpm
+        self.quota_concurrency = quota_concurrency
+        self.error_rate = error_rate
+        self.models = _FakeModels(self)
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._recent: deque[float] = deque()
+        self._in_flight = 0
+        self.stats = {"calls": 0, "ok": 0, "quota_errors": 0, "errors": 0, "max_in_flight": 0}
+
+    def _admit(self) -> None:
+        now = time.monotonic()
+        with self._lock:
+            self.stats["calls"] += 1
+            while self._recent and now - self._recent[0] > 60:
+                self._recent.popleft()
+            over_rpm = self.quota_rpm is not None and len(self._recent) >= self.quota_rpm
+            over_concurrency = self.quota_concurrency is not None and self._in_flight >= self.quota_concurrency
+            if over_rpm or over_concurrency:
+                self.stats["quota_errors"] += 1
+                raise FakeQuotaError("429 RESOURCE_EXHAUSTED: quota exceeded (fake endpoint)")
+            self._recent.append(now)
+            self._in_flight += 1
+            self.stats["max_in_flight"] = max(self.stats["max_in_flight"], self._in_flight)
+
+    def _generate(self, model, contents):
+        self._admit()
+        try:
+            time.sleep(self._rng.uniform(*self.latency_s))
+            if self._rng.random() < self.error_rate:
+                with self._lock:
+                    self.stats["errors"] += 1
+                raise RuntimeError("500 INTERNAL (fake endpoint)")
+            text = json.dumps({"response_text": f"Fake answer from {model}.", "queries": [], "chart_config": None})
+            with self._lock:
+                self.stats["ok"] += 1
+            return SimpleNamespace(
+                text=text,
+                usage_metadata=SimpleNamespace(
+                    prompt_token_count=len(str(contents)) // 4, candidates_token_count=len(text) // 4,
+                    cached_content_token_count=0,
+                ),
+            )
+        finally:
+            with self._lock:
+                self._in_flight -= 1
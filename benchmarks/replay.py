@@ -0,0 +1,191 @@
+"""Record/replay layer for Gemini and PostgREST calls made by `get_agent_response`.
+
+In record mode the wrappers forward every call to the real clients and keep the
+responses (and how long they took) in a cassette. In replay mode the same calls
+are answered from the cassette, optionally sleeping for the recorded latency so
+end-to-end timings stay realistic. Cassettes are stored as one JSON file per
+benchmark question.
+"""
+import json
+import threading
+import time
+from collections import defaultdict, deque
+from pathlib import Path
+from types import SimpleNamespace
+
+# PostgREST builder methods that change data; never recorded, answered with no rows.
+_WRITE_METHODS = {"insert", "update", "upsert", "delete"}
+_USAGE_FIELDS = ("prompt_token_count", "candidates_token_count", "cached_content_token_count")
+
+
+class ReplayMiss(LookupError):
+    """Raised when a replayed run makes a call the cassette has no answer for."""
+
+
+class Cassette:
+    """Recorded interactions for one question, replayed in order per call key."""
+
+    def __init__(self, interactions: list[dict] | None = None):
+        self._lock = threading.Lock()
+        self.interactions: list[dict] = list(interactions or [])
+        self._queues: dict[str, deque] = defaultdict(deque)
+        # Keys requested during replay without a recording (the agent swallows most errors).
+        self.misses: list[str] = []
+        for item in self.interactions:
+            self._queues[item["key"]].append(item)
+
+    @classmethod
+    def load(cls, path) -> "Cassette":
+        with open(path, encoding="utf-8") as fh:
+            return cls(json.load(fh)["interactions"])
+
+    def save(self, path, **meta) -> None:
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "w", encoding="utf-8") as fh:
+            json.dump({**meta, "interactions": self.interactions}, fh, indent=1, default=str)
+
+    def record(self, key: str, payload: dict, latency_ms: float, error: str | None = None) -> None:
+        with self._lock:
+            self.interactions.append({"key": key, "payload": payload, "latency_ms": latency_ms, "error": error})
+
+    def next(self, key: str) -> dict:
+        """Pop the next recording for `key`; the last one is reused once the queue runs dry."""
+        with self._lock:
+            queue = self._queues.get(key)
+            if not queue:
+                self.misses.append(key)
+                raise ReplayMiss(key)
+            return queue.popleft() if len(queue) > 1 else queue[0]
+
+
+class _Mode:
+    def __init__(self, cassette: Cassette, replay: bool, latency_scale: float):
+        self.cassette = cassette
+        self.replay = replay
+        self.latency_scale = latency_scale
+
+    def call(self, key: str, live_fn, to_payload, from_payload):
+        if self.replay:
+            item = self.cassette.next(key)
+            if self.latency_scale:
+                time.sleep(item["latency_ms"] * self.latency_scale / 1000)
+            if item["error"]:
+                raise RuntimeError(item["error"])
+            return from_payload(item["payload"])
+
+        started = time.perf_counter()
+        try:
+            result = live_fn()
+        except Exception as e:
+            self.cassette.record(key, {}, round((time.perf_counter() - started) * 1000, 2), error=str(e))
+            raise
+        self.cassette.record(key, to_payload(result), round((time.perf_counter() - started) * 1000, 2))
+        return result
+
+
+# --- Gemini -----------------------------------------------------------------
+
+
+def _gemini_payload(response) -> dict:
+    meta = getattr(response, "usage_metadata", None)
+    return {
+        "text": response.text,
+        "usage_metadata": {f: getattr(meta, f, None) for f in _USAGE_FIELDS} if meta is not None else None,
+    }
+
+
+def _gemini_response(payload: dict):
+    meta = payload.get("usage_metadata")
+    return SimpleNamespace(
+        text=payload["text"],
+        usage_metadata=SimpleNamespace(**meta) if meta is not None else None,
+    )
+
+
+class _Models:
+    def __init__(self, live, mode: _Mode):
+        self._live = live
+        self._mode = mode
+
+    def generate_content(self, model, config=None, contents=None, **kwargs):
+        # Not keyed by prompt or model: both change between commits (prompt pruning,
+        # tier routing) while the sequence of model calls for a question does not.
+        return self._mode.call(
+            "gemini",
+            lambda: self._live.models.generate_content(model=model, config=config, contents=contents, **kwargs),
+            _gemini_payload,
+            _gemini_response,
+        )
+
+
+class ReplayGeminiClient:
+    """Drop-in for `genai.Client` exposing `models.generate_content`."""
+
+    def __init__(self, cassette: Cassette, live_client=None, latency_scale: float = 1.0):
+        self.models = _Models(live_client, _Mode(cassette, live_client is None, latency_scale))
+
+
+# --- Supabase / PostgREST -----------------------------------------------------
+
+
+class _Request:
+    """Records a PostgREST builder chain; `execute()` is recorded or replayed."""
+
+    def __init__(self, client: "ReplaySupabaseClient", table: str, chain=()):
+        self._client = client
+        self._table = table
+        self._chain = tuple(chain)
+
+    def __getattr__(self, name):
+        def _method(*args, **kwargs):
+            return _Request(self._client, self._table, self._chain + ((name, args, kwargs),))
+
+        return _method
+
+    def _key(self) -> str:
+        steps = ",".join(f"{name}{json.dumps([args, kwargs], default=str, sort_keys=True)}" for name, args, kwargs in self._chain)
+        return f"postgrest:{self._table}:{steps}"
+
+    def _live_request(self):
+        request = self._client._live.table(self._table)
+        for name, args, kwargs in self._chain:
+            request = getattr(request, name)(*args, **kwargs)
+        return request
+
+    def execute(self):
+        if any(name in _WRITE_METHODS for name, _, _ in self._chain):
+            return SimpleNamespace(data=[], count=None)
+        return self._client._mode.call(
+            self._key(),
+            lambda: self._live_request().execute(),
+            lambda response: {"data": response.data, "count": getattr(response, "count", None)},
+            lambda payload: SimpleNamespace(data=payload["data"], count=payload.get("count")),
+        )
+
+
+class _Session:
+    def __init__(self, client: "ReplaySupabaseClient"):
+        self._client = client
+
+    def get(self, path, **kwargs):
+        mode = self._client._mode
+        return mode.call(
+            f"postgrest-http:{path}",
+            lambda: self._client._live.postgrest.session.get(path, **kwargs),
+            lambda response: {"status_code": response.status_code, "json": response.json()},
+            lambda payload: SimpleNamespace(
+                status_code=payload["status_code"], json=lambda: payload["json"], raise_for_status=lambda: None
+            ),
+        )
+
+
+class ReplaySupabaseClient:
+    """Drop-in for the Supabase client covering `table(...)` chains and the OpenAPI schema request."""
+
+    def __init__(self, cassette: Cassette, live_client=None, latency_scale: float = 1.0):
+        self._live = live_client
+        self._mode = _Mode(cassette, live_client is None, latency_scale)
+        self.postgrest = SimpleNamespace(session=_Session(self))
+
+    def table(self, name: str):
+        return _Request(self, name)
@@ -0,0 +1,143 @@
+import time
+
+import streamlit as st
+import pandas as pd
+
+from modules.chart_renderer import chart_cache_stats
+from modules.database import load_usage_log_cached
+from modules.gemini_scheduler import get_gemini_scheduler
+from modules.jobs import jobs_status
+from modules.local_engine import mirror_status
+from modules.memory_monitor import last_sample, memory_by_user, sample_memory, soft_limits
+from modules.model_router import tier_metrics
+from modules.response_schema import parse_failure_metrics
+from modules.precompute import precompute_status, trigger_precompute
+from modules.scenario_cache import invalidate_scenario_cache, scenario_cache_stats
+from modules.usage import recent_usage, summarize_usage
+
+
+def _load_usage(days: int) -> tuple[pd.DataFrame, str]:
+    """Persisted ledger rows, or this process' in-memory entries when the table is unavailable."""
+    df = load_usage_log_cached(days)
+    if df is not None and not df.empty:
+        return df, f"`amc_usage_log` (last {days} days)"
+    return recent_usage(), "this server process (ledger table unavailable)"
+
+
+def _render_memory_panel():
+    sample = last_sample()
+    if st.button("Measure now"):
+        sample_memory()
+        sample = last_sample()
+    snapshot = sample["snapshot"]
+    if snapshot is None:
+        st.info("The memory monitor has not taken a sample yet.")
+        return
+
+    limits = soft_limits()
+    chats = snapshot["chats"]
+    c1, c2, c3 = st.columns(3)
+    c1.metric("Tracked memory", f"{snapshot['total_bytes'] / 1e6:,.1f} MB")
+    c2.metric("Chat histories", f"{chats['bytes'].sum() / 1e6:,.1f} MB")
+    c3.metric("Caches", f"{snapshot['caches']['bytes'].sum() / 1e6:,.1f} MB")
+    st.caption(
+        f"Sampled {time.strftime('%H:%M:%S', time.localtime(sample['sampled_at']))}. "
+        f"Soft limits: {limits['session_bytes'] / 1e6:,.0f} MB per session, "
+        f"{limits['total_bytes'] / 1e6:,.0f} MB in total (largest entries are evicted first)."
+    )
+
+    st.caption("By user")
+    st.dataframe(memory_by_user(snapshot), use_container_width=True, hide_index=True)
+    st.caption("By chat (cached histories per browser session)")
+    st.dataframe(chats, use_container_width=True, hide_index=True)
+    st.caption("By cache")
+    st.dataframe(snapshot["caches"], use_container_width=True, hide_index=True)
+    if sample["evicted"]:
+        st.caption("Evicted at the last sample")
+        st.dataframe(pd.DataFrame(sample["evicted"]), use_container_width=True, hide_index=True)
+
+
+def render_admin_page(supabase=None):
+    st.title("📈 Usage & Latency")
+    st.caption("Gemini token usage and end-to-end latency per scenario, user and session.")
+
+    days = st.selectbox("Window", [1, 7, 30], index=1, format_func=lambda d: f"Last {d} days")
+    df, source = _load_usage(days)
+    st.caption(f"Source: {source}")
+
+    if df.empty:
+        st.info("No usage recorded yet.")
+        with st.expander("Memory", expanded=False):
+            _render_memory_panel()
+        return
+
+    for col in ("prompt_tokens", "output_tokens", "latency_ms"):
+        df[col] = pd.to_numeric(df[col], errors="coerce").fillna(0) if col in df.columns else 0
+
+    c1, c2, c3, c4 = st.columns(4)
+    c1.metric("Requests", f"{len(df):,}")
+    c2.metric("Prompt tokens", f"{int(df['prompt_tokens'].sum()):,}")
+    c3.metric("Output tokens", f"{int(df['output_tokens'].sum()):,}")
+    c4.metric("p95 latency", f"{df['latency_ms'].quantile(0.95) / 1000:.1f}s")
+
+    tab_route, tab_tier, tab_memo, tab_memory, tab_user, tab_session, tab_raw = st.tabs(
+        ["By scenario", "By model tier", "Scenario cache", "Memory", "By user", "By session", "Raw"]
+    )
+    with tab_route:
+        st.dataframe(summarize_usage(df, by="route"), use_container_width=True, hide_index=True)
+    with tab_tier:
+        st.dataframe(summarize_usage(df, by="tier"), use_container_width=True, hide_index=True)
+        st.caption("Every Gemini attempt in this server process, including timed-out tiers that fell back.")
+        st.dataframe(tier_metrics(), use_container_width=True, hide_index=True)
+        parse = parse_failure_metrics()
+        st.caption(
+            f"Structured output (this process): {parse['responses']} responses, "
+            f"{parse['invalid_rate']:.1%} invalid on first pass, {parse['repaired']} repaired, "
+            f"{parse['failure_rate']:.1%} unusable after repair."
+        )
+        scheduler = get_gemini_scheduler()
+        sched = scheduler.status()
+        st.caption(
+            f"Gemini scheduler: {sched['in_flight']}/{sched['max_concurrency']} in flight, "
+            f"{sched['queued']} queued, {sched['tokens']} tokens at {sched['rpm'] or 'unlimited'} rpm; "
+            f"{sched['granted']} granted, avg wait {sched['avg_wait_ms']} ms (max {sched['max_wait_ms']} ms), "
+            f"{sched['timed_out']} timed out in the queue."
+        )
+        st.dataframe(scheduler.queue_snapshot(), use_container_width=True, hide_index=True)
+    with tab_memo:
+        st.caption("Memoized quick-action results in this server process.")
+        st.dataframe(scenario_cache_stats(), use_container_width=True, hide_index=True)
+        if st.button("Clear scenario cache"):
+            st.success(f"Dropped {invalidate_scenario_cache()} cached results.")
+
+        status = precompute_status()
+        st.caption(
+            f"Precompute: {status['runs']} runs, last started {status['last_started'] or 'never'}"
+            f"{' (running)' if status['running'] else ''}, "
+            f"{status['results']} results in {status['last_seconds'] or 0}s."
+        )
+        for err in status["errors"]:
+            st.warning(err)
+        if st.button("Run precompute now"):
+            trigger_precompute()
+            st.info("Precompute requested.")
+
+        st.caption("Tables mirrored into the local DuckDB engine.")
+        st.dataframe(mirror_status(), use_container_width=True, hide_index=True)
+
+        st.caption("Background agent requests in this server process.")
+        st.dataframe(jobs_status(), use_container_width=True, hide_index=True)
+
+        charts = chart_cache_stats()
+        st.caption(
+            f"PDF chart images: {charts['entries']} cached ({charts['bytes'] / 1e6:.1f} MB), "
+            f"{charts['hits']} hits, {charts['misses']} misses, {charts['failed']} failed."
+        )
+    with tab_memory:
+        _render_memory_panel()
+    with tab_user:
+        st.dataframe(summarize_usage(df, by="auth_user"), use_container_width=True, hide_index=True)
+    with tab_session:
+        st.dataframe(summarize_usage(df, by="session_id"), use_container_width=True, hide_index=True)
+    with tab_raw:
+        st.dataframe(df, use_container_width=True, hide_index=True)
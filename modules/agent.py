@@ -1,34 +1,53 @@
 import pandas as pd
 import random
 import datetime
-import json
 import re
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import ExitStack
 from google.genai import types
 
-from modules.database import get_company_marketplace_ids_for_instance_ids_cached
+from modules.database import get_company_marketplace_ids_for_instance_ids_cached, get_instance_ids_by_names_cached
+from modules.flatten import flatten_records
+from modules.gemini_scheduler import requester_context
+from modules.local_engine import run_local_sql
+from modules.model_router import choose_model_tier, generate_with_fallback, templated_query_plan
+from modules.prefetch import collect_scope_prefetch, start_scope_prefetch
+from modules.query_executor import (
+    describe_query_plan,
+    execute_query_plan,
+    normalize_query_plan,
+    partial_result_warnings,
+)
+from modules.response_schema import (
+    AGENT_RESPONSE_SCHEMA,
+    build_repair_prompt,
+    parse_agent_response,
+    record_parse_outcome,
+)
+from modules.scenario_cache import (
+    MEMOIZED_SCENARIOS,
+    get_scenario_result,
+    scenario_cache_key,
+    store_scenario_result,
+)
+from modules.schema import (
+    CHARS_PER_TOKEN,
+    build_schema_section,
+    get_schema_registry,
+    select_relevant_tables,
+)
+from modules.tracing import bind_trace_context, start_trace, trace_span
+from modules.usage import extract_gemini_usage, record_usage
 
-# Default system instruction
-DEFAULT_SYSTEM_INSTRUCTION = """You are an expert Amazon Marketing Cloud (AMC) Analyst. 
+# System instruction pieces. The schema block between them is assembled per
+# question from `modules.schema` fragments (see `build_system_instruction`).
+_PROMPT_HEADER = """You are an expert Amazon Marketing Cloud (AMC) Analyst. 
 You have access to a Supabase database with the following schema:
 
--- AMC Tables
-1. amc_campaign (campaign_id, name)
-2. amc_chat_history (id, session_id, role, content, sql_query, chart_config, data_snapshot, created_at)
-4. amc_instance (amc_instance_id, company_id, region_id, name, created_at, instance_id)
-5. amc_lifestyle (amc_lifestyle_id, name)
-6. amc_lifestyle_size (amc_lifestyle_size_id, amc_query_execution_id, size, amc_lifestyle_id)
-7. amc_ntb_gateway (amc_ntb_gateaway_api, amc_query_execution_id, users_with_purchase, ntb_users, asin, gateway_asin_rank)
-8. amc_query_execution (amc_query_execution_id, created_at, amc_instance_id, start_date, end_date)
-9. amc_query_execution_company_marketplace (amc_query_execution_company_id, amc_query_execution_id, company_marketplace_id)
-10. amc_sponsored_ads_dsp_overlap (id, amc_query_execution_id, exposure_group, users_that_purchased, unique_reach, total_purchases, total_product_sales)
-11. amc_time_to_conversion (id, amc_query_execution_id, campaign_id, time_to_conversion_bucket, purchases, total_brand_purchases)
-
--- Other Related Tables
-12. ads_report (report_id, company_marketplace_id, start_date, end_date, weekly, asin, clicks, spend, sales, purchases, impressions)
-13. company (company_id, created_at, name)
-14. company_marketplace (company_marketplace_id, company_id, marketplace_id)
-15. marketplace (marketplace_id, country_code, currency_id, region_id, country_name)
-16. region (region_id, endpoint_code, aws_region, name)
+"""
+
+_PROMPT_RULES = """
 
 If the user asks for information that requires querying these tables, and it is NOT one of the standard commands, 
 you must output a JSON object to execute the query dynamically.
@@ -49,11 +68,31 @@ The JSON format must be:
   "chart_config": {"type": "bar", "x": "col1", "y": "col2"}
 }
 
+If answering requires comparing data from more than one table, return "queries" (a list of named
+query objects) instead of "query". They are executed in parallel and merged. Use "join_on" to list the
+column(s) shared by every query to join them on; omit it to stack the results with a "query" column.
+{
+  "response_text": "Brief explanation of what you are showing.",
+  "queries": [
+    {"name": "ntb", "table": "amc_ntb_gateway", "select": "asin, ntb_users", "order_by": "ntb_users", "order_direction": "desc", "limit": 20, "filters": []},
+    {"name": "spend", "table": "ads_report", "select": "asin, spend", "order_by": "spend", "order_direction": "desc", "limit": 20, "filters": []}
+  ],
+  "join_on": ["asin"],
+  "chart_config": {"type": "bar", "x": "asin", "y": "ntb_users"}
+}
+When joined, columns that exist in several queries are renamed to "<name>.<column>".
+
+For totals, averages or counts, add an "aggregate" clause instead of fetching raw rows. It is computed
+on the server; "select" is ignored and "order_by" may use a metric alias:
+"aggregate": {"group_by": ["asin"], "metrics": [{"fn": "sum", "column": "spend", "alias": "total_spend"}]}
+Supported functions: sum, count, avg, min, max. Use {"fn": "count", "alias": "rows"} to count rows.
+Results are capped per table, so always aggregate when the user asks for totals over many rows.
+
 IMPORTANT:
-1. 'query' MUST be an object, NOT a string.
+1. 'query' MUST be an object, NOT a string. Each item of 'queries' MUST be an object with a unique "name".
 2. 'filters' MUST be a list of objects.
 3. For foreign keys, use PostgREST syntax in 'select'. Example: "size, amc_lifestyle(name)".
-4. Supported operators: eq, gt, lt, gte, lte, like, ilike, in.
+4. Supported operators: eq, gt, lt, gte, lte, like, ilike, in. Filter values are strings; for "in" pass a "values" list.
 5. NEVER hallucinate tables. ONLY use the tables listed above.
 6. If the user asks for "lifestyles", query 'amc_lifestyle_size' joined with 'amc_lifestyle'.
 7. If the user explicitly asks for a table view, set "chart_config" to null.
@@ -110,7 +149,92 @@ If no data is needed, set "query" to null.
 Do NOT output markdown code blocks for the JSON. Output raw JSON.
 Keep answers concise and professional."""
 
-def get_agent_response(
+def build_system_instruction(user_query, extra_instruction=None):
+    """Assemble the system instruction with only the schema fragments relevant to `user_query`.
+
+    Returns `(instruction, prompt_stats)` where `prompt_stats` compares the pruned
+    prompt against the one carrying the full schema.
+    """
+    registry = get_schema_registry()
+    tables = select_relevant_tables(user_query, registry)
+
+    extra = f"\n\n{extra_instruction.strip()}" if extra_instruction and extra_instruction.strip() else ""
+    instruction = _PROMPT_HEADER + build_schema_section(tables, registry) + _PROMPT_RULES + extra
+    full_chars = len(_PROMPT_HEADER + build_schema_section(list(registry.keys()), registry) + _PROMPT_RULES + extra)
+    pruned_chars = len(instruction)
+
+    prompt_stats = {
+        "tables": tables,
+        "tables_total": len(registry),
+        "full_chars": full_chars,
+        "pruned_chars": pruned_chars,
+        "full_tokens_est": full_chars // CHARS_PER_TOKEN,
+        "pruned_tokens_est": pruned_chars // CHARS_PER_TOKEN,
+        "reduction_pct": round(100.0 * (full_chars - pruned_chars) / full_chars, 1) if full_chars else 0.0,
+    }
+    return instruction, prompt_stats
+
+def _traced_execute(request, table):
+    """Execute a PostgREST request inside a `supabase` trace span."""
+    with trace_span("supabase", table=table) as span_attrs:
+        response = request.execute()
+        span_attrs["rows"] = len(response.data or [])
+    return response
+
+
+# Built-in command scenarios, matched in order against the lowercased question.
+COMMAND_ROUTES: list[tuple[str, list[str]]] = [
+    ("campaign_audit", ["audit", "wasted", "efficiency"]),
+    ("time_to_conversion", ["time to conversion", "conversion days", "conversion time"]),
+    ("ntb_metrics", ["ntb metrics", "new to brand metrics", "ntb analysis"]),
+    ("query_execution_log", ["query execution log", "system status check", "check system status"]),
+    ("advertisers_list", ["list advertisers", "show instances", "list companies"]),
+    ("spend_trend", ["spend trend", "spend history", "cost evolution"]),
+    ("dashboard", ["performance dashboard", "sales overview", "main dashboard"]),
+    ("overlap", ["overlap", "dsp", "exposure group"]),
+    ("gateway_asins", ["gateway asins", "entry products", "first purchase analysis"]),
+    ("lifestyle_segments", ["lifestyle segments", "lifestyle analysis", "demographic segments"]),
+]
+
+
+# Chart settings for the columns returned by each scenario's `sql_query` when it
+# runs on the local DuckDB mirror (see `modules.local_engine`).
+LOCAL_SQL_CHARTS: dict[str, dict | None] = {
+    "time_to_conversion": {"type": "bar", "x": "time_to_conversion_bucket", "y": "total_purchases"},
+    "ntb_metrics": {"type": "bar", "x": "asin", "y": "ntb_users"},
+    "query_execution_log": None,
+    "advertisers_list": None,
+    "spend_trend": {"type": "line", "x": "start_date", "y": "total_spend"},
+    "dashboard": {"type": "bar", "x": "asin", "y": "total_sales"},
+    "overlap": {"type": "bar", "x": "exposure_group", "y": "unique_reach"},
+    "gateway_asins": {"type": "bar", "x": "asin", "y": "ntb_users"},
+    "lifestyle_segments": {"type": "bar", "x": "name", "y": "size"},
+}
+
+
+def scope_instruction(selected_advertisers) -> str:
+    """System-prompt rule restricting Gemini to the selected advertisers (or allowing all)."""
+    if not selected_advertisers:
+        return (
+            "You have access to data for ALL advertisers. "
+            "Do not filter by advertiser unless specifically asked in the user's question."
+        )
+    return (
+        f"SCOPE RESTRICTION: You are strictly limited to the following AMC instances: {list(selected_advertisers)}. "
+        "You MUST scope every query to these instances using `amc_query_execution.amc_instance_id` (or a join to `amc_instance`)."
+    )
+
+
+def route_command(user_query: str):
+    """Return the name of the built-in scenario matching `user_query`, or None for the Gemini path."""
+    query_lower = user_query.lower()
+    for name, keywords in COMMAND_ROUTES:
+        if any(k in query_lower for k in keywords):
+            return name
+    return None
+
+
+def _agent_response(
     client,
     supabase_client,
     system_instruction,
@@ -119,10 +243,13 @@ def get_agent_response(
     date_range=None,
     chat_history=None,
     selected_instance_ids=None,
+    memo_refresh=False,
+    memo_ttl=None,
 ):
-    """
-    Generates response using Gemini API for text and Mock Logic for data/charts.
-    Returns a dict with: text, sql, data (DataFrame), chart_config (dict)
+    """Body of `get_agent_response`; runs inside the request's trace.
+
+    `memo_refresh` recomputes memoized scenarios instead of reading the cache, and
+    `memo_ttl` sets how long the result is kept (used by `modules.precompute`).
     """
     # --- SPECIAL COMMAND: SUPABASE TEST ---
     if user_query.lower().strip() == "supabase":
@@ -193,15 +320,43 @@ def get_agent_response(
         )
 
     # 2. Command vs Prompt Logic
-    query_lower = user_query.lower()
     sql_query = None
     df = None
     chart_config = None
     ai_text = ""
     is_command = False
+    prompt_stats = None
+    usage = None
+
+    with trace_span("routing") as routing_attrs:
+        route = route_command(user_query)
+        template_query = None
+        if not route and supabase_client:
+            # Plain "show me <table>" lookups are answered without a model call.
+            template_query = templated_query_plan(user_query, get_schema_registry())
+            if template_query:
+                route = "template"
+        routing_attrs["route"] = route or "gemini"
+
+    # Span covering the whole scenario (query + DataFrame post-processing).
+    scenario_stack = ExitStack()
+    if route:
+        scenario_attrs = scenario_stack.enter_context(trace_span(f"scenario.{route}"))
+
+    # Quick actions are memoized per (scenario, instances, date window).
+    memo_key = None
+    memo = None
+    if route in MEMOIZED_SCENARIOS and supabase_client:
+        memo_key = scenario_cache_key(route, selected_instance_ids, start_date_str, end_date_str)
+        memo = None if memo_refresh else get_scenario_result(memo_key)
+        scenario_attrs["memo_hit"] = memo is not None
+
+    if memo is not None:
+        is_command = True
+        ai_text, sql_query, df, chart_config = memo["text"], memo["sql"], memo["data"], memo["chart_config"]
 
     # --- SCENARIO 1: CAMPAIGN AUDIT ---
-    if any(k in query_lower for k in ["audit", "wasted", "efficiency"]):
+    elif route == "campaign_audit":
         is_command = True
         ai_text = "### 🛡️ Campaign Audit\nAnalyzing inefficient campaigns with zero ROAS..."
         sql_query = (
@@ -222,7 +377,7 @@ def get_agent_response(
         chart_config = {"type": "bar", "x": "Campaign Name", "y": "Spend"}
 
     # --- SCENARIO 2: TIME-TO-CONVERSION ---
-    elif any(k in query_lower for k in ["time to conversion", "conversion days", "conversion time"]):
+    elif route == "time_to_conversion":
         is_command = True
         ai_text = "### ⏱️ Time to Conversion Analysis\nHere is the distribution of days taken for users to convert:"
         sql_query = f"""
@@ -238,7 +393,11 @@ ORDER BY total_purchases DESC;
 """
         
         try:
-            if supabase_client:
+            local_df = run_local_sql(sql_query, supabase_client) if supabase_client else None
+            if local_df is not None:
+                df = local_df
+                chart_config = LOCAL_SQL_CHARTS.get(route)
+            elif supabase_client:
                 query = supabase_client.table("amc_time_to_conversion").select(
                     "time_to_conversion_bucket, purchases, amc_query_execution!inner(amc_instance_id, start_date, end_date)"
                 )
@@ -249,7 +408,7 @@ ORDER BY total_purchases DESC;
                 if start_date_str and end_date_str:
                     query = query.lte("amc_query_execution.start_date", end_date_str).gte("amc_query_execution.end_date", start_date_str)
                 
-                response = query.execute()
+                response = _traced_execute(query, "amc_time_to_conversion")
                 if response.data:
                     df = pd.DataFrame(response.data)
                     # Aggregate if needed, assuming raw data might be granular
@@ -273,7 +432,7 @@ ORDER BY total_purchases DESC;
              df = pd.DataFrame()
 
     # --- SCENARIO 3: NEW-TO-BRAND (NTB) METRICS ---
-    elif any(k in query_lower for k in ["ntb metrics", "new to brand metrics", "ntb analysis"]):
+    elif route == "ntb_metrics":
         is_command = True
         ai_text = "### 🆕 New-To-Brand (NTB) Analysis\nTop Gateway ASINs driving new customer acquisition (Source: NTB Gateway):"
         sql_query = f"""
@@ -289,7 +448,11 @@ LIMIT 10;
 """
         
         try:
-            if supabase_client:
+            local_df = run_local_sql(sql_query, supabase_client) if supabase_client else None
+            if local_df is not None:
+                df = local_df
+                chart_config = LOCAL_SQL_CHARTS.get(route)
+            elif supabase_client:
                 query = supabase_client.table("amc_ntb_gateway").select(
                     "asin, ntb_users, users_with_purchase, amc_query_execution!inner(amc_instance_id, start_date, end_date)"
                 )
@@ -300,7 +463,7 @@ LIMIT 10;
                 if start_date_str and end_date_str:
                     query = query.lte("amc_query_execution.start_date", end_date_str).gte("amc_query_execution.end_date", start_date_str)
                 
-                response = query.order("ntb_users", desc=True).limit(10).execute()
+                response = _traced_execute(query.order("ntb_users", desc=True).limit(10), "amc_ntb_gateway")
                 if response.data:
                     df = pd.DataFrame(response.data)
                     chart_config = {"type": "bar", "x": "asin", "y": "ntb_users"}
@@ -327,7 +490,7 @@ LIMIT 10;
     #     ...
 
     # --- SCENARIO 6: QUERY EXECUTION LOG ---
-    elif any(k in query_lower for k in ["query execution log", "system status check", "check system status"]):
+    elif route == "query_execution_log":
         is_command = True
         ai_text = "### 📜 Query Execution Log\nRecent system activity and query status:"
         sql_query = f"""
@@ -342,7 +505,11 @@ LIMIT 20;
 """
         
         try:
-            if supabase_client:
+            local_df = run_local_sql(sql_query, supabase_client) if supabase_client else None
+            if local_df is not None:
+                df = local_df
+                chart_config = LOCAL_SQL_CHARTS.get(route)
+            elif supabase_client:
                 # Using PostgREST syntax for join: select("col, relation(col)")
                 query = supabase_client.table("amc_query_execution").select("created_at, amc_instance(name)")
 
@@ -352,20 +519,15 @@ LIMIT 20;
                 if start_date_str and end_date_str:
                     query = query.lte("start_date", end_date_str).gte("end_date", start_date_str)
 
-                response = query.order("created_at", desc=True).limit(20).execute()
+                response = _traced_execute(query.order("created_at", desc=True).limit(20), "amc_query_execution")
                 if response.data:
                     # Flatten the response because nested dicts don't display well in simple dataframes
-                    flat_data = []
-                    for item in response.data:
-                        inst_name = "Unknown"
-                        if item.get("amc_instance"):
-                            inst_name = item["amc_instance"].get("name", "Unknown")
-                        
-                        flat_data.append({
-                            "created_at": item.get("created_at"),
-                            "instance_name": inst_name
-                        })
-                    df = pd.DataFrame(flat_data)
+                    df = flatten_records(response.data)
+                    if "amc_instance.name" not in df.columns:
+                        df["amc_instance.name"] = None
+                    df = df.rename(columns={"amc_instance.name": "instance_name"})
+                    df["instance_name"] = df["instance_name"].fillna("Unknown")
+                    df = df[["created_at", "instance_name"]]
                     chart_config = None # Table only
                 else:
                     df = pd.DataFrame()
@@ -384,7 +546,7 @@ LIMIT 20;
             df = pd.DataFrame()
 
     # --- SCENARIO 7: ADVERTISERS LIST ---
-    elif any(k in query_lower for k in ["list advertisers", "show instances", "list companies"]):
+    elif route == "advertisers_list":
         is_command = True
         ai_text = "### 🏢 Registered Advertisers\nList of all AMC instances connected to this account:"
         sql_query = """
@@ -394,8 +556,12 @@ LIMIT 20;
         """
         
         try:
-            if supabase_client:
-                response = supabase_client.table("amc_instance").select("amc_instance_id, name, instance_id, region_id").order("name").execute()
+            local_df = run_local_sql(sql_query, supabase_client) if supabase_client else None
+            if local_df is not None:
+                df = local_df
+                chart_config = LOCAL_SQL_CHARTS.get(route)
+            elif supabase_client:
+                response = _traced_execute(supabase_client.table("amc_instance").select("amc_instance_id, name, instance_id, region_id").order("name"), "amc_instance")
                 if response.data:
                     df = pd.DataFrame(response.data)
                     chart_config = None
@@ -418,7 +584,7 @@ LIMIT 20;
             df = pd.DataFrame()
 
     # --- SCENARIO 8: SPEND TREND ---
-    elif any(k in query_lower for k in ["spend trend", "spend history", "cost evolution"]):
+    elif route == "spend_trend":
         is_command = True
         ai_text = "### 📈 Spend Trend Analysis\nDaily spend evolution (Source: Ads Report):"
         sql_query = f"""
@@ -443,7 +609,11 @@ ORDER BY r.start_date ASC;
 """
         
         try:
-            if supabase_client:
+            local_df = run_local_sql(sql_query, supabase_client) if supabase_client else None
+            if local_df is not None:
+                df = local_df
+                chart_config = LOCAL_SQL_CHARTS.get(route)
+            elif supabase_client:
                 # Fetching raw data and aggregating in Pandas. Limit to avoid overload.
                 query = supabase_client.table("ads_report").select("start_date, spend")
 
@@ -463,7 +633,7 @@ ORDER BY r.start_date ASC;
                 if start_date_str and end_date_str:
                      query = query.lte("start_date", end_date_str).gte("end_date", start_date_str)
                 
-                response = query.order("start_date", desc=True).limit(2000).execute()
+                response = _traced_execute(query.order("start_date", desc=True).limit(2000), "ads_report")
                 if response.data:
                     df = pd.DataFrame(response.data)
                     df = df.groupby("start_date", as_index=False)["spend"].sum()
@@ -480,7 +650,7 @@ ORDER BY r.start_date ASC;
             df = pd.DataFrame()
 
     # --- SCENARIO 9: DASHBOARD / PERFORMANCE (Explicit Request) ---
-    elif any(k in query_lower for k in ["performance dashboard", "sales overview", "main dashboard"]):
+    elif route == "dashboard":
         is_command = True
         ai_text = "### 📊 Performance Dashboard\nOverview of Top ASINs by Sales (Source: Ads Report):"
         sql_query = f"""
@@ -509,7 +679,11 @@ LIMIT 20;
 """
         
         try:
-            if supabase_client:
+            local_df = run_local_sql(sql_query, supabase_client) if supabase_client else None
+            if local_df is not None:
+                df = local_df
+                chart_config = LOCAL_SQL_CHARTS.get(route)
+            elif supabase_client:
                 query = supabase_client.table("ads_report").select("asin, spend, sales, impressions")
 
                 if selected_instance_ids:
@@ -528,7 +702,7 @@ LIMIT 20;
                 if start_date_str and end_date_str:
                      query = query.lte("start_date", end_date_str).gte("end_date", start_date_str)
                 
-                response = query.limit(2000).execute()
+                response = _traced_execute(query.limit(2000), "ads_report")
                 if response.data:
                     df = pd.DataFrame(response.data)
                     df = df.groupby("asin", as_index=False)[["spend", "sales", "impressions"]].sum()
@@ -545,7 +719,7 @@ LIMIT 20;
             df = pd.DataFrame()
 
     # --- SCENARIO 12: OVERLAP ANALYSIS (New) ---
-    elif any(k in query_lower for k in ["overlap", "dsp", "exposure group"]):
+    elif route == "overlap":
         is_command = True
         ai_text = "### 🔀 Media Overlap Analysis\nImpact of different ad exposure groups (Sponsored Ads vs DSP):"
         sql_query = f"""
@@ -563,7 +737,11 @@ ORDER BY o.unique_reach DESC;
 """
         
         try:
-            if supabase_client:
+            local_df = run_local_sql(sql_query, supabase_client) if supabase_client else None
+            if local_df is not None:
+                df = local_df
+                chart_config = LOCAL_SQL_CHARTS.get(route)
+            elif supabase_client:
                 query = supabase_client.table("amc_sponsored_ads_dsp_overlap").select(
                     "exposure_group, unique_reach, users_that_purchased, total_product_sales, amc_query_execution!inner(amc_instance_id, start_date, end_date)"
                 )
@@ -574,7 +752,7 @@ ORDER BY o.unique_reach DESC;
                 if start_date_str and end_date_str:
                     query = query.lte("amc_query_execution.start_date", end_date_str).gte("amc_query_execution.end_date", start_date_str)
                 
-                response = query.order("unique_reach", desc=True).execute()
+                response = _traced_execute(query.order("unique_reach", desc=True), "amc_sponsored_ads_dsp_overlap")
                 if response.data:
                     df = pd.DataFrame(response.data)
                     chart_config = {"type": "bar", "x": "exposure_group", "y": "unique_reach"}
@@ -588,7 +766,7 @@ ORDER BY o.unique_reach DESC;
             df = pd.DataFrame()
 
     # --- SCENARIO 10: GATEWAY ASINS (New Table) ---
-    elif any(k in query_lower for k in ["gateway asins", "entry products", "first purchase analysis"]):
+    elif route == "gateway_asins":
         is_command = True
         ai_text = "### 🚪 Gateway ASINs\nProducts that most frequently drive new-to-brand customers:"
         sql_query = f"""
@@ -604,7 +782,11 @@ LIMIT 10;
 """
         
         try:
-            if supabase_client:
+            local_df = run_local_sql(sql_query, supabase_client) if supabase_client else None
+            if local_df is not None:
+                df = local_df
+                chart_config = LOCAL_SQL_CHARTS.get(route)
+            elif supabase_client:
                 query = supabase_client.table("amc_ntb_gateway").select(
                     "asin, ntb_users, users_with_purchase, amc_query_execution!inner(amc_instance_id, start_date, end_date)"
                 )
@@ -615,7 +797,7 @@ LIMIT 10;
                 if start_date_str and end_date_str:
                     query = query.lte("amc_query_execution.start_date", end_date_str).gte("amc_query_execution.end_date", start_date_str)
                 
-                response = query.order("ntb_users", desc=True).limit(10).execute()
+                response = _traced_execute(query.order("ntb_users", desc=True).limit(10), "amc_ntb_gateway")
                 if response.data:
                     df = pd.DataFrame(response.data)
                     chart_config = {"type": "bar", "x": "asin", "y": "ntb_users"}
@@ -629,7 +811,7 @@ LIMIT 10;
             df = pd.DataFrame()
 
     # --- SCENARIO 11: LIFESTYLE SEGMENTS (New Table) ---
-    elif any(k in query_lower for k in ["lifestyle segments", "lifestyle analysis", "demographic segments"]):
+    elif route == "lifestyle_segments":
         is_command = True
         ai_text = "### 🧘 Lifestyle Segments\nSize of different lifestyle audiences:"
         sql_query = f"""
@@ -647,7 +829,11 @@ ORDER BY s.size DESC;
 """
         
         try:
-            if supabase_client:
+            local_df = run_local_sql(sql_query, supabase_client) if supabase_client else None
+            if local_df is not None:
+                df = local_df
+                chart_config = LOCAL_SQL_CHARTS.get(route)
+            elif supabase_client:
                 query = supabase_client.table("amc_lifestyle_size").select(
                     "size, amc_lifestyle(name), amc_query_execution!inner(amc_instance_id, start_date, end_date)"
                 )
@@ -658,16 +844,14 @@ ORDER BY s.size DESC;
                 if start_date_str and end_date_str:
                     query = query.lte("amc_query_execution.start_date", end_date_str).gte("amc_query_execution.end_date", start_date_str)
                 
-                response = query.order("size", desc=True).execute()
+                response = _traced_execute(query.order("size", desc=True), "amc_lifestyle_size")
                 if response.data:
-                    flat_data = []
-                    for item in response.data:
-                        l_name = "Unknown"
-                        if item.get("amc_lifestyle"):
-                            l_name = item["amc_lifestyle"].get("name", "Unknown")
-                        flat_data.append({"segment": l_name, "size": item.get("size")})
-                    
-                    df = pd.DataFrame(flat_data)
+                    df = flatten_records(response.data)
+                    if "amc_lifestyle.name" not in df.columns:
+                        df["amc_lifestyle.name"] = None
+                    df = df.rename(columns={"amc_lifestyle.name": "segment"})
+                    df["segment"] = df["segment"].fillna("Unknown")
+                    df = df[["segment", "size"]]
                     chart_config = {"type": "bar", "x": "segment", "y": "size"}
                 else:
                     df = pd.DataFrame()
@@ -678,6 +862,31 @@ ORDER BY s.size DESC;
             print(f"Error fetching Lifestyle Segments: {e}")
             df = pd.DataFrame()
 
+    # --- TEMPLATED LOOKUP (no model call) ---
+    elif route == "template":
+        is_command = True
+        ai_text = f"### 🔎 `{template_query['table']}`\nLatest rows from `{template_query['table']}`."
+        scope, _ = collect_scope_prefetch(
+            start_scope_prefetch(selected_instance_ids, start_date_str, end_date_str, user_query)
+        )
+        df, query_timings, merge = execute_query_plan(supabase_client, [template_query], scope=scope)
+        sql_query = describe_query_plan([template_query], merge, query_timings)
+        for timing in query_timings:
+            if timing.get("error"):
+                ai_text += f"\n\n⚠️ Error executing templated query: {timing['error']}"
+        for warning in partial_result_warnings(query_timings):
+            ai_text += f"\n\n{warning}"
+
+    # Empty frames are not memoized: the scenarios also return them on query errors.
+    if memo_key and memo is None and isinstance(df, pd.DataFrame) and not df.empty:
+        store_scenario_result(
+            memo_key,
+            {"text": ai_text, "sql": sql_query, "data": df.copy(), "chart_config": chart_config},
+            ttl_seconds=memo_ttl,
+        )
+
+    scenario_stack.close()
+
     # 3. Fallback to Gemini (Prompt Mode with Dynamic Query)
     if not is_command:
         try:
@@ -700,102 +909,100 @@ ORDER BY s.size DESC;
 
                 full_prompt = f"{history_text}\nUSER QUERY: {user_query}\n\n[Context: User is analyzing data for {context_msg} during {date_msg}.]"
                 
-                instruction = system_instruction if system_instruction else DEFAULT_SYSTEM_INSTRUCTION
+                # Only the schema fragments relevant to this question are sent;
+                # caller-provided instructions (scope, custom rules) are appended.
+                with trace_span("prompt_build"):
+                    instruction, prompt_stats = build_system_instruction(user_query, system_instruction)
+                print(
+                    f"System prompt: {prompt_stats['pruned_chars']} chars "
+                    f"({len(prompt_stats['tables'])}/{prompt_stats['tables_total']} tables, "
+                    f"-{prompt_stats['reduction_pct']}% vs full schema)"
+                )
                 
-                # Request JSON response
-                response = client.models.generate_content(
-                    model="gemini-2.5-flash",
-                    config=types.GenerateContentConfig(
-                        system_instruction=instruction,
-                        response_mime_type="application/json" 
-                    ),
-                    contents=full_prompt
+                # Resolve the chat scope while Gemini is generating the plan.
+                scope_future = None
+                if supabase_client and selected_instance_ids:
+                    scope_future = start_scope_prefetch(
+                        selected_instance_ids, start_date_str, end_date_str, user_query
+                    )
+
+                # Pick the model tier from the question's complexity.
+                with trace_span("model_routing") as tier_attrs:
+                    tier, complexity, signals = choose_model_tier(user_query, chat_history)
+                    tier_attrs.update(tier=tier, complexity=complexity, **signals)
+
+                # Request JSON matching the response schema (falls back to another tier on timeout)
+                gemini_started = time.perf_counter()
+                gen_config = types.GenerateContentConfig(
+                    system_instruction=instruction,
+                    response_mime_type="application/json",
+                    response_schema=AGENT_RESPONSE_SCHEMA,
                 )
+                response, attempts = generate_with_fallback(client, tier, config=gen_config, contents=full_prompt)
+                usage = {
+                    "model": attempts[-1]["model"],
+                    "tier": attempts[-1]["tier"],
+                    "complexity": complexity,
+                    "fallback_from": tier if len(attempts) > 1 else None,
+                    **extract_gemini_usage(response),
+                }
                 
                 raw_response = response.text
                 
-                # Parse JSON
-                try:
-                    # Clean up markdown code blocks if present (despite instructions)
-                    clean_json = raw_response.strip()
-                    if clean_json.startswith("```json"):
-                        clean_json = clean_json[7:]
-                    if clean_json.endswith("```"):
-                        clean_json = clean_json[:-3]
-                    
-                    response_json = json.loads(clean_json)
-                    
-                    if not isinstance(response_json, dict):
-                        # Handle case where JSON is a list or primitive
-                        ai_text = str(response_json)
-                        query_obj = None
-                        chart_config = None
-                    else:
-                        ai_text = response_json.get("response_text", "")
-                        query_obj = response_json.get("query")
-                        chart_config = response_json.get("chart_config")
-                    
-                    # Execute Dynamic Query
-                    if query_obj and isinstance(query_obj, dict) and supabase_client:
-                        try:
-                            table = query_obj.get("table")
-                            select = query_obj.get("select", "*")
-                            order_by = query_obj.get("order_by")
-                            order_dir = query_obj.get("order_direction", "desc")
-                            limit = query_obj.get("limit", 10)
-                            filters = query_obj.get("filters", [])
-                            
-                            q = supabase_client.table(table).select(select)
-                            
-                            if isinstance(filters, list):
-                                for f in filters:
-                                    if isinstance(f, dict):
-                                        col = f.get("column")
-                                        op = f.get("operator")
-                                        val = f.get("value")
-                                        
-                                        if col and op:
-                                            if op == "eq": q = q.eq(col, val)
-                                            elif op == "gt": q = q.gt(col, val)
-                                            elif op == "lt": q = q.lt(col, val)
-                                            elif op == "gte": q = q.gte(col, val)
-                                            elif op == "lte": q = q.lte(col, val)
-                                            elif op == "like": q = q.like(col, val)
-                                            elif op == "ilike": q = q.ilike(col, val)
-                                            elif op == "in": q = q.in_(col, val)
-                                
-                            if order_by:
-                                q = q.order(order_by, desc=(order_dir == "desc"))
-                            
-                            if limit:
-                                q = q.limit(limit)
-                                
-                            res = q.execute()
-                            if res.data:
-                                # Flatten nested JSON responses (e.g. amc_lifestyle: {name: ...})
-                                flat_data = []
-                                for item in res.data:
-                                    flat_item = {}
-                                    for k, v in item.items():
-                                        if isinstance(v, dict):
-                                            for sub_k, sub_v in v.items():
-                                                flat_item[f"{k}.{sub_k}"] = sub_v
-                                        else:
-                                            flat_item[k] = v
-                                    flat_data.append(flat_item)
-                                
-                                df = pd.DataFrame(flat_data)
-                                sql_query = f"-- Dynamic Query Generated by Gemini\n-- Table: {table}\n-- Filters: {filters}"
-                            else:
-                                df = pd.DataFrame()
-                                
-                        except Exception as e:
-                            ai_text += f"\n\n⚠️ Error executing dynamic query: {str(e)}"
-                            df = pd.DataFrame()
-                    
-                except json.JSONDecodeError:
-                    # Fallback if JSON parsing fails (model returned text)
-                    ai_text = raw_response
+                # Parse and validate, with a single repair pass on failure
+                with trace_span("json_parse") as parse_attrs:
+                    response_json, parse_errors = parse_agent_response(raw_response)
+                    parse_attrs["errors"] = len(parse_errors)
+                parse_status = "ok"
+                if parse_errors:
+                    print(f"Invalid Gemini response ({'; '.join(parse_errors)}); asking for a repair")
+                    try:
+                        with trace_span("json_repair"):
+                            repair, _ = generate_with_fallback(
+                                client,
+                                usage["tier"],
+                                config=gen_config,
+                                contents=build_repair_prompt(full_prompt, raw_response, parse_errors),
+                            )
+                        for key, value in extract_gemini_usage(repair).items():
+                            usage[key] += value
+                        raw_response = repair.text
+                        response_json, parse_errors = parse_agent_response(raw_response)
+                    except Exception as e:
+                        print(f"Repair pass failed: {e}")
+                    parse_status = "failed" if parse_errors else "repaired"
+                record_parse_outcome(parse_status)
+                usage["parse_status"] = parse_status
+                usage["gemini_ms"] = round((time.perf_counter() - gemini_started) * 1000, 2)
+                
+                if parse_errors:
+                    # Still invalid: show the model's explanation (or raw text) without running anything
+                    text = response_json.get("response_text") if isinstance(response_json, dict) else None
+                    ai_text = text if isinstance(text, str) else raw_response
+                    queries, join_on = [], []
+                    chart_config = None
+                else:
+                    ai_text = response_json.get("response_text", "")
+                    queries, join_on = normalize_query_plan(response_json)
+                    chart_config = response_json.get("chart_config")
+                
+                # Execute Dynamic Query (one or more, concurrently)
+                if queries and supabase_client:
+                    with trace_span("scope_resolution") as scope_attrs:
+                        scope, prefetch_ready = collect_scope_prefetch(scope_future)
+                        scope_attrs["prefetch_ready"] = prefetch_ready
+                    if scope:
+                        print(
+                            f"Scope prefetch: {scope['seconds']}s, "
+                            f"{'ready' if prefetch_ready else 'waited'} when the plan arrived"
+                        )
+                    df, query_timings, merge = execute_query_plan(supabase_client, queries, join_on, scope=scope)
+                    sql_query = describe_query_plan(queries, merge, query_timings)
+                    for timing in query_timings:
+                        if timing.get("error"):
+                            ai_text += f"\n\n⚠️ Error executing dynamic query `{timing['name']}`: {timing['error']}"
+                    for warning in partial_result_warnings(query_timings):
+                        ai_text += f"\n\n{warning}"
                     
             else:
                 ai_text = "⚠️ Gemini API Key not found or client not initialized. Please check your secrets."
@@ -806,9 +1013,205 @@ ORDER BY s.size DESC;
         "text": ai_text,
         "sql": sql_query,
         "data": df,
-        "chart_config": chart_config
+        "chart_config": chart_config,
+        "prompt_stats": prompt_stats,
+        "route": route or "gemini",
+        "usage": usage,
+    }
+
+
+# Advertisers queried at once when a chat is scoped to several of them.
+MAX_PARALLEL_SCOPES = 6
+# Column added to multi-advertiser results to tell the advertisers apart.
+ADVERTISER_COLUMN = "advertiser"
+
+
+def _advertiser_scopes(selected_advertisers) -> dict[str, list[int]]:
+    """Map each selected advertiser to its AMC instance ids (advertisers without instances are left out)."""
+    scopes = {}
+    for name in selected_advertisers:
+        ids = get_instance_ids_by_names_cached((name,)) or []
+        if ids:
+            scopes[name] = [int(i) for i in ids]
+    return scopes
+
+
+def merge_scope_results(results: dict[str, dict], advertisers: list[str]) -> dict:
+    """Combine per-advertiser scenario results into one comparison result.
+
+    Rows are tagged with `ADVERTISER_COLUMN` and concatenated in `advertisers`
+    order; the chart is colored by advertiser.
+    """
+    done = [name for name in advertisers if name in results]
+    first = results[done[0]] if done else {}
+
+    frames, empty = [], []
+    for name in done:
+        df = results[name].get("data")
+        if isinstance(df, pd.DataFrame) and not df.empty:
+            df = df.drop(columns=[ADVERTISER_COLUMN], errors="ignore")
+            df.insert(0, ADVERTISER_COLUMN, name)
+            frames.append(df)
+        else:
+            empty.append(name)
+    merged = pd.concat(frames, ignore_index=True) if frames else None
+
+    # Scenario headers are the same for every advertiser; warnings are listed per advertiser below.
+    header = "\n".join(line for line in str(first.get("text") or "").splitlines() if "⚠️" not in line)
+    lines = [header, f"Compared across: {', '.join(done)}."]
+    if empty:
+        lines.append(f"No data for: {', '.join(empty)}.")
+    missing = [name for name in advertisers if name not in results]
+    if missing:
+        lines.append(f"No AMC instance found for: {', '.join(missing)}.")
+    for name in done:
+        for line in str(results[name].get("text") or "").splitlines():
+            if "⚠️" in line:
+                lines.append(f"{name}: {line.strip()}")
+
+    sql = "\n\n".join(f"-- Advertiser: {name}\n{results[name]['sql']}" for name in done if results[name].get("sql"))
+    chart_config = next((dict(results[name]["chart_config"]) for name in done if results[name].get("chart_config")), None)
+    if chart_config and merged is not None:
+        chart_config["color"] = ADVERTISER_COLUMN
+
+    return {
+        "text": "\n\n".join(line for line in lines if line),
+        "sql": sql or None,
+        "data": merged,
+        "chart_config": chart_config,
+        "prompt_stats": None,
+        "route": first.get("route"),
+        "usage": None,
     }
 
+
+def _fan_out_scopes(supabase_client, user_query, selected_advertisers, scopes, date_range, on_partial=None):
+    """Run a built-in scenario for each advertiser concurrently and merge the results.
+
+    `on_partial(advertiser, result)` is called on the calling thread as each
+    advertiser finishes, so the UI can show results before the slowest one.
+    """
+
+    def _run(name, instance_ids):
+        with trace_span("scope", advertiser=name, instances=len(instance_ids)):
+            return _agent_response(
+                None, supabase_client, "", user_query, [name],
+                date_range=date_range, selected_instance_ids=instance_ids,
+            )
+
+    results: dict[str, dict] = {}
+    run = bind_trace_context(_run)
+    workers = min(MAX_PARALLEL_SCOPES, len(scopes))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="amc-scope") as pool:
+        futures = {pool.submit(run, name, ids): name for name, ids in scopes.items()}
+        for future in as_completed(futures):
+            name = futures[future]
+            try:
+                results[name] = future.result()
+            except Exception as e:
+                results[name] = {"text": f"⚠️ Error querying {name}: {e}", "sql": None, "data": None, "chart_config": None}
+            if on_partial:
+                try:
+                    on_partial(name, results[name])
+                except Exception as e:
+                    print(f"Partial result callback failed: {e}")
+
+    with trace_span("merge", scopes=len(results)):
+        return merge_scope_results(results, list(selected_advertisers))
+
+
+def get_agent_response(
+    client,
+    supabase_client,
+    system_instruction,
+    user_query,
+    selected_advertisers,
+    date_range=None,
+    chat_history=None,
+    selected_instance_ids=None,
+    usage_context=None,
+    on_partial=None,
+    on_queue=None,
+):
+    """
+    Generates response using Gemini API for text and Mock Logic for data/charts.
+    Returns a dict with: text, sql, data (DataFrame), chart_config (dict), prompt_stats,
+    route, usage (Gemini model/tokens/latency, None for scenarios) and timings (the
+    per-stage trace spans of this request).
+
+    `usage_context` (auth_user, session_id, scope) is stored with the request in the
+    usage ledger (see `modules.usage`).
+
+    With several advertisers selected, per-instance scenarios run once per advertiser
+    concurrently and are merged into one table with an `advertiser` column;
+    `on_partial(advertiser, result)` receives each advertiser's result as it lands.
+    Gemini questions are planned once over all the selected instances.
+
+    Gemini calls wait for a slot in the process-wide scheduler, queued fairly per
+    `usage_context["auth_user"]`; `on_queue(position)` reports the queue position.
+    """
+    context = usage_context or {}
+    requester = context.get("auth_user") or context.get("session_id")
+    with requester_context(requester, on_queue), start_trace("get_agent_response") as tracer:
+        scopes = {}
+        if supabase_client and len(selected_advertisers or []) > 1 and route_command(user_query) in MEMOIZED_SCENARIOS:
+            with trace_span("scope_split", advertisers=len(selected_advertisers)):
+                scopes = _advertiser_scopes(selected_advertisers)
+        if scopes:
+            result = _fan_out_scopes(supabase_client, user_query, selected_advertisers, scopes, date_range, on_partial)
+        else:
+            result = _agent_response(
+                client,
+                supabase_client,
+                system_instruction,
+                user_query,
+                selected_advertisers,
+                date_range=date_range,
+                chat_history=chat_history,
+                selected_instance_ids=selected_instance_ids,
+            )
+    result["timings"] = {"total_ms": tracer.total_ms(), "spans": tracer.timings()}
+
+    # The connection-test shortcut returns before routing.
+    result.setdefault("route", "supabase_test")
+    usage = result.get("usage") or {}
+    record_usage(
+        {
+            "auth_user": context.get("auth_user"),
+            "session_id": context.get("session_id"),
+            "scope": context.get("scope"),
+            "route": result["route"],
+            "model": usage.get("model"),
+            "tier": usage.get("tier"),
+            "complexity": usage.get("complexity"),
+            "fallback_from": usage.get("fallback_from"),
+            "parse_status": usage.get("parse_status"),
+            "prompt_tokens": usage.get("prompt_tokens", 0),
+            "output_tokens": usage.get("output_tokens", 0),
+            "cached_tokens": usage.get("cached_tokens", 0),
+            "latency_ms": result["timings"]["total_ms"],
+            "gemini_ms": usage.get("gemini_ms"),
+            "cache_hit": usage.get("cached_tokens", 0) > 0,
+            "ok": not str(result.get("text") or "").startswith("⚠️"),
+        },
+        supabase_client=supabase_client,
+    )
+    return result
+
+def run_scenario(supabase_client, user_query, selected_advertisers, date_range, selected_instance_ids, memo_ttl=None):
+    """Recompute a built-in scenario and refresh its memoized result (no Gemini, no usage record)."""
+    return _agent_response(
+        None,
+        supabase_client,
+        "",
+        user_query,
+        selected_advertisers,
+        date_range=date_range,
+        selected_instance_ids=selected_instance_ids,
+        memo_refresh=True,
+        memo_ttl=memo_ttl,
+    )
+
 def get_advertisers(supabase_client):
     """Fetch distinct advertiser names from Supabase."""
     try:
@@ -0,0 +1,261 @@
+"""Batch report mode: the same question set for many advertisers, without the chat UI.
+
+Run from the repository root (needs `.streamlit/secrets.toml`):
+
+    python -m modules.batch_report --questions weekly_pack.txt --all-advertisers --days 7
+    python -m modules.batch_report --questions weekly_pack.txt --advertisers "Brand A" "Brand B"
+
+Writes `combined.csv` (and `combined.parquet` when pyarrow is installed), one PDF
+per advertiser and `stats.json` into the output directory.
+"""
+import argparse
+import datetime
+import json
+import re
+import statistics
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+
+import pandas as pd
+
+from modules.agent import get_agent_response, route_command, scope_instruction
+from modules.database import get_advertisers_cached, get_instance_ids_by_names_cached, init_gemini, init_supabase
+from modules.pdf_generator import generate_pdf_pack
+
+# Jobs run on threads: they wait on Gemini/PostgREST and share the process caches.
+# The pool size caps concurrent Supabase load. Gemini jobs are spaced by their own
+# RPM budget on top of the process-wide scheduler, leaving room for chat users.
+BATCH_MAX_WORKERS = 4
+BATCH_GEMINI_RPM = 30
+BATCH_RETRIES = 1
+BATCH_RETRY_BACKOFF_SECONDS = 5
+
+
+class RateLimiter:
+    """Spaces calls evenly so at most `per_minute` start in any minute (thread-safe)."""
+
+    def __init__(self, per_minute: float):
+        self._interval = 60.0 / per_minute if per_minute else 0.0
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self) -> float:
+        """Block until the next slot; returns the seconds waited."""
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next)
+            self._next = slot + self._interval
+        wait = slot - now
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+
+def _is_failure(result: dict) -> bool:
+    return str(result.get("text") or "").startswith("⚠️")
+
+
+def _run_job(client, supabase_client, advertiser, instance_ids, question, date_range, limiter, run_id, retries):
+    """One (advertiser, question) pair, retried on errors. Returns a job record."""
+    job = {"advertiser": advertiser, "question": question, "attempts": 0, "waited_s": 0.0, "error": None}
+    started = time.perf_counter()
+    # Built-in scenarios never call Gemini, so only prompt-mode questions take a slot.
+    uses_gemini = route_command(question) is None
+    for attempt in range(retries + 1):
+        job["attempts"] = attempt + 1
+        if uses_gemini:
+            job["waited_s"] += limiter.acquire()
+        try:
+            result = get_agent_response(
+                client,
+                supabase_client,
+                scope_instruction([advertiser]),
+                question,
+                [advertiser],
+                date_range,
+                selected_instance_ids=instance_ids,
+                usage_context={"auth_user": "batch", "session_id": f"batch-{run_id}", "scope": {"mode": "instance", "advertiser_name": advertiser}},
+            )
+        except Exception as e:
+            result = {"text": f"⚠️ {e}", "sql": None, "data": None, "route": None}
+        if not _is_failure(result):
+            break
+        if attempt < retries:
+            time.sleep(BATCH_RETRY_BACKOFF_SECONDS * (attempt + 1))
+
+    job.update(
+        route=result.get("route"),
+        text=result.get("text") or "",
+        data=result.get("data"),
+        chart_config=result.get("chart_config"),
+        seconds=round(time.perf_counter() - started, 2),
+        error=(result.get("text") or "").splitlines()[0] if _is_failure(result) else None,
+    )
+    return job
+
+
+def _safe_name(name: str) -> str:
+    return re.sub(r"[^A-Za-z0-9_-]+", "_", name).strip("_") or "advertiser"
+
+
+def write_outputs(jobs: list[dict], advertisers: list[str], out_dir: Path, title: str) -> list[Path]:
+    """Combined table (one row per result row, tagged with advertiser and question) and per-advertiser PDFs."""
+    out_dir.mkdir(parents=True, exist_ok=True)
+    written = []
+
+    frames = [
+        job["data"].assign(advertiser=job["advertiser"], question=job["question"])
+        for job in jobs
+        if isinstance(job.get("data"), pd.DataFrame) and not job["data"].empty
+    ]
+    if frames:
+        combined = pd.concat(frames, ignore_index=True)
+        # Questions return different columns; keep the tags first.
+        combined = combined[["advertiser", "question"] + [c for c in combined.columns if c not in ("advertiser", "question")]]
+        combined.to_csv(out_dir / "combined.csv", index=False)
+        written.append(out_dir / "combined.csv")
+        try:
+            combined.astype({c: "string" for c in combined.columns if combined[c].dtype == object}).to_parquet(
+                out_dir / "combined.parquet", index=False
+            )
+            written.append(out_dir / "combined.parquet")
+        except Exception as e:  # pyarrow is optional
+            print(f"Batch report: skipping combined.parquet ({e})")
+
+    for advertiser in advertisers:
+        sections = [(job["question"], job["text"], job.get("data"), job.get("chart_config")) for job in jobs if job["advertiser"] == advertiser]
+        if not sections:
+            continue
+        path = out_dir / f"{_safe_name(advertiser)}.pdf"
+        try:
+            path.write_bytes(generate_pdf_pack(f"{title} - {advertiser}", sections))
+            written.append(path)
+        except Exception as e:
+            print(f"Batch report: PDF for {advertiser} failed: {e}")
+    return written
+
+
+def batch_stats(jobs: list[dict], elapsed: float, skipped: list[str]) -> dict:
+    """Throughput, latency percentiles and failures for a finished batch."""
+    seconds = sorted(job["seconds"] for job in jobs)
+    failed = [job for job in jobs if job["error"]]
+    by_route: dict[str, int] = {}
+    for job in jobs:
+        by_route[str(job["route"])] = by_route.get(str(job["route"]), 0) + 1
+    return {
+        "jobs": len(jobs),
+        "ok": len(jobs) - len(failed),
+        "failed": len(failed),
+        "retried": sum(1 for job in jobs if job["attempts"] > 1),
+        "elapsed_s": round(elapsed, 2),
+        "jobs_per_minute": round(len(jobs) / elapsed * 60, 2) if elapsed else None,
+        "p50_job_s": statistics.median(seconds) if seconds else None,
+        "p95_job_s": seconds[min(len(seconds) - 1, int(round(0.95 * (len(seconds) - 1))))] if seconds else None,
+        "rate_limit_wait_s": round(sum(job["waited_s"] for job in jobs), 2),
+        "by_route": by_route,
+        "skipped_advertisers": skipped,
+        "failures": [{"advertiser": j["advertiser"], "question": j["question"], "error": j["error"]} for j in failed],
+    }
+
+
+def run_batch_report(
+    questions: list[str],
+    advertisers: list[str],
+    date_range=None,
+    out_dir="reports",
+    max_workers: int = BATCH_MAX_WORKERS,
+    gemini_rpm: float = BATCH_GEMINI_RPM,
+    retries: int = BATCH_RETRIES,
+    title: str = "AMC Weekly Report",
+    client=None,
+    supabase_client=None,
+) -> dict:
+    """Answer every question for every advertiser on a worker pool and write the report files.
+
+    Returns the batch statistics (also written to `stats.json`), including the list
+    of written files.
+    """
+    client = client or init_gemini()
+    supabase_client = supabase_client or init_supabase()
+    if date_range is None:
+        today = datetime.date.today()
+        date_range = (today - datetime.timedelta(days=7), today)
+
+    run_id = uuid.uuid4().hex[:8]
+    limiter = RateLimiter(gemini_rpm)
+    scopes, skipped = {}, []
+    for advertiser in advertisers:
+        ids = [int(i) for i in (get_instance_ids_by_names_cached((advertiser,)) or [])]
+        if ids:
+            scopes[advertiser] = ids
+        else:
+            skipped.append(advertiser)
+
+    started = time.perf_counter()
+    jobs = []
+    total = len(scopes) * len(questions)
+    print(f"Batch {run_id}: {total} jobs ({len(scopes)} advertisers x {len(questions)} questions), {max_workers} workers")
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="amc-batch") as pool:
+        futures = [
+            pool.submit(_run_job, client, supabase_client, advertiser, ids, question, date_range, limiter, run_id, retries)
+            for advertiser, ids in scopes.items()
+            for question in questions
+        ]
+        for future in as_completed(futures):
+            job = future.result()
+            jobs.append(job)
+            status = f"FAILED ({job['error']})" if job["error"] else "ok"
+            print(f"[{len(jobs)}/{total}] {job['advertiser']} / {job['question']}: {status} in {job['seconds']}s")
+
+    # Keep the input order in files and PDFs regardless of completion order.
+    order = {(a, q): i for i, (a, q) in enumerate((a, q) for a in scopes for q in questions)}
+    jobs.sort(key=lambda job: order[(job["advertiser"], job["question"])])
+
+    out_dir = Path(out_dir)
+    written = write_outputs(jobs, list(scopes), out_dir, title)
+    stats = batch_stats(jobs, time.perf_counter() - started, skipped)
+    stats.update(run_id=run_id, date_range=[str(d) for d in date_range], files=[str(p) for p in written])
+    with open(out_dir / "stats.json", "w", encoding="utf-8") as fh:
+        json.dump(stats, fh, indent=1)
+    print(
+        f"Batch {run_id}: {stats['ok']}/{stats['jobs']} ok in {stats['elapsed_s']}s "
+        f"({stats['jobs_per_minute']} jobs/min, {stats['failed']} failed)"
+    )
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--questions", type=Path, required=True, help="text file, one question per line")
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument("--advertisers", nargs="+")
+    group.add_argument("--all-advertisers", action="store_true")
+    parser.add_argument("--days", type=int, default=7)
+    parser.add_argument("--out", type=Path, default=None)
+    parser.add_argument("--workers", type=int, default=BATCH_MAX_WORKERS)
+    parser.add_argument("--gemini-rpm", type=float, default=BATCH_GEMINI_RPM)
+    parser.add_argument("--retries", type=int, default=BATCH_RETRIES)
+    args = parser.parse_args()
+
+    questions = [line.strip() for line in args.questions.read_text(encoding="utf-8").splitlines() if line.strip()]
+    advertisers = get_advertisers_cached() if args.all_advertisers else args.advertisers
+    today = datetime.date.today()
+    out_dir = args.out or Path("reports") / today.isoformat()
+    stats = run_batch_report(
+        questions,
+        advertisers,
+        date_range=(today - datetime.timedelta(days=args.days), today),
+        out_dir=out_dir,
+        max_workers=args.workers,
+        gemini_rpm=args.gemini_rpm,
+        retries=args.retries,
+    )
+    if stats["failed"]:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
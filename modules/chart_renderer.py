@@ -0,0 +1,200 @@
+import hashlib
+import io
+import json
+import threading
+from collections import OrderedDict
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+# Figures are drawn straight onto an Agg canvas: headless, and no pyplot global state.
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+# Worker processes drawing the charts of a report pack. Drawing holds the GIL,
+# so threads would still draw one chart at a time.
+CHART_RENDER_WORKERS = 4
+# Rendered PNGs kept per server process, least recently used dropped first.
+CHART_CACHE_MAX_ENTRIES = 128
+# Bar charts with more categories than this keep the largest ones.
+CHART_MAX_BARS = 30
+CHART_SIZE_INCHES = (7.5, 3.2)
+CHART_DPI = 150
+
+_lock = threading.Lock()
+_png_cache: OrderedDict = OrderedDict()
+_stats = {"hits": 0, "misses": 0, "failed": 0}
+_pool = None
+
+
+def chart_cache_key(df: pd.DataFrame, chart_config: dict) -> str:
+    """Hash of the chart spec (minus `_meta`) and the columns it plots."""
+    spec = {k: v for k, v in chart_config.items() if not str(k).startswith("_")}
+    h = hashlib.sha256(json.dumps(spec, sort_keys=True, default=str).encode("utf-8"))
+    cols = [c for c in (chart_config.get("x"), chart_config.get("y"), chart_config.get("color")) if c in df.columns]
+    try:
+        h.update(pd.util.hash_pandas_object(df[cols], index=False).values.tobytes())
+    except TypeError:
+        h.update(df[cols].to_csv(index=False).encode("utf-8", "replace"))
+    return h.hexdigest()[:32]
+
+
+def _plot_frame(df: pd.DataFrame, chart_config: dict) -> pd.DataFrame | None:
+    """Values to draw: one row per x, one column per color group (or just y)."""
+    x, y, color = chart_config.get("x"), chart_config.get("y"), chart_config.get("color")
+    if x not in df.columns or y not in df.columns:
+        return None
+    values = pd.to_numeric(df[y], errors="coerce")
+    if color in df.columns:
+        frame = df.assign(**{y: values}).pivot_table(index=x, columns=color, values=y, aggfunc="sum")
+    else:
+        frame = values.groupby(df[x]).sum().to_frame(y)
+    if frame.empty:
+        return None
+    if chart_config.get("type") == "bar" and len(frame) > CHART_MAX_BARS:
+        frame = frame.loc[frame.sum(axis=1).nlargest(CHART_MAX_BARS).index]
+    return frame.sort_index()
+
+
+def _draw_png(frame: pd.DataFrame, chart_config: dict) -> bytes:
+    """Draw the aggregated `frame`. Runs in the worker processes too, so it only uses its arguments."""
+    fig = Figure(figsize=CHART_SIZE_INCHES, dpi=CHART_DPI)
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot()
+    labels = [str(v.date()) if isinstance(v, pd.Timestamp) else str(v) for v in frame.index]
+    positions = np.arange(len(frame))
+    if chart_config.get("type") == "line":
+        for name in frame.columns:
+            ax.plot(positions, frame[name].to_numpy(), marker="o", markersize=3, linewidth=1.5, label=str(name))
+    else:
+        width = 0.8 / frame.shape[1]
+        for i, name in enumerate(frame.columns):
+            ax.bar(positions + (i - (frame.shape[1] - 1) / 2) * width, frame[name].fillna(0).to_numpy(), width, label=str(name))
+
+    # Label at most ~30 ticks so long date axes stay readable.
+    step = max(1, len(labels) // 30)
+    ax.set_xticks(positions[::step], labels[::step], rotation=45, ha="right")
+    ax.set_xlabel(str(chart_config.get("x")))
+    ax.set_ylabel(str(chart_config.get("y")))
+    ax.tick_params(labelsize=7)
+    ax.grid(axis="y", alpha=0.3)
+    if frame.shape[1] > 1:
+        ax.legend(fontsize=7, title=str(chart_config.get("color")), title_fontsize=7)
+    fig.tight_layout()
+
+    buf = io.BytesIO()
+    fig.savefig(buf, format="png")
+    return buf.getvalue()
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _lock:
+        if _pool is None:
+            # Spawned workers only import this module, not the Streamlit app.
+            _pool = ProcessPoolExecutor(max_workers=CHART_RENDER_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+        return _pool
+
+
+def _cached(key: str) -> bytes | None:
+    with _lock:
+        if key in _png_cache:
+            _png_cache.move_to_end(key)
+            _stats["hits"] += 1
+            return _png_cache[key]
+        _stats["misses"] += 1
+    return None
+
+
+def _store(key: str, png: bytes) -> None:
+    with _lock:
+        _png_cache[key] = png
+        while len(_png_cache) > CHART_CACHE_MAX_ENTRIES:
+            _png_cache.popitem(last=False)
+
+
+def _failed(e: Exception) -> None:
+    print(f"Chart render failed: {e}")
+    with _lock:
+        _stats["failed"] += 1
+
+
+def _chartable(df, chart_config) -> bool:
+    return (
+        isinstance(df, pd.DataFrame)
+        and not df.empty
+        and isinstance(chart_config, dict)
+        and chart_config.get("type") in ("bar", "line")
+    )
+
+
+def render_chart_png(df: pd.DataFrame, chart_config: dict | None) -> bytes | None:
+    """PNG of the response chart (bar or line), or None when there is nothing to draw.
+
+    Cached by `chart_cache_key`, so re-exporting the same answer does not redraw it.
+    """
+    if not _chartable(df, chart_config):
+        return None
+    key = chart_cache_key(df, chart_config)
+    png = _cached(key)
+    if png is not None:
+        return png
+    try:
+        frame = _plot_frame(df, chart_config)
+        if frame is None:
+            return None
+        png = _draw_png(frame, chart_config)
+    except Exception as e:
+        _failed(e)
+        return None
+    _store(key, png)
+    return png
+
+
+def render_charts(items: list[tuple]) -> list[bytes | None]:
+    """PNGs for several `(df, chart_config)` charts, drawn in parallel on the worker processes.
+
+    Only the aggregated plot data is sent to the workers. Results are in input order.
+    """
+    results: list[bytes | None] = [None] * len(items)
+    pending = {}
+    for i, (df, chart_config) in enumerate(items):
+        if not _chartable(df, chart_config):
+            continue
+        key = chart_cache_key(df, chart_config)
+        results[i] = _cached(key)
+        if results[i] is not None:
+            continue
+        try:
+            frame = _plot_frame(df, chart_config)
+        except Exception as e:
+            _failed(e)
+            continue
+        if frame is not None:
+            pending[i] = (key, frame, chart_config)
+
+    if len(pending) > 1:
+        try:
+            pool = _get_pool()
+            futures = {i: pool.submit(_draw_png, frame, config) for i, (_, frame, config) in pending.items()}
+        except Exception as e:
+            print(f"Chart worker pool unavailable, drawing in-process: {e}")
+            futures = {}
+    else:
+        futures = {}
+
+    for i, (key, frame, config) in pending.items():
+        try:
+            png = futures[i].result() if i in futures else _draw_png(frame, config)
+        except Exception as e:
+            _failed(e)
+            continue
+        _store(key, png)
+        results[i] = png
+    return results
+
+
+def chart_cache_stats() -> dict:
+    with _lock:
+        return {**_stats, "entries": len(_png_cache), "bytes": sum(len(png) for png in _png_cache.values())}
@@ -0,0 +1,123 @@
+import json
+import sys
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+
+# Processed chat histories (messages with their DataFrames) kept per browser
+# session. Least recently viewed chats are dropped past this budget; they are
+# reloaded from the database when opened again.
+CHAT_HISTORY_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+
+def messages_nbytes(messages: list[dict]) -> int:
+    """Approximate memory held by a chat's messages, DataFrames included."""
+    total = sys.getsizeof(messages)
+    for message in messages:
+        total += sys.getsizeof(message)
+        for key in ("content", "sql"):
+            if isinstance(message.get(key), str):
+                total += sys.getsizeof(message[key])
+        data = message.get("data")
+        if isinstance(data, pd.DataFrame):
+            total += int(data.memory_usage(deep=True, index=True).sum())
+        chart_config = message.get("chart_config")
+        if chart_config:
+            total += len(json.dumps(chart_config, default=str))
+    return total
+
+
+class ChatHistoryCache:
+    """LRU map of chat id -> processed messages, bounded by `max_bytes`.
+
+    The most recently viewed chat is never evicted, even when it alone exceeds
+    the budget. Supports `in`, `[]` and `len()` like the dict it replaces.
+    Thread-safe: the memory monitor evicts from other sessions' caches.
+    """
+
+    def __init__(self, max_bytes: int = CHAT_HISTORY_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries: OrderedDict[str, list] = OrderedDict()
+        self._sizes: dict[str, int] = {}
+        self._evicted: set[str] = set()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "evicted_bytes": 0}
+        self._lock = threading.RLock()
+
+    def __contains__(self, chat_id: str) -> bool:
+        return chat_id in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __getitem__(self, chat_id: str) -> list:
+        messages = self.get(chat_id)
+        if messages is None:
+            raise KeyError(chat_id)
+        return messages
+
+    def __setitem__(self, chat_id: str, messages: list) -> None:
+        self.put(chat_id, messages)
+
+    def get(self, chat_id: str) -> list | None:
+        """Messages for `chat_id` (marking it most recently viewed), or None."""
+        with self._lock:
+            if chat_id not in self._entries:
+                self._stats["misses"] += 1
+                return None
+            self._stats["hits"] += 1
+            self._entries.move_to_end(chat_id)
+            return self._entries[chat_id]
+
+    def put(self, chat_id: str, messages: list) -> None:
+        """Store (or re-measure, after new messages) a chat and evict down to the budget."""
+        size = messages_nbytes(messages)
+        with self._lock:
+            self._entries[chat_id] = messages
+            self._entries.move_to_end(chat_id)
+            self._sizes[chat_id] = size
+            self._evicted.discard(chat_id)
+            while len(self._entries) > 1 and self.nbytes > self.max_bytes:
+                self.evict(next(iter(self._entries)))
+
+    def evict(self, chat_id: str) -> int:
+        """Drop `chat_id` (reloaded from the database when opened again). Returns the bytes freed."""
+        with self._lock:
+            if chat_id not in self._entries:
+                return 0
+            del self._entries[chat_id]
+            size = self._sizes.pop(chat_id, 0)
+            self._evicted.add(chat_id)
+            self._stats["evictions"] += 1
+            self._stats["evicted_bytes"] += size
+        print(f"Chat history cache: evicted {chat_id} ({size / 1e6:.1f} MB)")
+        return size
+
+    def evictable_sizes(self) -> dict[str, int]:
+        """Bytes per cached chat, except the one being viewed (which is never evicted)."""
+        with self._lock:
+            return {chat_id: self._sizes.get(chat_id, 0) for chat_id in list(self._entries)[:-1]}
+
+    def was_evicted(self, chat_id: str) -> bool:
+        """True if `chat_id` was dropped for space (its history may be newer than cached DB reads)."""
+        return chat_id in self._evicted
+
+    @property
+    def nbytes(self) -> int:
+        with self._lock:
+            return sum(self._sizes.values())
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "chats": len(self._entries),
+                "bytes": self.nbytes,
+                "max_bytes": self.max_bytes,
+                **self._stats,
+            }
+
+    def sizes(self) -> pd.DataFrame:
+        """Size per cached chat, most recently viewed first."""
+        with self._lock:
+            rows = [{"chat_id": chat_id, "bytes": self._sizes.get(chat_id, 0)} for chat_id in reversed(self._entries)]
+        return pd.DataFrame(rows)
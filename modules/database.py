@@ -2,6 +2,9 @@ import streamlit as st
 from supabase import create_client
 import pandas as pd
 import json
+import re
+
+from modules.tracing import trace_span
 
 
 @st.cache_resource(show_spinner=False)
@@ -66,6 +69,57 @@ def get_advertisers_cached():
         return []
 
 
+_FK_RE = re.compile(r"<fk table='([^']+)' column='([^']+)'/>")
+
+
+@st.cache_data(ttl=60 * 60, show_spinner=False)
+def get_table_schemas_cached():
+    """Introspect tables and columns from the PostgREST OpenAPI document (cached).
+
+    Returns a dict `{table: {"columns": [...], "description": str, "references": [...]}}`,
+    or an empty dict when the schema cannot be fetched.
+    """
+    supabase = _get_cached_supabase_client()
+    if not supabase:
+        return {}
+
+    try:
+        with trace_span("db.table_schemas"):
+            response = supabase.postgrest.session.get("/")
+            response.raise_for_status()
+            spec = response.json()
+    except Exception as e:
+        print(f"Error introspecting database schema: {e}")
+        return {}
+
+    definitions = spec.get("definitions") if isinstance(spec, dict) else None
+    if not isinstance(definitions, dict):
+        return {}
+
+    tables: dict[str, dict] = {}
+    for table_name, definition in definitions.items():
+        if not isinstance(definition, dict):
+            continue
+        properties = definition.get("properties") or {}
+        columns: list[str] = []
+        references: list[str] = []
+        for col_name, col_def in properties.items():
+            columns.append(col_name)
+            description = col_def.get("description") if isinstance(col_def, dict) else None
+            if isinstance(description, str):
+                for ref_table, _ref_col in _FK_RE.findall(description):
+                    if ref_table not in references:
+                        references.append(ref_table)
+
+        tables[table_name] = {
+            "columns": columns,
+            "description": (definition.get("description") or "").strip(),
+            "references": references,
+        }
+
+    return tables
+
+
 @st.cache_data(ttl=5 * 60, show_spinner=False)
 def get_all_sessions_cached():
     """Retrieve all unique chat session IDs (cached)."""
@@ -181,17 +235,12 @@ def get_instance_ids_by_names_cached(instance_names: tuple[str, ...]):
 
 
 @st.cache_data(ttl=5 * 60, show_spinner=False)
-def get_company_marketplace_ids_for_instance_ids_cached(
+def get_execution_ids_for_instance_ids_cached(
     instance_ids: tuple[int, ...],
     start_date: str | None,
     end_date: str | None,
 ):
-    """Derive company_marketplace_id values for the given AMC instance(s) and optional date window.
-
-    This is used to filter `ads_report` (which is keyed by company_marketplace_id) to match
-    the selected AMC instance(s) via:
-      amc_query_execution -> amc_query_execution_company_marketplace
-    """
+    """Resolve `amc_query_execution_id` values for AMC instance(s) whose window overlaps the dates (cached)."""
     supabase = _get_cached_supabase_client()
     if not supabase or not instance_ids:
         return []
@@ -204,7 +253,8 @@ def get_company_marketplace_ids_for_instance_ids_cached(
         if start_date and end_date:
             exec_query = exec_query.lte("start_date", end_date).gte("end_date", start_date)
 
-        exec_resp = exec_query.limit(5000).execute()
+        with trace_span("db.execution_ids", instances=len(instance_ids)):
+            exec_resp = exec_query.limit(5000).execute()
         exec_rows = exec_resp.data or []
         exec_ids: list[int] = []
         for row in exec_rows:
@@ -213,16 +263,64 @@ def get_company_marketplace_ids_for_instance_ids_cached(
                 if isinstance(raw_exec_id, int):
                     exec_ids.append(raw_exec_id)
 
+        return sorted(set(exec_ids))
+    except Exception as e:
+        st.error(f"Error resolving query executions: {e}")
+        return []
+
+
+@st.cache_data(ttl=30, show_spinner=False)
+def get_execution_watermark_cached(instance_ids: tuple[int, ...] = ()):
+    """Return the newest `amc_query_execution_id` for the instance(s), or for all instances (cached briefly).
+
+    Used to detect newly loaded AMC results and invalidate memoized scenario results.
+    """
+    supabase = _get_cached_supabase_client()
+    if not supabase:
+        return None
+
+    try:
+        query = supabase.table("amc_query_execution").select("amc_query_execution_id")
+        if instance_ids:
+            query = query.in_("amc_instance_id", list(instance_ids))
+        with trace_span("db.execution_watermark", instances=len(instance_ids)):
+            response = query.order("amc_query_execution_id", desc=True).limit(1).execute()
+        rows = response.data or []
+        return rows[0].get("amc_query_execution_id") if rows else None
+    except Exception as e:
+        print(f"Error reading execution watermark: {e}")
+        return None
+
+
+@st.cache_data(ttl=5 * 60, show_spinner=False)
+def get_company_marketplace_ids_for_instance_ids_cached(
+    instance_ids: tuple[int, ...],
+    start_date: str | None,
+    end_date: str | None,
+):
+    """Derive company_marketplace_id values for the given AMC instance(s) and optional date window.
+
+    This is used to filter `ads_report` (which is keyed by company_marketplace_id) to match
+    the selected AMC instance(s) via:
+      amc_query_execution -> amc_query_execution_company_marketplace
+    """
+    supabase = _get_cached_supabase_client()
+    if not supabase or not instance_ids:
+        return []
+
+    try:
+        exec_ids = get_execution_ids_for_instance_ids_cached(instance_ids, start_date, end_date)
         if not exec_ids:
             return []
 
-        cm_resp = (
-            supabase.table("amc_query_execution_company_marketplace")
-            .select("company_marketplace_id")
-            .in_("amc_query_execution_id", exec_ids)
-            .limit(5000)
-            .execute()
-        )
+        with trace_span("db.company_marketplace_ids", executions=len(exec_ids)):
+            cm_resp = (
+                supabase.table("amc_query_execution_company_marketplace")
+                .select("company_marketplace_id")
+                .in_("amc_query_execution_id", exec_ids)
+                .limit(5000)
+                .execute()
+            )
         cm_rows = cm_resp.data or []
         cm_ids: set[int] = set()
         for row in cm_rows:
@@ -269,6 +367,47 @@ def save_chat_message(supabase, session_id, role, content, sql_query=None, chart
         return None
 
 
+def save_usage_batch(supabase, table: str, rows: list[dict]):
+    """Insert a batch of usage-ledger rows in a single request.
+
+    Expected columns: created_at, auth_user, session_id, scope (jsonb), route, model,
+    tier, complexity, fallback_from, parse_status, prompt_tokens, output_tokens, cached_tokens,
+    latency_ms, gemini_ms, cache_hit, ok.
+    Runs off the script thread, so errors are logged instead of shown.
+    """
+    if not supabase or not rows:
+        return None
+
+    try:
+        return supabase.table(table).insert(rows).execute()
+    except Exception as e:
+        print(f"Error saving usage batch: {e}")
+        return None
+
+
+@st.cache_data(ttl=60, show_spinner=False)
+def load_usage_log_cached(days: int = 7, limit: int = 20000):
+    """Load recent usage-ledger rows as a DataFrame (cached)."""
+    supabase = _get_cached_supabase_client()
+    if not supabase:
+        return pd.DataFrame()
+
+    since = (pd.Timestamp.utcnow() - pd.Timedelta(days=int(days))).isoformat()
+    try:
+        response = (
+            supabase.table("amc_usage_log")
+            .select("*")
+            .gte("created_at", since)
+            .order("created_at", desc=True)
+            .limit(int(limit))
+            .execute()
+        )
+        return pd.DataFrame(response.data or [])
+    except Exception as e:
+        print(f"Error loading usage log: {e}")
+        return pd.DataFrame()
+
+
 def update_chat_title(supabase, session_id: str, title: str):
     """Persist a chat title for a session.
 
@@ -0,0 +1,127 @@
+import re
+from collections import deque
+from itertools import repeat
+
+import pandas as pd
+
+# Shared stand-in for null embeds; never mutated.
+_EMPTY: dict = {}
+# Identifier columns stay text even when every value is digits (ASINs, ISBNs,
+# zero-padded codes): matched on the last part of the column name.
+_IDENTIFIER_COLUMN_RE = re.compile(r"(?:^|_)(?:id|asin|isbn|sku|code)$")
+# "007", "-0123": numbers would drop the leading zeros.
+_LEADING_ZERO_RE = r"^[+-]?0\d"
+
+
+def _first_value(values: list):
+    return next((v for v in values if v is not None), None)
+
+
+def _is_record_list(value) -> bool:
+    return isinstance(value, list) and any(isinstance(v, dict) for v in value)
+
+
+def _has_record_lists(values: list) -> bool:
+    """True if any row holds a non-empty list of dicts (empty lists and nulls are skipped)."""
+    return any(map(_is_record_list, values))
+
+
+def _record_columns(values: list, prefix: str = "", sep: str = ".") -> dict[str, list]:
+    """Split a list of dicts into `{key: column_values}` without building per-row dicts.
+
+    Both the key union and the per-key extraction run as C-level `map` loops.
+    """
+    rows = [v if v.__class__ is dict else _EMPTY for v in values]
+    all_keys: set = set()
+    deque(map(all_keys.update, rows), maxlen=0)
+    if not all_keys:
+        return {}
+    # Keep the first record's key order, then any keys that only appear later.
+    first = next((r for r in rows if r), _EMPTY)
+    keys = list(first) + sorted(all_keys.difference(first))
+    name = (lambda k: f"{prefix}{sep}{k}") if prefix else str
+    return {name(k): list(map(dict.get, rows, repeat(k, len(rows)))) for k in keys}
+
+
+def _flatten_columns(columns: dict[str, list], sep: str) -> dict[str, list]:
+    """Recursively replace columns of dicts with one column per nested key."""
+    flat: dict[str, list] = {}
+    for name, values in columns.items():
+        if isinstance(_first_value(values), dict):
+            flat.update(_flatten_columns(_record_columns(values, name, sep), sep))
+        else:
+            flat[name] = values
+    return flat
+
+
+def _coerce_numeric(df: pd.DataFrame, sep: str = ".") -> pd.DataFrame:
+    """Convert text columns whose non-null values are all numeric (e.g. PostgREST `numeric` strings).
+
+    Identifier columns and values with leading zeros are left as text.
+    """
+    for col in df.columns:
+        if _IDENTIFIER_COLUMN_RE.search(str(col).rsplit(sep, 1)[-1].lower()):
+            continue
+        series = df[col]
+        if not (pd.api.types.is_object_dtype(series) or pd.api.types.is_string_dtype(series)):
+            continue
+        non_null = series.notna()
+        if not non_null.any():
+            continue
+        # Skip columns holding containers (lists of scalars) or booleans with nulls.
+        sample = series[non_null].iloc[0]
+        if isinstance(sample, (list, dict, bool)):
+            continue
+        # Cheap gate before the full-column conversion.
+        try:
+            float(sample)
+        except (TypeError, ValueError):
+            continue
+        converted = pd.to_numeric(series, errors="coerce")
+        if converted.notna().sum() != non_null.sum():
+            continue
+        text = series[non_null]
+        text = text[text.map(type) == str]
+        if text.str.match(_LEADING_ZERO_RE).any():
+            continue
+        df[col] = converted
+    return df
+
+
+def flatten_records(records, sep: str = ".", explode_lists: bool = True, coerce_numeric: bool = True) -> pd.DataFrame:
+    """Flatten PostgREST rows with embedded relations into a typed DataFrame.
+
+    Nested objects of any depth become `parent.child` columns. When `explode_lists`
+    is set, list-valued embeds (one-to-many relations) are exploded to one row per
+    element and flattened the same way; lists of scalars are left as-is. Text
+    columns holding only numbers are converted to numeric dtypes, except
+    identifier columns (`asin`, `*_id`, `*_code`...) and zero-padded values.
+    """
+    if records is None:
+        return pd.DataFrame()
+    if isinstance(records, dict):
+        records = [records]
+    if not records:
+        return pd.DataFrame()
+
+    # Columnar normalization: rows are split into per-key columns once per
+    # nesting level, and the DataFrame is built a single time at the end.
+    df = pd.DataFrame(_flatten_columns(_record_columns(list(records)), sep))
+
+    while explode_lists:
+        list_col = next(
+            (col for col in df.columns if df[col].dtype == object and _has_record_lists(df[col].tolist())),
+            None,
+        )
+        if list_col is None:
+            break
+        df = df.explode(list_col, ignore_index=True)
+        children = pd.DataFrame(
+            _flatten_columns(_record_columns(df[list_col].tolist(), list_col, sep), sep),
+            index=df.index,
+        )
+        df = pd.concat([df.drop(columns=[list_col]), children], axis=1)
+
+    if coerce_numeric:
+        df = _coerce_numeric(df, sep)
+    return df
@@ -0,0 +1,203 @@
+import contextvars
+import itertools
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import pandas as pd
+import streamlit as st
+
+# Process-wide limits for Gemini calls (override with the GEMINI_RPM,
+# GEMINI_BURST and GEMINI_MAX_CONCURRENCY secrets).
+DEFAULT_GEMINI_RPM = 60
+DEFAULT_GEMINI_BURST = 10
+DEFAULT_GEMINI_MAX_CONCURRENCY = 8
+# A request waiting longer than this fails instead of hanging the session.
+GEMINI_QUEUE_TIMEOUT_SECONDS = 120
+# How often a waiting request re-checks its queue position.
+_POSITION_POLL_SECONDS = 0.5
+
+# Who is asking, and how to report queue position to them. Set per request by
+# `requester_context`; worker threads inherit it via `bind_trace_context`.
+_requester = contextvars.ContextVar("gemini_requester", default="anonymous")
+_on_queue = contextvars.ContextVar("gemini_on_queue", default=None)
+
+
+class GeminiQueueTimeout(TimeoutError):
+    """Raised when a request waited `GEMINI_QUEUE_TIMEOUT_SECONDS` without getting a slot."""
+
+
+class GeminiScheduler:
+    """Token-bucket rate limit, bounded concurrency and per-user round-robin for Gemini calls.
+
+    Each user has a FIFO queue; slots go to the users in turn, so one user with
+    many pending requests delays everyone else by at most one request per turn.
+    """
+
+    def __init__(self, rpm: float, burst: int, max_concurrency: int):
+        # Tokens per second; None disables the rate limit (concurrency still applies).
+        self.rate = rpm / 60.0 if rpm > 0 else None
+        self.burst = max(1, burst)
+        self.max_concurrency = max(1, max_concurrency)
+        self._cond = threading.Condition()
+        self._tokens = float(self.burst)
+        self._refilled = time.monotonic()
+        self._in_flight = 0
+        self._queues: dict[str, deque] = {}
+        # Users with pending requests, in service order.
+        self._turns: deque[str] = deque()
+        self._ids = itertools.count(1)
+        self._stats = {"granted": 0, "timed_out": 0, "wait_ms_total": 0.0, "max_wait_ms": 0.0}
+
+    def _refill(self, now: float) -> None:
+        if self.rate is None:
+            self._tokens = float(self.burst)
+        else:
+            self._tokens = min(self.burst, self._tokens + (now - self._refilled) * self.rate)
+        self._refilled = now
+
+    def _position(self, user: str, ticket: int) -> int:
+        """1-based place of `ticket` in the round-robin service order."""
+        queue = self._queues[user]
+        depth = queue.index(ticket)
+        turn = self._turns.index(user)
+        ahead = 0
+        for i, other in enumerate(self._turns):
+            pending = len(self._queues[other])
+            # Every user gets `depth` turns before ours; users ahead in turn order get one more.
+            ahead += min(pending, depth + (1 if i < turn else 0))
+        return ahead + 1
+
+    def acquire(self, user: str, on_queue=None, timeout: float = GEMINI_QUEUE_TIMEOUT_SECONDS) -> float:
+        """Wait for a slot; returns the seconds waited. Pair with `release()`."""
+        started = time.monotonic()
+        with self._cond:
+            ticket = next(self._ids)
+            if user not in self._queues:
+                self._queues[user] = deque()
+                self._turns.append(user)
+            self._queues[user].append(ticket)
+            reported = None
+            try:
+                while True:
+                    now = time.monotonic()
+                    self._refill(now)
+                    is_next = self._turns[0] == user and self._queues[user][0] == ticket
+                    if is_next and self._in_flight < self.max_concurrency and self._tokens >= 1:
+                        break
+                    if now - started > timeout:
+                        self._stats["timed_out"] += 1
+                        raise GeminiQueueTimeout(f"waited {timeout:.0f}s for a Gemini slot")
+                    position = self._position(user, ticket)
+                    if on_queue and position != reported:
+                        reported = position
+                        # The callback may update the UI; do not hold up other requests meanwhile.
+                        self._cond.release()
+                        try:
+                            on_queue(position)
+                        except Exception as e:
+                            print(f"Queue position callback failed: {e}")
+                        finally:
+                            self._cond.acquire()
+                        continue
+                    delay = _POSITION_POLL_SECONDS
+                    if is_next and self._in_flight < self.max_concurrency and self.rate:
+                        delay = min(delay, (1 - self._tokens) / self.rate)
+                    self._cond.wait(delay)
+            except BaseException:
+                self._dequeue(user, ticket)
+                self._cond.notify_all()
+                raise
+
+            self._dequeue(user, ticket)
+            self._tokens -= 1
+            self._in_flight += 1
+            waited = time.monotonic() - started
+            self._stats["granted"] += 1
+            self._stats["wait_ms_total"] += waited * 1000
+            self._stats["max_wait_ms"] = max(self._stats["max_wait_ms"], waited * 1000)
+            self._cond.notify_all()
+        if on_queue and reported is not None:
+            # Position 0: the request left the queue and is running.
+            try:
+                on_queue(0)
+            except Exception as e:
+                print(f"Queue position callback failed: {e}")
+        return waited
+
+    def _dequeue(self, user: str, ticket: int) -> None:
+        queue = self._queues[user]
+        was_head = self._turns[0] == user and queue[0] == ticket
+        queue.remove(ticket)
+        if not queue:
+            del self._queues[user]
+            self._turns.remove(user)
+        elif was_head:
+            # Served: this user goes to the back of the line.
+            self._turns.rotate(-1)
+
+    def release(self) -> None:
+        with self._cond:
+            self._in_flight -= 1
+            self._cond.notify_all()
+
+    def status(self) -> dict:
+        with self._cond:
+            self._refill(time.monotonic())
+            granted = self._stats["granted"]
+            return {
+                "in_flight": self._in_flight,
+                "max_concurrency": self.max_concurrency,
+                "queued": sum(len(q) for q in self._queues.values()),
+                "tokens": round(self._tokens, 2),
+                "rpm": round(self.rate * 60, 1) if self.rate else None,
+                "granted": granted,
+                "timed_out": self._stats["timed_out"],
+                "avg_wait_ms": round(self._stats["wait_ms_total"] / granted, 1) if granted else 0.0,
+                "max_wait_ms": round(self._stats["max_wait_ms"], 1),
+            }
+
+    def queue_snapshot(self) -> pd.DataFrame:
+        """Pending requests per user, in service order (for the admin page)."""
+        with self._cond:
+            return pd.DataFrame([{"user": u, "pending": len(self._queues[u])} for u in self._turns])
+
+
+def _secret_number(name: str, default: float) -> float:
+    try:
+        return float(st.secrets.get(name, default))
+    except Exception:
+        return default
+
+
+@st.cache_resource(show_spinner=False)
+def get_gemini_scheduler() -> GeminiScheduler:
+    """The scheduler shared by every session of this server process."""
+    return GeminiScheduler(
+        rpm=_secret_number("GEMINI_RPM", DEFAULT_GEMINI_RPM),
+        burst=int(_secret_number("GEMINI_BURST", DEFAULT_GEMINI_BURST)),
+        max_concurrency=int(_secret_number("GEMINI_MAX_CONCURRENCY", DEFAULT_GEMINI_MAX_CONCURRENCY)),
+    )
+
+
+@contextmanager
+def requester_context(user: str | None, on_queue=None):
+    """Attribute Gemini calls made inside the block to `user` for fair queuing.
+
+    `on_queue(position)` is called while a request waits, whenever its place in
+    the queue changes, and with 0 once it gets its slot.
+    """
+    user_token = _requester.set(user or "anonymous")
+    queue_token = _on_queue.set(on_queue)
+    try:
+        yield
+    finally:
+        _requester.reset(user_token)
+        _on_queue.reset(queue_token)
+
+
+def acquire_gemini_slot(scheduler: GeminiScheduler | None = None) -> float:
+    """Wait for a Gemini slot for the current requester; returns the seconds waited."""
+    scheduler = scheduler or get_gemini_scheduler()
+    return scheduler.acquire(_requester.get(), _on_queue.get())
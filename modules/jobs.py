@@ -0,0 +1,147 @@
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+from modules.tracing import bind_trace_context
+
+# Agent requests running in the background, shared by every session of this process.
+JOB_MAX_WORKERS = 8
+# PDF/report builds get their own pool, so a burst of exports cannot hold every
+# agent worker (and agent requests cannot starve exports).
+REPORT_MAX_WORKERS = 2
+# Finished jobs are kept this long so a session that comes back can still attach them.
+JOB_RETENTION_SECONDS = 60 * 60
+
+_lock = threading.Lock()
+# job id -> {"id", "key", "owner", "status", "submitted_at", "started_at", "finished_at",
+#            "result", "error", "progress", "attached", "pool"}
+_jobs: dict[str, dict] = {}
+# Idempotency key -> job id (one job per chat message).
+_by_key: dict[str, str] = {}
+_JOB_POOL = ThreadPoolExecutor(max_workers=JOB_MAX_WORKERS, thread_name_prefix="amc-job")
+_REPORT_POOL = ThreadPoolExecutor(max_workers=REPORT_MAX_WORKERS, thread_name_prefix="amc-report")
+_POOLS = {"agent": _JOB_POOL, "report": _REPORT_POOL}
+
+
+def _run(job_id: str, fn, args, kwargs) -> None:
+    with _lock:
+        _jobs[job_id].update(status="running", started_at=time.time())
+    try:
+        result = fn(*args, **kwargs)
+        fields = {"status": "done", "result": result}
+    except Exception as e:
+        print(f"Background job {job_id} failed: {e}")
+        fields = {"status": "failed", "error": str(e)}
+    with _lock:
+        _jobs[job_id].update(finished_at=time.time(), **fields)
+
+
+def submit_job(key: str, fn, *args, owner: str | None = None, pool: str = "agent", **kwargs) -> str:
+    """Run `fn(*args, **kwargs)` in the background and return its job id.
+
+    `pool` is "agent" (chat answers) or "report" (PDF builds). Submitting the same
+    `key` again returns the existing job instead of running `fn` twice (unless the
+    earlier attempt failed).
+    """
+    executor = _POOLS[pool]
+    prune_jobs()
+    with _lock:
+        existing = _by_key.get(key)
+        if existing in _jobs and _jobs[existing]["status"] != "failed":
+            return existing
+        job_id = uuid.uuid4().hex[:12]
+        _jobs[job_id] = {
+            "id": job_id,
+            "key": key,
+            "owner": owner,
+            "status": "pending",
+            "submitted_at": time.time(),
+            "started_at": None,
+            "finished_at": None,
+            "result": None,
+            "error": None,
+            "progress": {},
+            "attached": False,
+            "pool": pool,
+        }
+        _by_key[key] = job_id
+    executor.submit(bind_trace_context(_run), job_id, fn, args, kwargs)
+    return job_id
+
+
+def get_job(job_id: str) -> dict | None:
+    """Snapshot of a job (the result object itself is shared, not copied)."""
+    with _lock:
+        job = _jobs.get(job_id)
+        return {**job, "progress": dict(job["progress"])} if job else None
+
+
+def find_job(key: str) -> str | None:
+    with _lock:
+        job_id = _by_key.get(key)
+        return job_id if job_id in _jobs else None
+
+
+def update_job_progress(job_id: str, **fields) -> None:
+    """Merge `fields` into the job's progress (queue position, partial results...)."""
+    with _lock:
+        if job_id in _jobs:
+            _jobs[job_id]["progress"].update(fields)
+
+
+def mark_attached(job_id: str) -> bool:
+    """Claim a finished job's result for the chat. Only the first caller gets True."""
+    with _lock:
+        job = _jobs.get(job_id)
+        if not job or job["attached"] or job["status"] not in ("done", "failed"):
+            return False
+        job["attached"] = True
+        return True
+
+
+def prune_jobs(max_age: float = JOB_RETENTION_SECONDS) -> int:
+    """Drop jobs that finished more than `max_age` seconds ago."""
+    cutoff = time.time() - max_age
+    with _lock:
+        old = [job_id for job_id, job in _jobs.items() if job["finished_at"] and job["finished_at"] < cutoff]
+        for job_id in old:
+            job = _jobs.pop(job_id)
+            if _by_key.get(job["key"]) == job_id:
+                del _by_key[job["key"]]
+    return len(old)
+
+
+def jobs_nbytes() -> int:
+    """Approximate memory held by finished jobs' results (answers with data, PDF bytes)."""
+    with _lock:
+        results = [job["result"] for job in _jobs.values() if job["result"] is not None]
+    total = 0
+    for result in results:
+        if isinstance(result, (bytes, bytearray)):
+            total += len(result)
+        elif isinstance(result, dict) and isinstance(result.get("data"), pd.DataFrame):
+            total += int(result["data"].memory_usage(deep=True).sum()) + len(str(result.get("text") or ""))
+    return total
+
+
+def jobs_status() -> pd.DataFrame:
+    """Jobs in this server process with their state and timings, for the admin page."""
+    now = time.time()
+    with _lock:
+        rows = [
+            {
+                "id": job["id"],
+                "owner": job["owner"],
+                "pool": job["pool"],
+                "status": job["status"],
+                "attached": job["attached"],
+                "queued_s": round((job["started_at"] or now) - job["submitted_at"], 2),
+                "run_s": round((job["finished_at"] or now) - job["started_at"], 2) if job["started_at"] else None,
+                "error": job["error"],
+            }
+            for job in _jobs.values()
+        ]
+    return pd.DataFrame(rows)
@@ -0,0 +1,264 @@
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+import streamlit as st
+
+from modules.database import get_execution_watermark_cached, init_supabase
+from modules.flatten import flatten_records
+from modules.schema import get_schema_registry
+from modules.tracing import bind_trace_context, trace_span
+
+try:
+    import duckdb
+except ImportError:  # Optional: scenarios fall back to PostgREST + pandas
+    duckdb = None
+
+# Tables are mirrored page by page (PostgREST returns at most 1000 rows per request).
+MIRROR_PAGE_SIZE = 1000
+# A table larger than this is not mirrored; queries touching it fall back to PostgREST.
+# Its size is checked with a count request first, and again only once new
+# executions land (the watermark changes).
+MIRROR_MAX_ROWS = 250_000
+# Mirrors are refreshed when new executions land, and at least this often.
+# Refreshes run in the background; requests use PostgREST until they finish.
+MIRROR_TTL_SECONDS = 15 * 60
+
+_TABLE_REF_RE = re.compile(r"\b(?:FROM|JOIN)\s+([A-Za-z_][A-Za-z0-9_]*)", re.IGNORECASE)
+
+# Guards the DuckDB connection and `_mirrors`; never held while downloading.
+_lock = threading.Lock()
+_connection = None
+# table -> {"loaded_at", "watermark", "rows", "complete"}
+_mirrors: dict[str, dict] = {}
+# One lock per table, so concurrent sessions download a table once and other
+# tables load in parallel.
+_table_locks: dict[str, threading.Lock] = {}
+# Tables with a refresh queued or running on `_MIRROR_POOL`.
+_refreshing: set[str] = set()
+_MIRROR_POOL = ThreadPoolExecutor(max_workers=4, thread_name_prefix="amc-mirror")
+
+
+def local_engine_enabled() -> bool:
+    """True when DuckDB is installed and `LOCAL_SQL_ENGINE` is not turned off in secrets."""
+    if duckdb is None:
+        return False
+    flag = st.secrets.get("LOCAL_SQL_ENGINE", True)
+    return str(flag).strip().lower() not in {"0", "false", "no", "off"}
+
+
+def referenced_tables(sql: str) -> list[str]:
+    """Base tables referenced by `sql` (CTE names are excluded)."""
+    ctes = set(re.findall(r"\b([A-Za-z_][A-Za-z0-9_]*)\s+AS\s*\(", sql, re.IGNORECASE))
+    tables = []
+    for name in _TABLE_REF_RE.findall(sql):
+        if name not in ctes and name not in tables:
+            tables.append(name)
+    return tables
+
+
+def _get_connection():
+    global _connection
+    if _connection is None:
+        _connection = duckdb.connect(database=":memory:")
+    return _connection
+
+
+def _fetch_table(supabase_client, table: str, order_column: str | None):
+    """Read a whole table through PostgREST. Returns `(DataFrame, complete)`."""
+    rows: list[dict] = []
+    start = 0
+    with trace_span(f"local_sql.mirror.{table}") as span_attrs:
+        while start < MIRROR_MAX_ROWS:
+            query = supabase_client.table(table).select("*")
+            if order_column:
+                query = query.order(order_column)
+            page = query.range(start, start + MIRROR_PAGE_SIZE - 1).execute().data or []
+            rows.extend(page)
+            if len(page) < MIRROR_PAGE_SIZE:
+                break
+            start += MIRROR_PAGE_SIZE
+        complete = len(rows) < MIRROR_MAX_ROWS
+        span_attrs.update(rows=len(rows), complete=complete)
+    if not complete:
+        # Never queried locally, so skip normalizing the partial download.
+        return pd.DataFrame(), False
+    # Same normalization as the PostgREST path: numeric strings become numbers.
+    df = flatten_records(rows, explode_lists=False)
+    if df.empty and not len(df.columns):
+        df = pd.DataFrame(columns=get_schema_registry().get(table, {}).get("columns") or [])
+    return df, complete
+
+
+def _row_count(supabase_client, table: str) -> int | None:
+    """Exact row count from a HEAD request (no rows transferred), or None if unavailable."""
+    try:
+        return supabase_client.table(table).select("*", count="exact", head=True).execute().count
+    except Exception as e:
+        print(f"Local SQL engine: could not count rows of {table}: {e}")
+        return None
+
+
+def _store_table(con, table: str, df: pd.DataFrame, watermark, complete: bool, rows: int | None = None) -> None:
+    """Replace `table` in DuckDB with `df` and record it as mirrored. Caller holds `_lock`.
+
+    Incomplete tables are only recorded (and any older copy dropped): they are never queried.
+    """
+    if complete:
+        con.register("_mirror_df", df)
+        con.execute(f'CREATE OR REPLACE TABLE "{table}" AS SELECT * FROM _mirror_df')
+        con.unregister("_mirror_df")
+    else:
+        con.execute(f'DROP TABLE IF EXISTS "{table}"')
+    _mirrors[table] = {
+        "loaded_at": time.monotonic(),
+        "watermark": watermark,
+        "rows": len(df) if complete else (rows or MIRROR_MAX_ROWS),
+        "complete": complete,
+    }
+
+
+def _is_fresh(table: str, watermark, ahead_seconds: float = 0) -> bool:
+    """True if `table` needs no download. Caller holds `_lock`.
+
+    Tables over `MIRROR_MAX_ROWS` stay skipped until the watermark changes,
+    instead of being checked again every `MIRROR_TTL_SECONDS`. `ahead_seconds`
+    treats mirrors that expire within that time as stale already.
+    """
+    mirror = _mirrors.get(table)
+    if not mirror or mirror["watermark"] != watermark:
+        return False
+    age = time.monotonic() - mirror["loaded_at"]
+    return not mirror["complete"] or age < MIRROR_TTL_SECONDS - ahead_seconds
+
+
+def _table_lock(table: str) -> threading.Lock:
+    with _lock:
+        return _table_locks.setdefault(table, threading.Lock())
+
+
+def _refresh_table(supabase_client, table: str, order_column: str | None, watermark, ahead_seconds: float = 0) -> None:
+    """Download and store `table` unless another session refreshed it while we waited.
+
+    Tables over `MIRROR_MAX_ROWS` (by a HEAD count) are recorded as incomplete without downloading them.
+    """
+    try:
+        with _table_lock(table):
+            with _lock:
+                if _is_fresh(table, watermark, ahead_seconds):
+                    return
+            count = _row_count(supabase_client, table)
+            if count is not None and count >= MIRROR_MAX_ROWS:
+                df, complete = pd.DataFrame(), False
+            else:
+                df, complete = _fetch_table(supabase_client, table, order_column)
+            with _lock:
+                _store_table(_get_connection(), table, df, watermark, complete, rows=count)
+    except Exception as e:
+        print(f"Local SQL engine: could not mirror {table}: {e}")
+    finally:
+        with _lock:
+            _refreshing.discard(table)
+
+
+def _schedule_refresh(supabase_client, tables: list[str], watermark, ahead_seconds: float = 0) -> list:
+    """Queue background refreshes for `tables` (skipping those already queued). Returns their futures."""
+    registry = get_schema_registry()
+    with _lock:
+        queued = [t for t in tables if t not in _refreshing]
+        _refreshing.update(queued)
+    refresh = bind_trace_context(_refresh_table)
+    return [
+        _MIRROR_POOL.submit(
+            refresh, supabase_client, t, (registry.get(t, {}).get("columns") or [None])[0], watermark, ahead_seconds
+        )
+        for t in queued
+    ]
+
+
+def ensure_mirrored(tables: list[str], supabase_client=None) -> bool:
+    """True if every table has a fresh, complete mirror.
+
+    Missing or stale tables are refreshed in the background and False is returned,
+    so the request answers through PostgREST instead of waiting for the download.
+    """
+    supabase_client = supabase_client or init_supabase()
+    registry = get_schema_registry()
+    if not supabase_client or any(t not in registry for t in tables):
+        return False
+
+    watermark = get_execution_watermark_cached(())
+    with _lock:
+        stale = [t for t in tables if not _is_fresh(t, watermark)]
+        ready = all(_mirrors.get(t, {}).get("complete") for t in tables)
+    if stale:
+        _schedule_refresh(supabase_client, stale, watermark)
+        return False
+    return ready
+
+
+def refresh_mirrors(supabase_client=None, ahead_seconds: float = 0) -> int:
+    """Refresh mirrored tables that are stale or expire within `ahead_seconds`; blocks until done.
+
+    Called by the precompute scheduler so requests rarely find a stale mirror.
+    Returns how many tables were refreshed.
+    """
+    if not local_engine_enabled():
+        return 0
+    supabase_client = supabase_client or init_supabase()
+    if not supabase_client:
+        return 0
+    watermark = get_execution_watermark_cached(())
+    with _lock:
+        stale = [t for t in _mirrors if not _is_fresh(t, watermark, ahead_seconds)]
+    futures = _schedule_refresh(supabase_client, stale, watermark, ahead_seconds)
+    for future in futures:
+        future.result()
+    return len(futures)
+
+
+def attach_tables(frames: dict[str, pd.DataFrame]) -> None:
+    """Load DataFrames as already-mirrored tables (e.g. synthetic data for load tests).
+
+    They count as fresh for the current execution watermark, so queries run on them
+    without reading Supabase.
+    """
+    watermark = get_execution_watermark_cached(())
+    with _lock:
+        con = _get_connection()
+        for table, df in frames.items():
+            _store_table(con, table, df, watermark, complete=True)
+
+
+def run_local_sql(sql: str, supabase_client=None):
+    """Run `sql` against the DuckDB mirror. Returns a DataFrame, or None when it cannot run locally."""
+    if not local_engine_enabled():
+        return None
+    tables = referenced_tables(sql)
+    try:
+        if not tables or not ensure_mirrored(tables, supabase_client):
+            return None
+        with trace_span("local_sql.query", tables=len(tables)) as span_attrs:
+            cursor = _get_connection().cursor()
+            try:
+                df = cursor.execute(sql).df()
+            finally:
+                cursor.close()
+            span_attrs["rows"] = len(df)
+        return df
+    except Exception as e:
+        print(f"Local SQL engine failed, using PostgREST: {e}")
+        return None
+
+
+def mirror_status() -> pd.DataFrame:
+    """Mirrored tables with row counts and age, for the admin page."""
+    now = time.monotonic()
+    with _lock:
+        rows = [
+            {"table": t, "rows": m["rows"], "complete": m["complete"], "age_s": round(now - m["loaded_at"], 1)}
+            for t, m in _mirrors.items()
+        ]
+    return pd.DataFrame(rows)
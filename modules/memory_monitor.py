@@ -0,0 +1,204 @@
+import sys
+import threading
+import time
+import weakref
+
+import pandas as pd
+import streamlit as st
+
+from modules.chart_renderer import chart_cache_stats
+from modules.chat_cache import CHAT_HISTORY_CACHE_MAX_BYTES
+from modules.jobs import jobs_nbytes
+from modules.scenario_cache import drop_scenario_result, scenario_cache_sizes
+
+# How often the monitor thread measures memory and applies the soft limits.
+MEMORY_SAMPLE_SECONDS = 60
+# Soft limits (override with the MEMORY_SESSION_SOFT_LIMIT_MB and
+# MEMORY_TOTAL_SOFT_LIMIT_MB secrets). Past them the largest evictable entries
+# are dropped first; the process may still go above them between samples.
+# Each chat cache already evicts at its own budget, so a session limit above it
+# would never trigger: it defaults to 3/4 of that budget and is capped at it.
+DEFAULT_SESSION_SOFT_LIMIT_MB = 0.75 * CHAT_HISTORY_CACHE_MAX_BYTES / 1e6
+DEFAULT_TOTAL_SOFT_LIMIT_MB = 2048
+# Sessions that have not run for this long are dropped from the registry.
+SESSION_IDLE_SECONDS = 6 * 60 * 60
+
+_lock = threading.Lock()
+# Browser session id -> {"user", "cache" (weakref to its ChatHistoryCache), "last_seen"}.
+_sessions: dict[str, dict] = {}
+_last: dict = {"sampled_at": None, "snapshot": None, "evicted": []}
+
+
+def register_session(session_id: str, user: str | None, chat_cache) -> None:
+    """Called on every run so the monitor can see (and trim) this session's chat cache."""
+    with _lock:
+        _sessions[session_id] = {"user": user or "anonymous", "cache": weakref.ref(chat_cache), "last_seen": time.time()}
+
+
+def _live_sessions() -> list[tuple[str, str, object]]:
+    cutoff = time.time() - SESSION_IDLE_SECONDS
+    with _lock:
+        for session_id in [sid for sid, s in _sessions.items() if s["last_seen"] < cutoff or s["cache"]() is None]:
+            del _sessions[session_id]
+        return [(sid, s["user"], s["cache"]()) for sid, s in _sessions.items() if s["cache"]() is not None]
+
+
+def _cached_functions() -> dict[str, object]:
+    """`st.cache_data` functions defined in this app's modules, by qualified name."""
+    functions = {}
+    for name, module in list(sys.modules.items()):
+        if not name.startswith("modules.") or module is None:
+            continue
+        for attr in vars(module).values():
+            if callable(getattr(attr, "clear", None)) and getattr(attr, "__module__", None) == name:
+                functions[f"{name}.{getattr(attr, '__qualname__', '')}"] = attr
+    return functions
+
+
+def _cache_data_sizes() -> dict[str, int]:
+    """Bytes held per `st.cache_data` function, from Streamlit's cache stats."""
+    try:
+        from streamlit.runtime.caching import get_data_cache_stats_provider
+
+        stats = get_data_cache_stats_provider().get_stats()
+    except Exception as e:
+        print(f"Memory monitor: st.cache_data stats unavailable ({e})")
+        return {}
+    sizes: dict[str, int] = {}
+    for stat in stats:
+        sizes[stat.cache_name] = sizes.get(stat.cache_name, 0) + int(stat.byte_length)
+    return sizes
+
+
+def memory_snapshot() -> dict:
+    """Current memory attribution: per session/chat, per cache function and process-wide caches."""
+    chats = []
+    for session_id, user, cache in _live_sessions():
+        for row in cache.sizes().to_dict("records"):
+            chats.append({"user": user, "session": session_id, "chat_id": row["chat_id"], "bytes": row["bytes"]})
+
+    caches = [{"cache": f"st.cache_data: {name}", "bytes": size} for name, size in _cache_data_sizes().items()]
+    caches.append({"cache": "scenario cache", "bytes": sum(size for _, size in scenario_cache_sizes())})
+    caches.append({"cache": "PDF chart images", "bytes": chart_cache_stats()["bytes"]})
+    caches.append({"cache": "background jobs", "bytes": jobs_nbytes()})
+
+    chats_df = pd.DataFrame(chats, columns=["user", "session", "chat_id", "bytes"])
+    caches_df = pd.DataFrame(caches, columns=["cache", "bytes"])
+    return {
+        "chats": chats_df.sort_values("bytes", ascending=False).reset_index(drop=True),
+        "caches": caches_df.sort_values("bytes", ascending=False).reset_index(drop=True),
+        "total_bytes": int(chats_df["bytes"].sum() + caches_df["bytes"].sum()),
+    }
+
+
+def memory_by_user(snapshot: dict) -> pd.DataFrame:
+    chats = snapshot["chats"]
+    if chats.empty:
+        return pd.DataFrame(columns=["user", "sessions", "chats", "bytes"])
+    return (
+        chats.groupby("user")
+        .agg(sessions=("session", "nunique"), chats=("chat_id", "count"), bytes=("bytes", "sum"))
+        .reset_index()
+        .sort_values("bytes", ascending=False)
+    )
+
+
+def _secret_mb(name: str, default: float) -> float:
+    try:
+        return float(st.secrets.get(name, default))
+    except Exception:
+        return default
+
+
+def soft_limits() -> dict:
+    return {
+        "session_bytes": min(
+            int(_secret_mb("MEMORY_SESSION_SOFT_LIMIT_MB", DEFAULT_SESSION_SOFT_LIMIT_MB) * 1e6),
+            CHAT_HISTORY_CACHE_MAX_BYTES,
+        ),
+        "total_bytes": int(_secret_mb("MEMORY_TOTAL_SOFT_LIMIT_MB", DEFAULT_TOTAL_SOFT_LIMIT_MB) * 1e6),
+    }
+
+
+def enforce_soft_limits(snapshot: dict | None = None) -> list[dict]:
+    """Evict largest-first until each session and the whole process are under their soft limits.
+
+    Candidates: cached chats other than the one each session is viewing, memoized
+    scenario results and whole `st.cache_data` functions. Returns what was evicted.
+    """
+    limits = soft_limits()
+    evicted = []
+    sessions = _live_sessions()
+
+    # 1. Per session: trim its own chat cache.
+    for session_id, user, cache in sessions:
+        over = cache.nbytes - limits["session_bytes"]
+        for chat_id, size in sorted(cache.evictable_sizes().items(), key=lambda item: -item[1]):
+            if over <= 0:
+                break
+            over -= cache.evict(chat_id)
+            evicted.append({"kind": "chat", "owner": user, "name": chat_id, "bytes": size, "limit": "session"})
+
+    # 2. Whole process: largest candidates anywhere.
+    snapshot = snapshot or memory_snapshot()
+    over = snapshot["total_bytes"] - sum(e["bytes"] for e in evicted) - limits["total_bytes"]
+    if over <= 0:
+        return evicted
+
+    candidates = []
+    for session_id, user, cache in sessions:
+        for chat_id, size in cache.evictable_sizes().items():
+            candidates.append((size, "chat", user, chat_id, lambda c=cache, k=chat_id: c.evict(k)))
+    for key, size in scenario_cache_sizes():
+        candidates.append((size, "scenario", None, str(key), lambda k=key: drop_scenario_result(k)))
+    functions = _cached_functions()
+    for name, size in _cache_data_sizes().items():
+        fn = functions.get(name)
+        if fn is not None:
+            candidates.append((size, "cache_data", None, name, fn.clear))
+
+    for size, kind, owner, name, evict in sorted(candidates, key=lambda c: -c[0]):
+        if over <= 0:
+            break
+        try:
+            evict()
+        except Exception as e:
+            print(f"Memory monitor: could not evict {kind} {name}: {e}")
+            continue
+        over -= size
+        evicted.append({"kind": kind, "owner": owner, "name": name, "bytes": size, "limit": "total"})
+    return evicted
+
+
+def sample_memory(enforce: bool = True) -> dict:
+    """Measure, apply the soft limits, and keep the result for the admin page."""
+    snapshot = memory_snapshot()
+    evicted = enforce_soft_limits(snapshot) if enforce else []
+    if evicted:
+        print(f"Memory monitor: evicted {len(evicted)} entries ({sum(e['bytes'] for e in evicted) / 1e6:.1f} MB)")
+        snapshot = memory_snapshot()
+    with _lock:
+        _last.update(sampled_at=time.time(), snapshot=snapshot, evicted=evicted)
+    return snapshot
+
+
+def last_sample() -> dict:
+    with _lock:
+        return dict(_last)
+
+
+def _monitor_loop():
+    while True:
+        try:
+            sample_memory()
+        except Exception as e:
+            print(f"Memory monitor sample failed: {e}")
+        time.sleep(MEMORY_SAMPLE_SECONDS)
+
+
+@st.cache_resource(show_spinner=False)
+def start_memory_monitor():
+    """Start the background memory monitor once per server process."""
+    thread = threading.Thread(target=_monitor_loop, name="amc-memory", daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,193 @@
+import re
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+import pandas as pd
+
+from modules.gemini_scheduler import acquire_gemini_slot, get_gemini_scheduler
+from modules.schema import get_schema_registry, match_tables
+from modules.tracing import bind_trace_context, trace_span
+
+# Model per tier, fastest first.
+MODEL_TIERS: dict[str, str] = {
+    "lite": "gemini-2.5-flash-lite",
+    "standard": "gemini-2.5-flash",
+    "pro": "gemini-2.5-pro",
+}
+
+# Per-attempt deadline; on timeout (or an API error) the next tier in
+# `FALLBACK_TIERS` is tried with the same request.
+TIER_TIMEOUT_SECONDS: dict[str, float] = {"lite": 20.0, "standard": 40.0, "pro": 90.0}
+FALLBACK_TIERS: dict[str, list[str]] = {"lite": ["standard"], "standard": ["lite"], "pro": ["standard"]}
+
+# Complexity score thresholds (see `score_complexity`). Tune them with `tier_metrics`.
+LITE_MAX_SCORE = 1
+PRO_MIN_SCORE = 4
+
+_ANALYTIC_TERMS = {
+    "compare", "comparison", "versus", "vs", "correlation", "correlate", "trend", "why",
+    "breakdown", "growth", "change", "impact", "incremental", "cohort", "share", "ratio",
+    "forecast", "attribution", "difference", "between", "over",
+}
+_GROUPING_TERMS = {"per", "by", "each", "across"}
+_FOLLOW_UP_TERMS = {"that", "those", "it", "them", "same", "previous", "again"}
+_LOOKUP_TERMS = {"show", "list", "display", "sample", "preview"}
+# The only other words a templated lookup may contain besides the table name.
+# Anything else (filters, values, ordering, metrics) goes to the model.
+_LOOKUP_FILLER = {"me", "the", "a", "an", "all", "some", "few", "please", "rows", "records", "entries", "data", "table"}
+# Quoted values and comparisons are filters.
+_QUALIFIER_RE = re.compile(r"[\"'`=<>]")
+
+_WORD_RE = re.compile(r"[a-z0-9]+")
+
+# Abandoned (timed out) calls keep their worker until the API returns, so the
+# pool is sized above the number of concurrent chats we expect.
+_MODEL_POOL = ThreadPoolExecutor(max_workers=8, thread_name_prefix="amc-gemini")
+
+_attempts_lock = threading.Lock()
+_attempts: deque = deque(maxlen=5000)
+
+
+def score_complexity(user_query: str, chat_history=None, registry: dict[str, dict] | None = None):
+    """Score how much reasoning a free-form question needs.
+
+    Returns `(score, signals)`; each signal adds to the score: tables touched,
+    analytic wording, grouping, long questions and follow-ups that depend on
+    the chat history.
+    """
+    registry = registry if registry is not None else get_schema_registry()
+    words = set(_WORD_RE.findall((user_query or "").lower()))
+    analytic = words & _ANALYTIC_TERMS
+
+    # Only tables the question names: column words are too loose to signal joins.
+    tables = match_tables(user_query, registry, explicit_only=True)
+    signals = {
+        # Each table beyond the first adds one; vague questions (no match) count as one.
+        "tables": max(0, len(tables) - 1) if tables else 1,
+        # Any analytic wording counts double; a second term adds one more.
+        "analytic": min(len(analytic), 2) + 1 if analytic else 0,
+        "grouping": 1 if words & _GROUPING_TERMS else 0,
+        "long": 1 if len(words) > 25 else 0,
+        "follow_up": 1 if chat_history and words & _FOLLOW_UP_TERMS else 0,
+    }
+    return sum(signals.values()), signals
+
+
+def choose_model_tier(user_query: str, chat_history=None):
+    """Return `(tier, score, signals)` for a question that goes to Gemini."""
+    score, signals = score_complexity(user_query, chat_history)
+    if score <= LITE_MAX_SCORE:
+        tier = "lite"
+    elif score >= PRO_MIN_SCORE:
+        tier = "pro"
+    else:
+        tier = "standard"
+    return tier, score, signals
+
+
+def templated_query_plan(user_query: str, registry: dict[str, dict] | None = None):
+    """Build a query object for plain "show me <table>" lookups, skipping the model.
+
+    Only questions made of a lookup verb, filler words and exactly one table name
+    qualify ("show me the marketplace rows"). Any other word, number, quoted value
+    or comparison may be a filter the template would drop, so those return None
+    and go to the model.
+    """
+    registry = registry if registry is not None else get_schema_registry()
+    if _QUALIFIER_RE.search(user_query or ""):
+        return None
+    tokens = _WORD_RE.findall((user_query or "").lower())
+    if not set(tokens) & _LOOKUP_TERMS:
+        return None
+
+    # Underscores are not word characters for `_WORD_RE`, so "ads_report" reads as "ads report".
+    text = " ".join(tokens)
+    patterns = {t: rf"\b{re.escape(t.replace('_', ' '))}s?\b" for t in registry}
+    named = [t for t, pattern in patterns.items() if re.search(pattern, text)]
+    if len(named) != 1:
+        return None
+
+    table = named[0]
+    rest = re.sub(patterns[table], " ", text).split()
+    if set(rest) - _LOOKUP_TERMS - _LOOKUP_FILLER:
+        return None
+    columns = registry[table].get("columns") or []
+    query = {"name": table, "table": table, "select": "*", "limit": 10, "filters": []}
+    if "created_at" in columns:
+        query.update(order_by="created_at", order_direction="desc")
+    return query
+
+
+def _record_attempt(attempt: dict) -> None:
+    with _attempts_lock:
+        _attempts.append(attempt)
+
+
+def generate_with_fallback(client, tier: str, **request):
+    """Call `generate_content` on `tier`, falling back to other tiers on timeout or error.
+
+    `request` is passed through (config, contents). Returns `(response, attempts)`,
+    where the last attempt is the one that answered. Re-raises the last error when
+    every tier fails.
+    """
+    attempts: list[dict] = []
+    last_error = None
+    scheduler = get_gemini_scheduler()
+    for current in [tier] + FALLBACK_TIERS.get(tier, []):
+        model = MODEL_TIERS[current]
+        timeout = TIER_TIMEOUT_SECONDS[current]
+        attempt = {"tier": current, "model": model, "ok": False, "timeout": False, "error": None}
+        # Wait for a process-wide slot first, so queueing does not count against the tier deadline.
+        with trace_span("gemini_queue") as queue_attrs:
+            attempt["queue_ms"] = round(acquire_gemini_slot(scheduler) * 1000, 2)
+            queue_attrs["queue_ms"] = attempt["queue_ms"]
+        started = time.perf_counter()
+        with trace_span("gemini_call", tier=current, model=model) as span_attrs:
+            future = _MODEL_POOL.submit(
+                bind_trace_context(client.models.generate_content), model=model, **request
+            )
+            # The slot is held until the call returns, even if we stop waiting for it.
+            future.add_done_callback(lambda _f: scheduler.release())
+            try:
+                response = future.result(timeout=timeout)
+                attempt["ok"] = True
+            except FutureTimeoutError:
+                future.cancel()
+                attempt["timeout"] = True
+                attempt["error"] = f"timed out after {timeout:.0f}s"
+                last_error = TimeoutError(f"{model} {attempt['error']}")
+            except Exception as e:
+                attempt["error"] = str(e)
+                last_error = e
+            span_attrs.update(ok=attempt["ok"], timeout=attempt["timeout"])
+
+        attempt["ms"] = round((time.perf_counter() - started) * 1000, 2)
+        attempts.append(attempt)
+        _record_attempt(attempt)
+        if attempt["ok"]:
+            return response, attempts
+        print(f"Gemini tier '{current}' failed ({attempt['error']}); falling back")
+
+    raise last_error
+
+
+def tier_metrics() -> pd.DataFrame:
+    """Per-tier attempts, success/timeout rates and latency for this server process."""
+    with _attempts_lock:
+        df = pd.DataFrame(list(_attempts))
+    if df.empty:
+        return df
+
+    grouped = df.groupby(["tier", "model"])
+    return pd.DataFrame(
+        {
+            "attempts": grouped.size(),
+            "success_rate": grouped["ok"].mean(),
+            "timeout_rate": grouped["timeout"].mean(),
+            "p50_ms": grouped["ms"].quantile(0.5),
+            "p95_ms": grouped["ms"].quantile(0.95),
+        }
+    ).reset_index().round(3)
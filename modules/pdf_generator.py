@@ -1,23 +1,147 @@
+import hashlib
+import json
+import os
+import tempfile
+
+import numpy as np
+import pandas as pd
 from fpdf import FPDF
 
-def generate_pdf_report(user_query, insight_text, df):
-    """
-    Generates a PDF report using FPDF.
-    Returns the PDF content as bytes.
+from modules.chart_renderer import render_chart_png, render_charts
+
+# Rows shown under each answer; the full data goes to an appendix.
+PDF_PREVIEW_ROWS = 20
+# The appendix stops here (about 400 pages at the default row height).
+PDF_APPENDIX_MAX_ROWS = 20_000
+# Rows formatted at a time, so large tables never hold every formatted cell at once.
+PDF_TABLE_CHUNK_ROWS = 2_000
+# Column widths come from the longest values in the first rows, in characters.
+_WIDTH_SAMPLE_ROWS = 500
+_MIN_COL_CHARS = 4
+_MAX_COL_CHARS = 40
+_TABLE_FONT_SIZE = 8
+# Height / width of the images from `modules.chart_renderer`.
+CHART_ASPECT = 3.2 / 7.5
+_ROW_HEIGHT = 6
+
+def _format_column(series):
+    """Cell text for a whole column at once (latin-1 safe, missing values blank)."""
+    missing = series.isna()
+    if pd.api.types.is_bool_dtype(series):
+        text = series.astype(str)
+    elif pd.api.types.is_integer_dtype(series):
+        text = series.astype(str)
+    elif pd.api.types.is_float_dtype(series):
+        text = pd.Series(np.char.mod("%.2f", series.fillna(0).to_numpy(dtype=float)), index=series.index)
+    elif pd.api.types.is_datetime64_any_dtype(series):
+        dates_only = (series.dropna().dt.normalize() == series.dropna()).all()
+        text = series.dt.strftime("%Y-%m-%d" if dates_only else "%Y-%m-%d %H:%M")
+    else:
+        text = series.astype(str)
+    text = text.where(~missing, "")
+    return text.str.encode("latin-1", "replace").str.decode("latin-1")
+
+def _truncate(text, max_chars):
+    too_long = text.str.len() > max_chars
+    if not too_long.any():
+        return text
+    return text.where(~too_long, text.str.slice(0, max(1, max_chars - 3)) + "...")
+
+def _column_layout(pdf, df):
+    """Width (mm), max characters and alignment per column, sized from the content."""
+    sample = df.head(_WIDTH_SAMPLE_ROWS)
+    chars = []
+    for col in df.columns:
+        longest = _format_column(sample[col]).str.len().max()
+        longest = 0 if pd.isna(longest) else int(longest)
+        chars.append(min(_MAX_COL_CHARS, max(_MIN_COL_CHARS, longest, len(str(col)))))
+
+    available = pdf.w - pdf.l_margin - pdf.r_margin
+    total = sum(chars)
+    widths = [available * c / total for c in chars]
+    char_width = pdf.get_string_width("0") or 1.5
+    max_chars = [max(3, int((w - 2) / char_width)) for w in widths]
+    aligns = ["R" if pd.api.types.is_numeric_dtype(df[col]) else "L" for col in df.columns]
+    return widths, max_chars, aligns
+
+def _table_header(pdf, headers, widths):
+    pdf.set_font("Arial", "B", _TABLE_FONT_SIZE)
+    for header, width in zip(headers, widths):
+        pdf.cell(width, _ROW_HEIGHT, header, border=1)
+    pdf.ln()
+    pdf.set_font("Arial", "", _TABLE_FONT_SIZE)
+
+def render_table(pdf, df, max_rows=None):
+    """Draw `df` as a table, continuing onto new pages with the header repeated.
+
+    Cells are formatted column by column, `PDF_TABLE_CHUNK_ROWS` rows at a time.
+    Returns the number of rows drawn.
     """
-    pdf = FPDF()
-    pdf.add_page()
-    
-    # Header
+    if df is None or df.empty or len(df.columns) == 0:
+        return 0
+    if max_rows is not None:
+        df = df.head(max_rows)
+
+    pdf.set_font("Arial", "", _TABLE_FONT_SIZE)
+    widths, max_chars, aligns = _column_layout(pdf, df)
+    headers = [str(col).encode("latin-1", "replace").decode("latin-1") for col in df.columns]
+    headers = [h if len(h) <= n else h[:max(1, n - 3)] + "..." for h, n in zip(headers, max_chars)]
+    bottom = pdf.h - pdf.b_margin
+    # Draw page breaks ourselves so the header can be repeated.
+    auto_break, break_margin = pdf.auto_page_break, pdf.b_margin
+    pdf.set_auto_page_break(False)
+    try:
+        _table_header(pdf, headers, widths)
+        for start in range(0, len(df), PDF_TABLE_CHUNK_ROWS):
+            chunk = df.iloc[start:start + PDF_TABLE_CHUNK_ROWS]
+            columns = [
+                _truncate(_format_column(chunk[col]), n).tolist()
+                for col, n in zip(df.columns, max_chars)
+            ]
+            for row in zip(*columns):
+                if pdf.get_y() + _ROW_HEIGHT > bottom:
+                    pdf.add_page()
+                    _table_header(pdf, headers, widths)
+                for value, width, align in zip(row, widths, aligns):
+                    pdf.cell(width, _ROW_HEIGHT, value, border=1, align=align)
+                pdf.ln()
+    finally:
+        pdf.set_auto_page_break(auto_break, break_margin)
+    pdf.ln(4)
+    return len(df)
+
+def _add_header(pdf, title="AMC Insights Service"):
     pdf.set_font("Arial", "B", 16)
-    pdf.cell(0, 10, "AMC Insights Service", ln=True, align="C")
+    pdf.cell(0, 10, title.encode('latin-1', 'replace').decode('latin-1'), ln=True, align="C")
     pdf.ln(10)
-    
+
+def _add_chart(pdf, png):
+    """Place a rendered chart across the page width (FPDF only reads images from files)."""
+    fd, path = tempfile.mkstemp(suffix=".png")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(png)
+        width = pdf.w - pdf.l_margin - pdf.r_margin
+        # Charts are drawn at a fixed aspect ratio; keep them on one page.
+        height = width * CHART_ASPECT
+        if pdf.get_y() + height > pdf.h - pdf.b_margin:
+            pdf.add_page()
+        pdf.image(path, x=pdf.l_margin, y=pdf.get_y(), w=width, h=height)
+        pdf.set_y(pdf.get_y() + height + 4)
+    finally:
+        os.unlink(path)
+
+def _add_section(pdf, user_query, insight_text, df, appendix=False, chart_png=None):
+    """Write one question: title, summary text, the chart and a preview of the data.
+
+    With `appendix`, the full data (up to `PDF_APPENDIX_MAX_ROWS`) follows on new pages.
+    """
     # Title (User Query)
     pdf.set_font("Arial", "B", 12)
-    pdf.cell(0, 10, f"Query: {user_query}", ln=True)
+    safe_query = str(user_query).encode('latin-1', 'replace').decode('latin-1')
+    pdf.cell(0, 10, f"Query: {safe_query}", ln=True)
     pdf.ln(5)
-    
+
     # Executive Summary
     pdf.set_font("Arial", "", 11)
     # Multi_cell for text wrapping
@@ -25,32 +149,67 @@ def generate_pdf_report(user_query, insight_text, df):
     safe_text = insight_text.encode('latin-1', 'replace').decode('latin-1')
     pdf.multi_cell(0, 7, f"Executive Summary:\n{safe_text}")
     pdf.ln(10)
-    
+
+    if chart_png:
+        _add_chart(pdf, chart_png)
+
     # Data Table
     if df is not None and not df.empty:
         pdf.set_font("Arial", "B", 10)
         pdf.cell(0, 10, "Data Preview:", ln=True)
-        
-        # Table Header
-        pdf.set_font("Arial", "B", 9)
-        cols = df.columns.tolist()
-        if cols:
-            col_width = 190 / len(cols) # Distribute width roughly
-            
-            for col in cols:
-                pdf.cell(col_width, 8, str(col), border=1)
-            pdf.ln()
-            
-            # Table Rows
-            pdf.set_font("Arial", "", 9)
-            for index, row in df.head(20).iterrows(): # Limit to 20 rows for the PDF preview
-                for col in cols:
-                    val = str(row[col])
-                    # Truncate if too long
-                    if len(val) > 20:
-                        val = val[:17] + "..."
-                    pdf.cell(col_width, 8, val, border=1)
-                pdf.ln()
-        
+        render_table(pdf, df, max_rows=PDF_PREVIEW_ROWS)
+
+    if appendix and df is not None and len(df) > PDF_PREVIEW_ROWS:
+        pdf.add_page()
+        pdf.set_font("Arial", "B", 12)
+        pdf.cell(0, 10, f"Appendix: Full Data ({len(df):,} rows)", ln=True)
+        if len(df) > PDF_APPENDIX_MAX_ROWS:
+            pdf.set_font("Arial", "I", 9)
+            pdf.cell(0, 6, f"Showing the first {PDF_APPENDIX_MAX_ROWS:,} rows.", ln=True)
+        render_table(pdf, df, max_rows=PDF_APPENDIX_MAX_ROWS)
+
+def report_cache_key(user_query, insight_text, df, chart_config=None):
+    """Stable hash of a report's inputs; equal inputs always produce the same PDF."""
+    h = hashlib.sha256()
+    h.update(str(user_query).encode("utf-8", "replace"))
+    h.update(b"\0")
+    h.update(str(insight_text).encode("utf-8", "replace"))
+    h.update(b"\0")
+    h.update(json.dumps(chart_config, sort_keys=True, default=str).encode("utf-8"))
+    if isinstance(df, pd.DataFrame):
+        h.update(",".join(map(str, df.columns)).encode("utf-8", "replace"))
+        try:
+            h.update(pd.util.hash_pandas_object(df, index=False).values.tobytes())
+        except TypeError:
+            # Unhashable cells (lists, dicts): fall back to the CSV text.
+            h.update(df.to_csv(index=False).encode("utf-8", "replace"))
+    return h.hexdigest()[:32]
+
+def generate_pdf_report(user_query, insight_text, df, chart_config=None):
+    """
+    Generates a PDF report using FPDF, with the response chart when `chart_config` has one.
+    Returns the PDF content as bytes.
+    """
+    pdf = FPDF()
+    pdf.add_page()
+    _add_header(pdf)
+    chart_png = render_chart_png(df, chart_config)
+    _add_section(pdf, user_query, insight_text, df, appendix=True, chart_png=chart_png)
+
     # Return bytes
     return pdf.output(dest='S').encode('latin-1')
+
+def generate_pdf_pack(title, sections):
+    """
+    Generates one PDF with a page per `(user_query, insight_text, df, chart_config)`
+    section (used by the batch report to build one document per advertiser).
+    Charts for all sections are rendered in parallel first.
+    Returns the PDF content as bytes.
+    """
+    pdf = FPDF()
+    charts = render_charts([(df, chart_config) for _, _, df, chart_config in sections])
+    for (user_query, insight_text, df, _), chart_png in zip(sections, charts):
+        pdf.add_page()
+        _add_header(pdf, title)
+        _add_section(pdf, user_query, insight_text, df, chart_png=chart_png)
+    return pdf.output(dest='S').encode('latin-1')
@@ -0,0 +1,148 @@
+import datetime
+import threading
+import time
+
+import streamlit as st
+
+from modules.agent import route_command, run_scenario
+from modules.database import (
+    get_advertisers_cached,
+    get_execution_watermark_cached,
+    get_instance_ids_by_names_cached,
+    init_supabase,
+)
+from modules.local_engine import refresh_mirrors
+from modules.scenario_cache import MEMOIZED_SCENARIOS, invalidate_scenario_cache
+
+# Prompts behind the sidebar quick actions and the starter buttons. Only those
+# routed to a memoizable scenario are precomputed.
+PRECOMPUTED_PROMPTS = [
+    "Show Time to Conversion",
+    "Analyze NTB Metrics",
+    "Overlap Analysis",
+    "Show Spend Trend",
+]
+
+# Full refresh interval, and how often to look for newly landed executions.
+PRECOMPUTE_INTERVAL_SECONDS = 30 * 60
+PRECOMPUTE_POLL_SECONDS = 60
+# Keep results a little past the next run so there is no gap while it works.
+PRECOMPUTE_TTL_SECONDS = PRECOMPUTE_INTERVAL_SECONDS + 10 * 60
+
+_run_lock = threading.Lock()
+_wake = threading.Event()
+_status: dict = {"runs": 0, "last_started": None, "last_seconds": None, "results": 0, "errors": [], "running": False}
+
+
+def default_date_range(today: datetime.date | None = None):
+    """The app's default window: the last 30 days, as of today.
+
+    Sessions that have not picked a range use it too (see `_ensure_session_state`),
+    so their memo keys match the precomputed ones across midnight.
+    """
+    today = today or datetime.date.today()
+    return (today - datetime.timedelta(days=30), today)
+
+
+def _scopes():
+    """Global scope plus one scope per advertiser: `(advertisers, instance_ids)`."""
+    yield [], []
+    for name in get_advertisers_cached():
+        ids = get_instance_ids_by_names_cached((name,)) or []
+        if ids:
+            yield [name], [int(i) for i in ids]
+
+
+def run_precompute(supabase_client=None) -> int:
+    """Materialize the quick-action scenarios for every advertiser; returns the results stored.
+
+    Skips the run when another one is already in progress.
+    """
+    supabase_client = supabase_client or init_supabase()
+    if not supabase_client or not _run_lock.acquire(blocking=False):
+        return 0
+
+    prompts = [p for p in PRECOMPUTED_PROMPTS if route_command(p) in MEMOIZED_SCENARIOS]
+    date_range = default_date_range()
+    started = time.perf_counter()
+    stored = 0
+    errors = []
+    _status.update(running=True, last_started=datetime.datetime.now().isoformat(timespec="seconds"))
+    try:
+        for advertisers, instance_ids in _scopes():
+            for prompt in prompts:
+                try:
+                    result = run_scenario(
+                        supabase_client, prompt, advertisers, date_range, instance_ids, memo_ttl=PRECOMPUTE_TTL_SECONDS
+                    )
+                    data = result.get("data")
+                    if data is None or data.empty:
+                        # Empty frames are not memoized (query errors also return them), so
+                        # sessions would fall through to a live run: report it.
+                        errors.append(f"{advertisers or 'Global'} / {prompt}: empty result, not cached")
+                    else:
+                        stored += 1
+                except Exception as e:
+                    errors.append(f"{advertisers or 'Global'} / {prompt}: {e}")
+    finally:
+        _status.update(
+            running=False,
+            runs=_status["runs"] + 1,
+            last_seconds=round(time.perf_counter() - started, 2),
+            results=stored,
+            errors=errors[-20:],
+        )
+        _run_lock.release()
+
+    print(f"Precompute: {stored} quick-action results in {_status['last_seconds']}s ({len(errors)} errors)")
+    return stored
+
+
+def _scheduler_loop():
+    last_run = 0.0
+    watermark = get_execution_watermark_cached(())
+    while True:
+        _wake.wait(PRECOMPUTE_POLL_SECONDS)
+        forced = _wake.is_set()
+        _wake.clear()
+
+        get_execution_watermark_cached.clear()
+        latest = get_execution_watermark_cached(())
+        landed = latest != watermark
+        if landed:
+            # New executions: cached results are stale everywhere.
+            invalidate_scenario_cache()
+            watermark = latest
+
+        # Keep the DuckDB mirrors warm off the request path: refresh those that
+        # are stale or would expire before the next poll.
+        try:
+            refresh_mirrors(ahead_seconds=2 * PRECOMPUTE_POLL_SECONDS)
+        except Exception as e:
+            print(f"Mirror refresh failed: {e}")
+
+        if forced or landed or time.monotonic() - last_run >= PRECOMPUTE_INTERVAL_SECONDS:
+            try:
+                run_precompute()
+            except Exception as e:
+                print(f"Precompute run failed: {e}")
+            last_run = time.monotonic()
+
+
+@st.cache_resource(show_spinner=False)
+def start_precompute_scheduler():
+    """Start the background precompute thread once per server process."""
+    thread = threading.Thread(target=_scheduler_loop, name="amc-precompute", daemon=True)
+    thread.start()
+    # First run right away instead of after the first poll interval.
+    _wake.set()
+    return thread
+
+
+def trigger_precompute() -> None:
+    """Ask the scheduler for a run now (no-op while one is running)."""
+    _wake.set()
+
+
+def precompute_status() -> dict:
+    return dict(_status)
@@ -0,0 +1,154 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from modules.database import (
+    get_company_marketplace_ids_for_instance_ids_cached,
+    get_execution_ids_for_instance_ids_cached,
+)
+from modules.schema import get_schema_registry, select_relevant_tables
+from modules.tracing import bind_trace_context, trace_span
+
+try:
+    from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+except ImportError:  # Older Streamlit versions
+    add_script_run_ctx = None
+    get_script_run_ctx = None
+
+# Shared, bounded pool for speculative work started while Gemini is generating.
+_PREFETCH_POOL = ThreadPoolExecutor(max_workers=4, thread_name_prefix="amc-prefetch")
+
+# How long to wait for an unfinished prefetch once the plan has arrived.
+PREFETCH_WAIT_SECONDS = 10.0
+
+# Tables filtered through `company_marketplace_id` rather than an execution id.
+_MARKETPLACE_SCOPED_TABLES = {"ads_report", "amc_query_execution_company_marketplace", "company_marketplace"}
+
+
+def _needs_marketplace_ids(tables: list[str], registry: dict[str, dict]) -> bool:
+    return any(
+        t in _MARKETPLACE_SCOPED_TABLES or "company_marketplace_id" in (registry.get(t, {}).get("columns") or [])
+        for t in tables
+    )
+
+
+def _resolve_scope(instance_ids: tuple[int, ...], start_date: str | None, end_date: str | None, user_query: str):
+    t0 = time.perf_counter()
+    with trace_span("scope_prefetch", instances=len(instance_ids)):
+        registry = get_schema_registry()
+        likely_tables = select_relevant_tables(user_query, registry)
+
+        execution_ids = get_execution_ids_for_instance_ids_cached(instance_ids, start_date, end_date)
+        company_marketplace_ids = None
+        if _needs_marketplace_ids(likely_tables, registry):
+            company_marketplace_ids = get_company_marketplace_ids_for_instance_ids_cached(
+                instance_ids, start_date, end_date
+            )
+
+    return {
+        "instance_ids": list(instance_ids),
+        "start_date": start_date,
+        "end_date": end_date,
+        "execution_ids": list(execution_ids or []),
+        "company_marketplace_ids": list(company_marketplace_ids) if company_marketplace_ids is not None else None,
+        "likely_tables": likely_tables,
+        "seconds": round(time.perf_counter() - t0, 3),
+    }
+
+
+def start_scope_prefetch(instance_ids, start_date: str | None, end_date: str | None, user_query: str):
+    """Resolve the chat scope (and warm the schema registry) on a background thread.
+
+    Meant to be started right before the Gemini call. Returns a future whose result
+    is the scope dict consumed by `apply_scope_filters`, or `None` for global chats.
+    The future keeps its arguments in `scope_args` so `collect_scope_prefetch` can
+    resolve the scope again if the prefetch fails.
+    """
+    if not instance_ids:
+        return None
+
+    ids = tuple(sorted(int(i) for i in instance_ids))
+    ctx = get_script_run_ctx() if callable(get_script_run_ctx) else None
+
+    def _run():
+        # Let Streamlit caches and `st.error` work from the worker thread.
+        if ctx is not None and callable(add_script_run_ctx):
+            add_script_run_ctx(threading.current_thread(), ctx)
+        return _resolve_scope(ids, start_date, end_date, user_query)
+
+    future = _PREFETCH_POOL.submit(bind_trace_context(_run))
+    future.scope_args = (ids, start_date, end_date, user_query)
+    return future
+
+
+def collect_scope_prefetch(future, timeout: float = PREFETCH_WAIT_SECONDS):
+    """Return `(scope, was_ready)` for a prefetch started with `start_scope_prefetch`.
+
+    A failed or slow prefetch is resolved again on this thread: a scoped chat never
+    runs unscoped. If that fails too, the scope has no ids (scoped tables return no
+    rows) and carries the reason in `error`.
+    """
+    if future is None:
+        return None, False
+    was_ready = future.done()
+    try:
+        return future.result(timeout=timeout), was_ready
+    except Exception as e:
+        print(f"Scope prefetch failed, resolving synchronously: {e!r}")
+        future.cancel()
+
+    ids, start_date, end_date, user_query = future.scope_args
+    t0 = time.perf_counter()
+    try:
+        return _resolve_scope(ids, start_date, end_date, user_query), False
+    except Exception as e:
+        print(f"Scope resolution failed: {e}")
+        return {
+            "instance_ids": list(ids),
+            "start_date": start_date,
+            "end_date": end_date,
+            "execution_ids": [],
+            "company_marketplace_ids": [],
+            "likely_tables": [],
+            "seconds": round(time.perf_counter() - t0, 3),
+            "error": str(e),
+        }, False
+
+
+def apply_scope_filters(query_obj: dict, scope: dict | None, registry: dict[str, dict]):
+    """Add `in` filters restricting a guarded query to the chat scope.
+
+    AMC fact tables are filtered by execution id, `ads_report`-style tables by
+    company marketplace id and instance-level tables by instance id. Dimension
+    tables without any of those keys are left as-is. Returns `(query_obj, note)`;
+    when the ids could not be resolved the query gets `scope_error` set.
+    """
+    if not scope:
+        return query_obj, None
+
+    table = query_obj.get("table")
+    columns = registry.get(table, {}).get("columns") or []
+
+    if "amc_instance_id" in columns:
+        column, values = "amc_instance_id", scope["instance_ids"]
+    elif "amc_query_execution_id" in columns:
+        column, values = "amc_query_execution_id", scope["execution_ids"]
+    elif "company_marketplace_id" in columns:
+        values = scope.get("company_marketplace_ids")
+        if values is None:
+            # Not predicted by the prefetch; resolve now (cached).
+            values = get_company_marketplace_ids_for_instance_ids_cached(
+                tuple(scope["instance_ids"]), scope.get("start_date"), scope.get("end_date")
+            )
+        column = "company_marketplace_id"
+    else:
+        return query_obj, None
+
+    scoped = dict(query_obj)
+    scoped["filters"] = list(query_obj.get("filters") or []) + [
+        {"column": column, "operator": "in", "value": list(values or [])}
+    ]
+    if scope.get("error") and column != "amc_instance_id":
+        scoped["scope_error"] = scope["error"]
+        return scoped, f"scoped by {column} (unresolved: {scope['error']})"
+    return scoped, f"scoped by {column} ({len(values or [])} ids)"
@@ -0,0 +1,481 @@
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+from modules.flatten import flatten_records
+from modules.prefetch import apply_scope_filters
+from modules.schema import get_schema_registry
+from modules.tracing import bind_trace_context, trace_span
+
+# Upper bound on concurrent PostgREST requests for a single multi-query plan.
+MAX_PARALLEL_QUERIES = 4
+
+# Rows returned when the plan does not set a limit, and the hard per-table caps.
+# Supabase returns at most `max-rows` (1000 by default) per request, so caps
+# above it would truncate silently instead of being reported as partial.
+DEFAULT_QUERY_LIMIT = 10
+DEFAULT_ROW_CAP = 1000
+TABLE_ROW_CAPS: dict[str, int] = {
+    "amc_chat_history": 200,
+}
+
+# Columns never fetched when a plan asks for "*".
+HEAVY_COLUMNS: dict[str, set[str]] = {
+    "amc_chat_history": {"data_snapshot", "chart_config"},
+}
+
+AGGREGATE_FUNCTIONS = {"sum", "count", "avg", "min", "max"}
+
+_IDENTIFIER_RE = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+
+_FILTER_METHODS = {
+    "eq": "eq",
+    "gt": "gt",
+    "lt": "lt",
+    "gte": "gte",
+    "lte": "lte",
+    "like": "like",
+    "ilike": "ilike",
+    "in": "in_",
+}
+
+
+def normalize_query_plan(response_json: dict):
+    """Return `(queries, join_on)` from a Gemini response.
+
+    Accepts the multi-query contract (`queries` list + optional `join_on`) and the
+    legacy single `query` object. Every query gets a unique `name` (defaults to `q1`,
+    `q2`...; repeated names get a `_2`, `_3`... suffix so their results stay apart).
+    """
+    raw_queries = response_json.get("queries")
+    if not isinstance(raw_queries, list):
+        single = response_json.get("query")
+        raw_queries = [single] if isinstance(single, dict) else []
+
+    queries: list[dict] = []
+    used: set[str] = set()
+    for i, query_obj in enumerate(raw_queries, start=1):
+        if not isinstance(query_obj, dict) or not query_obj.get("table"):
+            continue
+        name = query_obj.get("name")
+        name = name.strip() if isinstance(name, str) and name.strip() else f"q{i}"
+        unique, n = name, 2
+        while unique in used:
+            unique, n = f"{name}_{n}", n + 1
+        used.add(unique)
+        queries.append({**query_obj, "name": unique})
+
+    join_on = response_json.get("join_on")
+    if isinstance(join_on, str):
+        join_on = [join_on]
+    if not isinstance(join_on, list):
+        join_on = []
+    join_on = [k for k in join_on if isinstance(k, str) and k]
+
+    return queries, join_on
+
+
+def _split_select(select: str) -> list[str]:
+    """Split a PostgREST select string on top-level commas (embeds keep their inner lists)."""
+    items: list[str] = []
+    depth = 0
+    current = ""
+    for ch in select:
+        if ch == "(":
+            depth += 1
+        elif ch == ")":
+            depth -= 1
+        if ch == "," and depth == 0:
+            items.append(current.strip())
+            current = ""
+        else:
+            current += ch
+    if current.strip():
+        items.append(current.strip())
+    return items
+
+
+def _strip_alias_and_cast(item: str) -> str:
+    # "alias:column::text" -> "column"
+    if ":" in item.split("::", 1)[0]:
+        item = item.split(":", 1)[1]
+    return item.split("::", 1)[0].strip()
+
+
+def _validate_select(table: str, select: str, registry: dict[str, dict], notes: list[str]) -> str:
+    """Check every selected column / embed against the registry and return the projected select."""
+    columns = registry[table].get("columns") or []
+    if not select or select.strip() == "*":
+        heavy = HEAVY_COLUMNS.get(table, set())
+        projected = [c for c in columns if c not in heavy]
+        if not projected:
+            return "*"
+        notes.append(f"projected '*' to {len(projected)} columns")
+        return ", ".join(projected)
+
+    kept: list[str] = []
+    for item in _split_select(select):
+        if "(" in item:
+            relation = _strip_alias_and_cast(item.split("(", 1)[0]).split("!", 1)[0].strip()
+            if relation not in registry:
+                raise ValueError(f"Unknown embedded table '{relation}' in select.")
+            inner = item[item.index("(") + 1:item.rindex(")")]
+            try:
+                validated = _validate_select(relation, inner, registry, notes)
+            except ValueError as e:
+                if not str(e).startswith("None of the selected columns"):
+                    raise
+                notes.append(f"dropped embed '{relation}' (none of its columns exist)")
+                continue
+            # Send only the validated inner columns, so the notes match the request.
+            kept.append(f"{item[:item.index('(')]}({validated}){item[item.rindex(')') + 1:]}")
+            continue
+
+        column = _strip_alias_and_cast(item)
+        if column == "*" or column in columns:
+            kept.append(item)
+        else:
+            notes.append(f"dropped unknown column '{column}'")
+
+    if not kept:
+        raise ValueError(f"None of the selected columns exist in '{table}'.")
+    return ", ".join(kept)
+
+
+def _validate_column_ref(table: str, column, registry: dict[str, dict], allow_embedded: bool = True) -> None:
+    """Accept `column` or, when `allow_embedded`, `relation.column` (filters on embedded resources)."""
+    if not isinstance(column, str) or not column:
+        raise ValueError(f"Missing column for table '{table}'.")
+    if "." in column and allow_embedded:
+        relation, sub_column = column.split(".", 1)
+        if relation in registry and sub_column in (registry[relation].get("columns") or []):
+            return
+    elif column in (registry[table].get("columns") or []):
+        return
+    raise ValueError(f"Unknown column '{column}' for table '{table}'.")
+
+
+def _validate_aggregate(table: str, aggregate, registry: dict[str, dict]):
+    if not aggregate:
+        return None
+    if not isinstance(aggregate, dict):
+        raise ValueError("'aggregate' must be an object.")
+
+    group_by = aggregate.get("group_by") or []
+    if isinstance(group_by, str):
+        group_by = [group_by]
+    metrics = aggregate.get("metrics") or []
+    if not isinstance(metrics, list) or not metrics:
+        raise ValueError("'aggregate.metrics' must be a non-empty list.")
+
+    # Aggregates are pushed down as `alias:column.fn()`, so only the table's own columns qualify.
+    for column in group_by:
+        _validate_column_ref(table, column, registry, allow_embedded=False)
+
+    clean_metrics: list[dict] = []
+    for metric in metrics:
+        if not isinstance(metric, dict):
+            raise ValueError("Each aggregate metric must be an object.")
+        fn = str(metric.get("fn", "")).lower()
+        if fn not in AGGREGATE_FUNCTIONS:
+            raise ValueError(f"Unsupported aggregate function '{fn}'.")
+        column = metric.get("column")
+        if fn == "count" and not column:
+            column = None
+        else:
+            _validate_column_ref(table, column, registry, allow_embedded=False)
+        alias = metric.get("alias") or (f"{fn}_{column}" if column else "count")
+        if not _IDENTIFIER_RE.match(alias):
+            raise ValueError(f"Invalid aggregate alias '{alias}'.")
+        clean_metrics.append({"fn": fn, "column": column, "alias": alias})
+
+    return {"group_by": list(group_by), "metrics": clean_metrics}
+
+
+def guard_query_object(query_obj: dict, registry: dict[str, dict]):
+    """Validate a plan query against the schema registry and apply the row caps.
+
+    Returns `(guarded_query, notes)`; `notes` lists any adjustments (capped limit,
+    projection...). Raises `ValueError` for unknown tables/columns or bad clauses.
+    """
+    table = query_obj.get("table")
+    if table not in registry:
+        raise ValueError(f"Unknown table '{table}'.")
+
+    notes: list[str] = []
+    guarded = dict(query_obj)
+
+    guarded["aggregate"] = _validate_aggregate(table, query_obj.get("aggregate"), registry)
+    if not guarded["aggregate"]:
+        guarded["select"] = _validate_select(table, query_obj.get("select", "*"), registry, notes)
+
+    filters = query_obj.get("filters") or []
+    if not isinstance(filters, list):
+        raise ValueError("'filters' must be a list.")
+    for f in filters:
+        if isinstance(f, dict) and f.get("column"):
+            _validate_column_ref(table, f["column"], registry)
+            if f.get("operator") not in _FILTER_METHODS:
+                raise ValueError(f"Unsupported operator '{f.get('operator')}'.")
+    guarded["filters"] = filters
+
+    order_by = query_obj.get("order_by")
+    if order_by:
+        aliases = {m["alias"] for m in guarded["aggregate"]["metrics"]} if guarded["aggregate"] else set()
+        if order_by not in aliases:
+            _validate_column_ref(table, order_by, registry)
+
+    cap = TABLE_ROW_CAPS.get(table, DEFAULT_ROW_CAP)
+    try:
+        limit = int(query_obj.get("limit") or DEFAULT_QUERY_LIMIT)
+    except (TypeError, ValueError):
+        limit = DEFAULT_QUERY_LIMIT
+    if limit > cap:
+        notes.append(f"limit capped from {limit} to {cap}")
+        limit = cap
+    guarded["limit"] = max(1, limit)
+
+    return guarded, notes
+
+
+def _aggregate_select(aggregate: dict) -> str:
+    parts = list(aggregate["group_by"])
+    for metric in aggregate["metrics"]:
+        if metric["column"]:
+            parts.append(f"{metric['alias']}:{metric['column']}.{metric['fn']}()")
+        else:
+            parts.append(f"{metric['alias']}:count()")
+    return ", ".join(parts)
+
+
+def _aggregate_locally(df: pd.DataFrame, aggregate: dict) -> pd.DataFrame:
+    """Fallback used when the server has PostgREST aggregates disabled."""
+    group_by = [c for c in aggregate["group_by"] if c in df.columns]
+    if not group_by:
+        row = {}
+        for metric in aggregate["metrics"]:
+            if metric["column"] is None:
+                row[metric["alias"]] = len(df)
+            else:
+                series = df[metric["column"]]
+                row[metric["alias"]] = series.mean() if metric["fn"] == "avg" else getattr(series, metric["fn"])()
+        return pd.DataFrame([row])
+
+    named = {}
+    for metric in aggregate["metrics"]:
+        if metric["column"] is None:
+            named[metric["alias"]] = (group_by[0], "size")
+        else:
+            named[metric["alias"]] = (metric["column"], "mean" if metric["fn"] == "avg" else metric["fn"])
+    return df.groupby(group_by, as_index=False, dropna=False).agg(**named)
+
+
+def _apply_filters(q, filters: list):
+    for f in filters:
+        if isinstance(f, dict):
+            col = f.get("column")
+            method = _FILTER_METHODS.get(f.get("operator"))
+            if col and method:
+                # Structured responses send `in` lists as `values`.
+                value = f["values"] if method == "in_" and "values" in f else f.get("value")
+                q = getattr(q, method)(col, value)
+    return q
+
+
+def execute_query_object(supabase_client, query_obj: dict, notes: list[str] | None = None) -> pd.DataFrame:
+    """Run one guarded `query` object from the Gemini contract and return the flattened rows.
+
+    `query_obj` must come from `guard_query_object`. Aggregates and their ordering
+    are pushed down to PostgREST; the limit then applies to the grouped result.
+    Results that hit the row cap carry the reason in `df.attrs["partial"]`.
+    """
+    notes = notes if notes is not None else []
+    table = query_obj.get("table")
+    order_by = query_obj.get("order_by")
+    descending = query_obj.get("order_direction", "desc") == "desc"
+    limit = query_obj["limit"]
+    filters = query_obj.get("filters") or []
+    aggregate = query_obj.get("aggregate")
+
+    if aggregate:
+        cap = TABLE_ROW_CAPS.get(table, DEFAULT_ROW_CAP)
+        q = _apply_filters(supabase_client.table(table).select(_aggregate_select(aggregate)), filters)
+        if order_by in {m["alias"] for m in aggregate["metrics"]} | set(aggregate["group_by"]):
+            # Rank on the server: with more groups than `cap`, a local sort would only see some of them.
+            q = q.order(order_by, desc=descending)
+        try:
+            with trace_span("supabase", table=table, aggregate=True):
+                res = q.limit(cap).execute()
+            df = flatten_records(res.data) if res.data else pd.DataFrame()
+            notes.append("aggregated on the server")
+            if len(res.data or []) >= cap:
+                notes.append(f"row cap {cap} reached; further groups were not fetched")
+                df.attrs["partial"] = f"returned {cap:,} groups, the row cap for `{table}`; groups beyond it were not fetched."
+        except Exception as e:
+            # PostgREST rejects aggregate functions unless `db-aggregates-enabled` is on.
+            if "aggregate" not in str(e).lower() and "PGRST123" not in str(e):
+                raise
+            raw_columns = list(aggregate["group_by"]) + [m["column"] for m in aggregate["metrics"] if m["column"]]
+            select = ", ".join(dict.fromkeys(raw_columns)) or "*"
+            with trace_span("supabase", table=table, aggregate=False):
+                res = _apply_filters(supabase_client.table(table).select(select), filters).limit(cap).execute()
+            with trace_span("dataframe"):
+                raw = flatten_records(res.data) if res.data else pd.DataFrame()
+                df = _aggregate_locally(raw, aggregate) if not raw.empty else raw
+            notes.append(f"server aggregates disabled; aggregated {len(raw)} rows locally")
+            if len(raw) >= cap:
+                # More rows may match than were fetched: sums and counts are lower bounds.
+                notes.append(f"row cap {cap} reached; aggregate is partial")
+                df.attrs["partial"] = (
+                    f"was aggregated over only the first {cap:,} matching rows of `{table}` "
+                    "(server aggregates are disabled), so totals and counts may be understated."
+                )
+
+        if not df.empty and order_by in df.columns:
+            df = df.sort_values(order_by, ascending=not descending)
+        return df.head(limit).reset_index(drop=True)
+
+    q = _apply_filters(supabase_client.table(table).select(query_obj.get("select", "*")), filters)
+
+    if order_by:
+        q = q.order(order_by, desc=descending)
+
+    with trace_span("supabase", table=table) as span_attrs:
+        res = q.limit(limit).execute()
+        span_attrs["rows"] = len(res.data or [])
+    # Flatten nested JSON responses (e.g. amc_lifestyle: {name: ...})
+    with trace_span("dataframe"):
+        return flatten_records(res.data) if res.data else pd.DataFrame()
+
+
+def _timed_query(supabase_client, query_obj: dict, registry: dict[str, dict], scope: dict | None = None):
+    t0 = time.perf_counter()
+    notes: list[str] = []
+    try:
+        with trace_span(f"query.{query_obj['name']}", table=query_obj.get("table")):
+            guarded, notes = guard_query_object(query_obj, registry)
+            guarded, scope_note = apply_scope_filters(guarded, scope, registry)
+            if scope_note:
+                notes.append(scope_note)
+            df = execute_query_object(supabase_client, guarded, notes)
+        error = None
+        partial = df.attrs.get("partial")
+        if guarded.get("scope_error"):
+            partial = (
+                f"returned no `{query_obj.get('table')}` rows for the selected advertisers: "
+                f"their ids could not be resolved ({guarded['scope_error']}). Try again."
+            )
+    except Exception as e:
+        df = pd.DataFrame()
+        error = str(e)
+        partial = None
+    timing = {
+        "name": query_obj["name"],
+        "table": query_obj.get("table"),
+        "rows": len(df),
+        "seconds": round(time.perf_counter() - t0, 3),
+        "error": error,
+        "notes": notes,
+        # Why the result may be incomplete (an aggregate hit the row cap), or None.
+        "partial": partial,
+    }
+    return df, timing
+
+
+def merge_query_results(frames: dict[str, pd.DataFrame], join_on: list[str]):
+    """Combine the per-query frames into one DataFrame.
+
+    With `join_on`, frames are outer-joined on those keys and clashing non-key
+    columns are prefixed with the query name (`spend.asin`...). Without join keys
+    (or when a frame lacks them) frames are stacked with a `query` column.
+    Returns `(df, strategy)`, where `strategy` describes what was done
+    ("join on ...", "stacked", "single result" or "no rows").
+    """
+    non_empty = {name: df for name, df in frames.items() if df is not None and not df.empty}
+    if not non_empty:
+        return pd.DataFrame(), "no rows"
+    if len(non_empty) == 1:
+        return next(iter(non_empty.values())), "single result"
+
+    if join_on and all(all(k in df.columns for k in join_on) for df in non_empty.values()):
+        seen: dict[str, int] = {}
+        for df in non_empty.values():
+            for col in df.columns:
+                if col not in join_on:
+                    seen[col] = seen.get(col, 0) + 1
+
+        merged = None
+        for name, df in non_empty.items():
+            renamed = df.rename(columns={c: f"{name}.{c}" for c in df.columns if seen.get(c, 0) > 1})
+            merged = renamed if merged is None else merged.merge(renamed, on=join_on, how="outer")
+        return merged, f"join on {', '.join(join_on)}"
+
+    stacked = [df.assign(query=name) for name, df in non_empty.items()]
+    strategy = "stacked (a result lacks the join keys)" if join_on else "stacked"
+    return pd.concat(stacked, ignore_index=True, sort=False), strategy
+
+
+def execute_query_plan(
+    supabase_client,
+    queries: list[dict],
+    join_on: list[str] | None = None,
+    scope: dict | None = None,
+):
+    """Execute the queries concurrently on a bounded thread pool and merge them locally.
+
+    Every query is checked by `guard_query_object` first, then restricted to `scope`
+    (see `modules.prefetch.apply_scope_filters`) when given. Returns `(df, timings, merge)`
+    where `timings` has one entry per query (`name`, `table`, `rows`, `seconds`,
+    `error`, `notes`, `partial`) and `merge` is the strategy `merge_query_results` used.
+    """
+    if not queries:
+        return pd.DataFrame(), [], None
+
+    registry = get_schema_registry()
+
+    if len(queries) == 1:
+        df, timing = _timed_query(supabase_client, queries[0], registry, scope)
+        return df, [timing], None
+
+    workers = min(MAX_PARALLEL_QUERIES, len(queries))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="amc-query") as pool:
+        run_query = bind_trace_context(lambda q: _timed_query(supabase_client, q, registry, scope))
+        results = list(pool.map(run_query, queries))
+
+    frames = {timing["name"]: df for df, timing in results}
+    timings = [timing for _df, timing in results]
+    with trace_span("merge", queries=len(frames)):
+        merged, merge = merge_query_results(frames, join_on or [])
+    return merged, timings, merge
+
+
+def partial_result_warnings(timings: list[dict]) -> list[str]:
+    """User-facing warnings for incomplete results (row cap reached, chat scope unresolved)."""
+    return [
+        f"⚠️ Partial result: `{t['name']}` {t['partial']}"
+        for t in timings
+        if t.get("partial")
+    ]
+
+
+def describe_query_plan(queries: list[dict], merge: str | None, timings: list[dict]) -> str:
+    """Render the executed plan and per-query timings for the "View Generated SQL" expander."""
+    lines = ["-- Dynamic Query Generated by Gemini"]
+    timing_by_name = {t["name"]: t for t in timings}
+    for query_obj in queries:
+        timing = timing_by_name.get(query_obj["name"], {})
+        lines.append(f"-- [{query_obj['name']}] Table: {query_obj.get('table')}")
+        lines.append(f"--     Select: {query_obj.get('select', '*')}")
+        lines.append(f"--     Filters: {query_obj.get('filters', [])}")
+        if query_obj.get("aggregate"):
+            lines.append(f"--     Aggregate: {query_obj['aggregate']}")
+        for note in timing.get("notes") or []:
+            lines.append(f"--     Guard: {note}")
+        if timing:
+            status = f"error: {timing['error']}" if timing.get("error") else f"{timing['rows']} rows"
+            lines.append(f"--     {status} in {timing['seconds']:.3f}s")
+    if merge:
+        lines.append(f"-- Merge: {merge}")
+    return "\n".join(lines)
@@ -0,0 +1,66 @@
+import functools
+import time
+from contextlib import contextmanager
+
+import pandas as pd
+import streamlit as st
+
+# Per-session render timings: area -> {"runs", "last_ms", "total_ms", "max_ms", "payload_bytes"}.
+_STATE_KEY = "render_costs"
+
+
+def _new_entry() -> dict:
+    return {"runs": 0, "last_ms": 0.0, "total_ms": 0.0, "max_ms": 0.0, "payload_bytes": None}
+
+
+@contextmanager
+def measure_render(area: str):
+    """Record how long the block takes to render under `area` (kept in session state)."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        ms = (time.perf_counter() - started) * 1000
+        costs = st.session_state.setdefault(_STATE_KEY, {})
+        entry = costs.setdefault(area, _new_entry())
+        entry["runs"] += 1
+        entry["last_ms"] = ms
+        entry["total_ms"] += ms
+        entry["max_ms"] = max(entry["max_ms"], ms)
+
+
+def measured_fragment(area: str, **fragment_kwargs):
+    """`st.fragment` whose runs (full-page or its own reruns) are timed under `area`."""
+
+    def decorator(fn):
+        @functools.wraps(fn)
+        def _timed(*args, **kwargs):
+            with measure_render(area):
+                return fn(*args, **kwargs)
+
+        return st.fragment(**fragment_kwargs)(_timed)
+
+    return decorator
+
+
+def record_payload(area: str, nbytes: int) -> None:
+    """Remember roughly how many bytes the last run of `area` sent to the browser."""
+    costs = st.session_state.setdefault(_STATE_KEY, {})
+    costs.setdefault(area, _new_entry())["payload_bytes"] = nbytes
+
+
+def render_cost_table() -> pd.DataFrame:
+    """This session's render timings per area, most expensive first."""
+    rows = [
+        {
+            "area": area,
+            "runs": entry["runs"],
+            "last_ms": round(entry["last_ms"], 1),
+            "avg_ms": round(entry["total_ms"] / entry["runs"], 1) if entry["runs"] else 0.0,
+            "max_ms": round(entry["max_ms"], 1),
+            "payload_kb": round(entry["payload_bytes"] / 1024, 1) if entry["payload_bytes"] is not None else None,
+        }
+        for area, entry in st.session_state.get(_STATE_KEY, {}).items()
+    ]
+    df = pd.DataFrame(rows)
+    return df.sort_values("avg_ms", ascending=False) if not df.empty else df
@@ -0,0 +1,187 @@
+import json
+import threading
+
+from modules.query_executor import AGGREGATE_FUNCTIONS
+
+FILTER_OPERATORS = ["eq", "gt", "lt", "gte", "lte", "like", "ilike", "in"]
+CHART_TYPES = ["bar", "line"]
+
+# Response contract of the dynamic-query path, passed to Gemini as `response_schema`
+# (OpenAPI subset understood by google-genai). Filter values are strings; the `in`
+# operator takes `values` instead.
+_FILTER_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "column": {"type": "STRING"},
+        "operator": {"type": "STRING", "enum": FILTER_OPERATORS},
+        "value": {"type": "STRING"},
+        "values": {"type": "ARRAY", "items": {"type": "STRING"}},
+    },
+    "required": ["column", "operator"],
+}
+
+_AGGREGATE_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "group_by": {"type": "ARRAY", "items": {"type": "STRING"}},
+        "metrics": {
+            "type": "ARRAY",
+            "items": {
+                "type": "OBJECT",
+                "properties": {
+                    "fn": {"type": "STRING", "enum": sorted(AGGREGATE_FUNCTIONS)},
+                    "column": {"type": "STRING"},
+                    "alias": {"type": "STRING"},
+                },
+                "required": ["fn"],
+            },
+        },
+    },
+    "required": ["metrics"],
+}
+
+_QUERY_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "name": {"type": "STRING"},
+        "table": {"type": "STRING"},
+        "select": {"type": "STRING"},
+        "order_by": {"type": "STRING"},
+        "order_direction": {"type": "STRING", "enum": ["asc", "desc"]},
+        "limit": {"type": "INTEGER"},
+        "filters": {"type": "ARRAY", "items": _FILTER_SCHEMA},
+        "aggregate": _AGGREGATE_SCHEMA,
+    },
+    "required": ["table"],
+}
+
+AGENT_RESPONSE_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "response_text": {"type": "STRING"},
+        "query": _QUERY_SCHEMA,
+        "queries": {"type": "ARRAY", "items": _QUERY_SCHEMA},
+        "join_on": {"type": "ARRAY", "items": {"type": "STRING"}},
+        "chart_config": {
+            "type": "OBJECT",
+            "nullable": True,
+            "properties": {
+                "type": {"type": "STRING", "enum": CHART_TYPES},
+                "x": {"type": "STRING"},
+                "y": {"type": "STRING"},
+            },
+        },
+    },
+    "required": ["response_text"],
+}
+
+_stats_lock = threading.Lock()
+_parse_stats = {"responses": 0, "invalid": 0, "repaired": 0, "failed": 0}
+
+
+def _validate_query(query_obj, path: str) -> list[str]:
+    if not isinstance(query_obj, dict):
+        return [f"{path} must be an object"]
+    errors = []
+    if not isinstance(query_obj.get("table"), str) or not query_obj["table"].strip():
+        errors.append(f"{path}.table must be a non-empty string")
+    for key in ("select", "order_by", "name"):
+        if query_obj.get(key) is not None and not isinstance(query_obj[key], str):
+            errors.append(f"{path}.{key} must be a string")
+    if query_obj.get("order_direction") not in (None, "asc", "desc"):
+        errors.append(f"{path}.order_direction must be 'asc' or 'desc'")
+    limit = query_obj.get("limit")
+    if limit is not None and (isinstance(limit, bool) or not isinstance(limit, int) or limit <= 0):
+        errors.append(f"{path}.limit must be a positive integer")
+
+    filters = query_obj.get("filters")
+    if filters is not None and not isinstance(filters, list):
+        errors.append(f"{path}.filters must be a list")
+    for i, f in enumerate(filters or []):
+        if not isinstance(f, dict) or not isinstance(f.get("column"), str):
+            errors.append(f"{path}.filters[{i}] must be an object with a 'column'")
+        elif f.get("operator") not in FILTER_OPERATORS:
+            errors.append(f"{path}.filters[{i}].operator must be one of {', '.join(FILTER_OPERATORS)}")
+        elif f["operator"] == "in" and not isinstance(f.get("values", f.get("value")), list):
+            errors.append(f"{path}.filters[{i}] with operator 'in' needs a 'values' list")
+
+    aggregate = query_obj.get("aggregate")
+    if aggregate is not None:
+        metrics = aggregate.get("metrics") if isinstance(aggregate, dict) else None
+        if not isinstance(metrics, list) or not metrics:
+            errors.append(f"{path}.aggregate.metrics must be a non-empty list")
+        else:
+            for i, m in enumerate(metrics):
+                if not isinstance(m, dict) or m.get("fn") not in AGGREGATE_FUNCTIONS:
+                    errors.append(f"{path}.aggregate.metrics[{i}].fn must be one of {', '.join(sorted(AGGREGATE_FUNCTIONS))}")
+    return errors
+
+
+def validate_agent_response(response_json) -> list[str]:
+    """Check a decoded response against `AGENT_RESPONSE_SCHEMA`; returns error messages."""
+    if not isinstance(response_json, dict):
+        return ["response must be a JSON object"]
+
+    errors = []
+    if not isinstance(response_json.get("response_text"), str):
+        errors.append("response_text must be a string")
+    if response_json.get("query") is not None:
+        errors += _validate_query(response_json["query"], "query")
+    queries = response_json.get("queries")
+    if queries is not None:
+        if not isinstance(queries, list):
+            errors.append("queries must be a list")
+        else:
+            for i, query_obj in enumerate(queries):
+                errors += _validate_query(query_obj, f"queries[{i}]")
+    join_on = response_json.get("join_on")
+    if join_on is not None and not (isinstance(join_on, list) and all(isinstance(k, str) for k in join_on)):
+        errors.append("join_on must be a list of column names")
+    chart = response_json.get("chart_config")
+    if chart is not None and (not isinstance(chart, dict) or chart.get("type") not in CHART_TYPES):
+        errors.append(f"chart_config.type must be one of {', '.join(CHART_TYPES)} (or chart_config null)")
+    return errors
+
+
+def parse_agent_response(raw_response: str):
+    """Decode and validate a model response. Returns `(response_json, errors)`."""
+    clean_json = (raw_response or "").strip()
+    # Markdown fences only show up when the schema is not enforced (e.g. older models).
+    if clean_json.startswith("```"):
+        clean_json = clean_json.split("\n", 1)[-1] if "\n" in clean_json else ""
+    if clean_json.endswith("```"):
+        clean_json = clean_json[:-3]
+    try:
+        response_json = json.loads(clean_json)
+    except json.JSONDecodeError as e:
+        return None, [f"invalid JSON: {e}"]
+    return response_json, validate_agent_response(response_json)
+
+
+def build_repair_prompt(full_prompt: str, raw_response: str, errors: list[str]) -> str:
+    """Prompt for the single repair pass after a response failed validation."""
+    problems = "\n".join(f"- {e}" for e in errors)
+    return (
+        f"{full_prompt}\n\n[Your previous answer did not match the required JSON format]\n"
+        f"{raw_response}\n\n[Problems]\n{problems}\n\n"
+        "Return the corrected JSON object only."
+    )
+
+
+def record_parse_outcome(status: str) -> None:
+    """Count a response as `ok`, `repaired` (invalid, fixed by the repair pass) or `failed`."""
+    with _stats_lock:
+        _parse_stats["responses"] += 1
+        if status != "ok":
+            _parse_stats["invalid"] += 1
+            _parse_stats[status] += 1
+
+
+def parse_failure_metrics() -> dict:
+    """First-pass invalid rate and final failure rate for this server process."""
+    with _stats_lock:
+        stats = dict(_parse_stats)
+    total = stats["responses"] or 1
+    stats["invalid_rate"] = round(stats["invalid"] / total, 4)
+    stats["failure_rate"] = round(stats["failed"] / total, 4)
+    return stats
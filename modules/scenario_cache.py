@@ -0,0 +1,152 @@
+import threading
+import time
+from collections import OrderedDict, defaultdict
+
+import pandas as pd
+
+from modules.database import (
+    get_company_marketplace_ids_for_instance_ids_cached,
+    get_execution_ids_for_instance_ids_cached,
+    get_execution_watermark_cached,
+)
+
+# Quick-action scenarios whose results depend only on the scope and date window.
+MEMOIZED_SCENARIOS = {
+    "time_to_conversion",
+    "ntb_metrics",
+    "overlap",
+    "gateway_asins",
+    "lifestyle_segments",
+    "spend_trend",
+    "dashboard",
+}
+
+SCENARIO_CACHE_TTL_SECONDS = 15 * 60
+SCENARIO_CACHE_MAX_ENTRIES = 256
+
+# Shared by every session of this server process.
+_lock = threading.Lock()
+_entries: OrderedDict = OrderedDict()
+_stats: dict[str, dict[str, int]] = defaultdict(lambda: {"hits": 0, "misses": 0, "invalidated": 0})
+
+
+def scenario_cache_key(scenario: str, instance_ids, start_date: str | None, end_date: str | None) -> tuple:
+    """`(scenario, sorted instance ids, start_date, end_date)`."""
+    ids = tuple(sorted({int(i) for i in instance_ids or []}))
+    return (scenario, ids, start_date, end_date)
+
+
+def get_scenario_result(key: tuple):
+    """Return a copy of the memoized result for `key`, or None.
+
+    Entries expire after their TTL and are dropped once a newer
+    `amc_query_execution` row exists for their instances (detected within the
+    watermark cache TTL).
+    """
+    scenario, ids = key[0], key[1]
+    watermark = get_execution_watermark_cached(ids)
+    with _lock:
+        entry = _entries.get(key)
+        if entry is None:
+            _stats[scenario]["misses"] += 1
+            return None
+        new_executions = entry["watermark"] != watermark
+        if new_executions or time.monotonic() - entry["stored_at"] > entry["ttl"]:
+            del _entries[key]
+            _stats[scenario]["invalidated"] += 1
+            _stats[scenario]["misses"] += 1
+            result = None
+        else:
+            _entries.move_to_end(key)
+            _stats[scenario]["hits"] += 1
+            result = dict(entry["result"])
+
+    if result is None:
+        if new_executions:
+            # Everything else cached for these instances predates the new rows too.
+            invalidate_scenario_cache(ids or None)
+        return None
+
+    if isinstance(result.get("data"), pd.DataFrame):
+        result["data"] = result["data"].copy()
+    return result
+
+
+def store_scenario_result(key: tuple, result: dict, ttl_seconds: float | None = None) -> None:
+    """Memoize a scenario result (text, sql, data, chart_config) under `key`.
+
+    `ttl_seconds` overrides `SCENARIO_CACHE_TTL_SECONDS` (precomputed results live
+    until the next scheduled run).
+    """
+    watermark = get_execution_watermark_cached(key[1])
+    entry = {
+        "result": dict(result),
+        "watermark": watermark,
+        "stored_at": time.monotonic(),
+        "ttl": ttl_seconds or SCENARIO_CACHE_TTL_SECONDS,
+    }
+    with _lock:
+        _entries[key] = entry
+        _entries.move_to_end(key)
+        while len(_entries) > SCENARIO_CACHE_MAX_ENTRIES:
+            _entries.popitem(last=False)
+
+
+def invalidate_scenario_cache(instance_ids=None) -> int:
+    """Drop memoized results touching `instance_ids` (all when None). Returns the number dropped.
+
+    Call after loading new `amc_query_execution` rows; the execution-id lookups are
+    cleared as well so the next run sees the new executions.
+    """
+    ids = {int(i) for i in instance_ids} if instance_ids is not None else None
+    with _lock:
+        stale = [k for k in _entries if ids is None or not k[1] or ids & set(k[1])]
+        for key in stale:
+            del _entries[key]
+            _stats[key[0]]["invalidated"] += 1
+
+    get_execution_watermark_cached.clear()
+    get_execution_ids_for_instance_ids_cached.clear()
+    get_company_marketplace_ids_for_instance_ids_cached.clear()
+    return len(stale)
+
+
+def _result_nbytes(result: dict) -> int:
+    total = sum(len(str(result.get(k) or "")) for k in ("text", "sql"))
+    if isinstance(result.get("data"), pd.DataFrame):
+        total += int(result["data"].memory_usage(deep=True).sum())
+    return total
+
+
+def scenario_cache_sizes() -> list[tuple[tuple, int]]:
+    """`(key, approximate bytes)` for every memoized result."""
+    with _lock:
+        entries = list(_entries.items())
+    return [(key, _result_nbytes(entry["result"])) for key, entry in entries]
+
+
+def drop_scenario_result(key: tuple) -> bool:
+    """Forget one memoized result (the memory monitor frees the largest first)."""
+    with _lock:
+        if key not in _entries:
+            return False
+        del _entries[key]
+        _stats[key[0]]["invalidated"] += 1
+        return True
+
+
+def scenario_cache_stats() -> pd.DataFrame:
+    """Hits, misses, invalidations and hit rate per scenario for this server process."""
+    with _lock:
+        rows = [{"scenario": name, **counts} for name, counts in _stats.items()]
+        cached = defaultdict(int)
+        for key in _entries:
+            cached[key[0]] += 1
+    if not rows:
+        return pd.DataFrame()
+
+    df = pd.DataFrame(rows)
+    df["entries"] = df["scenario"].map(cached).fillna(0).astype(int)
+    lookups = (df["hits"] + df["misses"]).clip(lower=1)
+    df["hit_rate"] = (df["hits"] / lookups).round(3)
+    return df.sort_values("scenario").reset_index(drop=True)
@@ -0,0 +1,243 @@
+import re
+
+from modules.database import get_table_schemas_cached
+
+# Static schema used as the fallback when the live OpenAPI document is not
+# reachable, and as the source of descriptions / keywords for known tables.
+# Live introspection (see `get_table_schemas_cached`) overrides the columns.
+STATIC_TABLE_SCHEMAS: dict[str, dict] = {
+    "amc_campaign": {
+        "group": "amc",
+        "columns": ["campaign_id", "name"],
+        "description": "Campaign names.",
+        "references": [],
+        "keywords": ["campaign", "campaigns"],
+    },
+    "amc_chat_history": {
+        "group": "amc",
+        "columns": ["id", "session_id", "role", "content", "sql_query", "chart_config", "data_snapshot", "created_at"],
+        "description": "Assistant chat transcript.",
+        "references": [],
+        "keywords": ["chat", "conversation", "message", "history"],
+    },
+    "amc_instance": {
+        "group": "amc",
+        "columns": ["amc_instance_id", "company_id", "region_id", "name", "created_at", "instance_id"],
+        "description": "Registry of AMC Instances (Advertisers).",
+        "references": [],
+        "keywords": ["advertiser", "advertisers", "instance", "instances", "account", "brand", "brands"],
+    },
+    "amc_lifestyle": {
+        "group": "amc",
+        "columns": ["amc_lifestyle_id", "name"],
+        "description": "Lifestyle segment definitions.",
+        "references": [],
+        "keywords": ["lifestyle", "lifestyles", "segment", "segments"],
+    },
+    "amc_lifestyle_size": {
+        "group": "amc",
+        "columns": ["amc_lifestyle_size_id", "amc_query_execution_id", "size", "amc_lifestyle_id"],
+        "description": "Size of lifestyle segments.",
+        "references": ["amc_query_execution", "amc_lifestyle"],
+        "keywords": ["lifestyle", "lifestyles", "segment", "segments", "audience", "audiences", "demographic"],
+    },
+    "amc_ntb_gateway": {
+        "group": "amc",
+        "columns": ["amc_ntb_gateaway_api", "amc_query_execution_id", "users_with_purchase", "ntb_users", "asin", "gateway_asin_rank"],
+        "description": "Gateway ASINs driving NTB users.",
+        "references": ["amc_query_execution"],
+        "keywords": ["ntb", "new", "gateway", "acquisition", "entry", "asin", "asins"],
+    },
+    "amc_query_execution": {
+        "group": "amc",
+        "columns": ["amc_query_execution_id", "created_at", "amc_instance_id", "start_date", "end_date"],
+        "description": "Log of executed AMC queries.",
+        "references": ["amc_instance"],
+        "keywords": ["execution", "executions", "log", "status", "run", "runs"],
+    },
+    "amc_query_execution_company_marketplace": {
+        "group": "amc",
+        "columns": ["amc_query_execution_company_id", "amc_query_execution_id", "company_marketplace_id"],
+        "description": "Maps AMC query executions to company marketplaces.",
+        "references": ["amc_query_execution", "company_marketplace"],
+        "keywords": [],
+    },
+    "amc_sponsored_ads_dsp_overlap": {
+        "group": "amc",
+        "columns": ["id", "amc_query_execution_id", "exposure_group", "users_that_purchased", "unique_reach", "total_purchases", "total_product_sales"],
+        "description": "Unique and shared reach between Sponsored Ads and DSP.",
+        "references": ["amc_query_execution"],
+        "keywords": ["overlap", "dsp", "exposure", "reach", "sponsored"],
+    },
+    "amc_time_to_conversion": {
+        "group": "amc",
+        "columns": ["id", "amc_query_execution_id", "campaign_id", "time_to_conversion_bucket", "purchases", "total_brand_purchases"],
+        "description": "Distribution of days to conversion.",
+        "references": ["amc_query_execution"],
+        "keywords": ["conversion", "convert", "days", "bucket", "time"],
+    },
+    "ads_report": {
+        "group": "other",
+        "columns": ["report_id", "company_marketplace_id", "start_date", "end_date", "weekly", "asin", "clicks", "spend", "sales", "purchases", "impressions"],
+        "description": "Sponsored Ads performance by ASIN and period.",
+        "references": ["amc_query_execution_company_marketplace"],
+        "keywords": ["spend", "sales", "clicks", "impressions", "roas", "acos", "performance", "cost", "revenue", "trend", "asin", "asins"],
+    },
+    "company": {
+        "group": "other",
+        "columns": ["company_id", "created_at", "name"],
+        "description": "Companies.",
+        "references": [],
+        "keywords": ["company", "companies"],
+    },
+    "company_marketplace": {
+        "group": "other",
+        "columns": ["company_marketplace_id", "company_id", "marketplace_id"],
+        "description": "Company to marketplace assignments.",
+        "references": ["company", "marketplace"],
+        "keywords": [],
+    },
+    "marketplace": {
+        "group": "other",
+        "columns": ["marketplace_id", "country_code", "currency_id", "region_id", "country_name"],
+        "description": "Amazon marketplaces (countries).",
+        "references": [],
+        "keywords": ["marketplace", "marketplaces", "country", "countries", "currency"],
+    },
+    "region": {
+        "group": "other",
+        "columns": ["region_id", "endpoint_code", "aws_region", "name"],
+        "description": "Amazon Ads API regions.",
+        "references": [],
+        "keywords": ["region", "regions", "endpoint"],
+    },
+}
+
+# Column name parts that appear in most tables and say nothing about relevance.
+_GENERIC_TOKENS = {
+    "id", "name", "date", "start", "end", "created", "at", "total", "amc", "query",
+    "the", "a", "an", "of", "for", "by", "to", "in", "on", "and", "or", "me", "show",
+    "top", "list", "all", "with", "what", "which", "how", "many", "is", "are",
+}
+
+_WORD_RE = re.compile(r"[a-z0-9]+")
+
+# Column words alone select tables only when they point at this many or fewer.
+COLUMN_MATCH_MAX_TABLES = 3
+
+# Rough conversion used to report prompt sizes without a tokenizer.
+CHARS_PER_TOKEN = 4
+
+
+def get_schema_registry() -> dict[str, dict]:
+    """Return the merged schema registry (live columns + static metadata).
+
+    When the live schema is available it defines the set of tables and their
+    columns; descriptions and keywords come from `STATIC_TABLE_SCHEMAS`.
+    """
+    live = get_table_schemas_cached() or {}
+    if not live:
+        return {name: dict(info) for name, info in STATIC_TABLE_SCHEMAS.items()}
+
+    registry: dict[str, dict] = {}
+    for name, live_info in live.items():
+        static_info = STATIC_TABLE_SCHEMAS.get(name, {})
+        registry[name] = {
+            "group": static_info.get("group", "amc" if name.startswith("amc_") else "other"),
+            "columns": list(live_info.get("columns") or static_info.get("columns") or []),
+            "description": live_info.get("description") or static_info.get("description", ""),
+            "references": list(
+                dict.fromkeys(list(static_info.get("references") or []) + list(live_info.get("references") or []))
+            ),
+            "keywords": list(static_info.get("keywords", [])),
+        }
+    return registry
+
+
+def _tokens(text: str) -> set[str]:
+    words = set(_WORD_RE.findall((text or "").lower()))
+    # Cheap singularization so "segments" matches "segment".
+    words |= {w[:-1] for w in words if len(w) > 3 and w.endswith("s")}
+    return words - _GENERIC_TOKENS
+
+
+def _names_table(question: str, question_tokens: set[str], name: str, info: dict) -> bool:
+    """True if the question names the table: its full name, or one of its curated keywords.
+
+    Parts of compound names ("company" in `company_marketplace`) do not count, so
+    mapping tables are pulled in as references instead.
+    """
+    if question_tokens & (set(info.get("keywords") or []) - _GENERIC_TOKENS):
+        return True
+    text = " ".join(_WORD_RE.findall((question or "").lower()))
+    return re.search(rf"\b{re.escape(name.replace('_', ' '))}s?\b", text) is not None
+
+
+def _column_keywords(info: dict) -> set[str]:
+    keywords: set[str] = set()
+    for col in info.get("columns") or []:
+        keywords |= _tokens(col.replace("_", " "))
+    return keywords - _GENERIC_TOKENS
+
+
+def match_tables(question: str, registry: dict[str, dict], explicit_only: bool = False) -> list[str]:
+    """Tables the question refers to (no references, may be empty).
+
+    Tables named by name or keyword win. Column words only pick tables when no table
+    is named, and then only the best-covered ones, at most `COLUMN_MATCH_MAX_TABLES`
+    (a word that appears in many tables says nothing). `explicit_only` skips the
+    column fallback.
+    """
+    question_tokens = _tokens(question)
+    named = [name for name, info in registry.items() if _names_table(question, question_tokens, name, info)]
+    if named or explicit_only:
+        return named
+
+    scores = {name: len(question_tokens & _column_keywords(info)) for name, info in registry.items()}
+    best = max(scores.values(), default=0)
+    if best == 0:
+        return []
+    matched = [name for name, score in scores.items() if score == best]
+    return matched if len(matched) <= COLUMN_MATCH_MAX_TABLES else []
+
+
+def select_relevant_tables(question: str, registry: dict[str, dict]) -> list[str]:
+    """Pick the tables the question refers to (see `match_tables`), plus their direct references.
+
+    Returns every table when nothing matches, so vague questions keep the full schema.
+    """
+    matched = match_tables(question, registry)
+    if not matched:
+        return list(registry.keys())
+
+    selected = set(matched)
+    for name in matched:
+        for ref in registry[name].get("references") or []:
+            if ref in registry:
+                selected.add(ref)
+
+    # Preserve registry order for a stable prompt.
+    return [name for name in registry if name in selected]
+
+
+def build_schema_fragment(name: str, info: dict) -> str:
+    """Render a single table description for the system instruction."""
+    columns = ", ".join(info.get("columns") or [])
+    fragment = f"- {name} ({columns})"
+    description = info.get("description")
+    if description:
+        fragment += f" -- {description}"
+    return fragment
+
+
+def build_schema_section(tables: list[str], registry: dict[str, dict]) -> str:
+    """Assemble the schema block from per-table fragments, grouped like the original prompt."""
+    amc = [build_schema_fragment(t, registry[t]) for t in tables if registry[t].get("group") == "amc"]
+    other = [build_schema_fragment(t, registry[t]) for t in tables if registry[t].get("group") != "amc"]
+
+    parts: list[str] = []
+    if amc:
+        parts.append("-- AMC Tables\n" + "\n".join(amc))
+    if other:
+        parts.append("-- Other Related Tables\n" + "\n".join(other))
+    return "\n\n".join(parts)
@@ -0,0 +1,205 @@
+import numpy as np
+import pandas as pd
+
+LIFESTYLE_NAMES = [
+    "Fitness Enthusiasts", "Foodies", "Frequent Travelers", "Home Improvers", "Pet Owners",
+    "Gamers", "New Parents", "Outdoor Adventurers", "Beauty Mavens", "Tech Early Adopters",
+    "Book Lovers", "Green Living", "Luxury Shoppers", "Value Shoppers", "Music Lovers",
+    "Sports Fans", "Home Chefs", "Fashionistas", "Students", "Movie Buffs",
+]
+EXPOSURE_GROUPS = ["Sponsored Ads only", "DSP only", "Sponsored Ads + DSP"]
+TIME_TO_CONVERSION_BUCKETS = 14
+NTB_ROWS_PER_EXECUTION = 10
+LIFESTYLE_ROWS_PER_EXECUTION = 12
+
+
+def _asins(rng: np.random.Generator, n: int) -> np.ndarray:
+    digits = rng.choice(np.array(list("0123456789ABCDEFGHJKLMNPQRSTUVWXYZ")), size=(n, 8))
+    return np.char.add("B0", digits.view("<U8").ravel()).astype(object)
+
+
+def _days(base: np.datetime64, offsets) -> np.ndarray:
+    return base + np.asarray(offsets).astype("timedelta64[D]")
+
+
+def generate_amc_dataset(
+    n_instances: int = 25,
+    n_executions: int = 2_000,
+    ads_rows: int = 1_000_000,
+    n_asins: int = 5_000,
+    n_campaigns: int = 500,
+    start_date: str = "2025-01-01",
+    days: int = 365,
+    seed: int = 7,
+) -> dict[str, pd.DataFrame]:
+    """Build a synthetic, referentially consistent AMC dataset with NumPy.
+
+    Returns `{table: DataFrame}` using the column names of `STATIC_TABLE_SCHEMAS`.
+    Every execution belongs to an instance; each execution is mapped to a
+    marketplace of its instance's company, and `ads_report` rows only use mapped
+    marketplaces, so the scenario joins return data. Results tables hold a fixed
+    number of rows per execution. No per-row Python loops: a few million rows
+    take seconds.
+    """
+    rng = np.random.default_rng(seed)
+    base = np.datetime64(start_date, "D")
+
+    # --- Dimensions -----------------------------------------------------------
+    instance_ids = np.arange(1, n_instances + 1)
+    company = pd.DataFrame(
+        {
+            "company_id": instance_ids,
+            "created_at": _days(base, -rng.integers(30, 720, n_instances)),
+            "name": np.char.add("Company ", instance_ids.astype(str)).astype(object),
+        }
+    )
+    amc_instance = pd.DataFrame(
+        {
+            "amc_instance_id": instance_ids,
+            "company_id": instance_ids,
+            "region_id": rng.integers(1, 4, n_instances),
+            "name": np.char.add("Advertiser ", instance_ids.astype(str)).astype(object),
+            "created_at": company["created_at"].to_numpy(),
+            "instance_id": np.char.add("amc", rng.integers(10**7, 10**8, n_instances).astype(str)).astype(object),
+        }
+    )
+
+    # 1-3 marketplaces per company, stored contiguously so a company's range is [start, start + count).
+    cm_count = rng.integers(1, 4, n_instances)
+    cm_start = np.concatenate(([0], np.cumsum(cm_count)[:-1]))
+    n_cm = int(cm_count.sum())
+    company_marketplace = pd.DataFrame(
+        {
+            "company_marketplace_id": np.arange(1, n_cm + 1),
+            "company_id": np.repeat(instance_ids, cm_count),
+            "marketplace_id": rng.integers(1, 14, n_cm),
+        }
+    )
+
+    amc_campaign = pd.DataFrame(
+        {
+            "campaign_id": np.arange(1, n_campaigns + 1),
+            "name": np.char.add("Campaign ", np.arange(1, n_campaigns + 1).astype(str)).astype(object),
+        }
+    )
+    amc_lifestyle = pd.DataFrame(
+        {"amc_lifestyle_id": np.arange(1, len(LIFESTYLE_NAMES) + 1), "name": np.array(LIFESTYLE_NAMES, dtype=object)}
+    )
+    asin_pool = _asins(rng, n_asins)
+
+    # --- Executions -----------------------------------------------------------
+    exec_ids = np.arange(1, n_executions + 1)
+    exec_instance = rng.integers(1, n_instances + 1, n_executions)
+    exec_start = rng.integers(0, max(days - 30, 1), n_executions)
+    exec_length = rng.choice([7, 14, 30], n_executions)
+    amc_query_execution = pd.DataFrame(
+        {
+            "amc_query_execution_id": exec_ids,
+            "created_at": _days(base, exec_start + exec_length + rng.integers(1, 4, n_executions)),
+            "amc_instance_id": exec_instance,
+            "start_date": _days(base, exec_start),
+            "end_date": _days(base, exec_start + exec_length),
+        }
+    )
+    company_idx = exec_instance - 1
+    exec_cm = cm_start[company_idx] + (rng.random(n_executions) * cm_count[company_idx]).astype(int) + 1
+    amc_query_execution_company_marketplace = pd.DataFrame(
+        {
+            "amc_query_execution_company_id": exec_ids,
+            "amc_query_execution_id": exec_ids,
+            "company_marketplace_id": exec_cm,
+        }
+    )
+
+    # --- Ads report (weekly rows per mapped marketplace and ASIN) ---------------
+    mapped_cm = np.unique(exec_cm)
+    ad_start = rng.integers(0, days, ads_rows)
+    impressions = rng.lognormal(7.5, 1.2, ads_rows).astype(np.int64)
+    clicks = rng.binomial(impressions, rng.uniform(0.002, 0.02, ads_rows))
+    purchases = rng.binomial(clicks, rng.uniform(0.02, 0.15, ads_rows))
+    ads_report = pd.DataFrame(
+        {
+            "report_id": np.arange(1, ads_rows + 1),
+            "company_marketplace_id": mapped_cm[rng.integers(0, len(mapped_cm), ads_rows)],
+            "start_date": _days(base, ad_start),
+            "end_date": _days(base, ad_start + 6),
+            "weekly": True,
+            "asin": asin_pool[rng.integers(0, n_asins, ads_rows)],
+            "clicks": clicks,
+            "spend": np.round(clicks * rng.uniform(0.3, 2.5, ads_rows), 2),
+            "sales": np.round(purchases * rng.uniform(8, 120, ads_rows), 2),
+            "purchases": purchases,
+            "impressions": impressions,
+        }
+    )
+
+    # --- Per-execution result tables -----------------------------------------
+    k = NTB_ROWS_PER_EXECUTION
+    users = rng.lognormal(6, 1, n_executions * k).astype(np.int64) + 1
+    amc_ntb_gateway = pd.DataFrame(
+        {
+            "amc_ntb_gateaway_api": np.arange(1, n_executions * k + 1),
+            "amc_query_execution_id": np.repeat(exec_ids, k),
+            "users_with_purchase": users,
+            "ntb_users": rng.binomial(users, rng.uniform(0.2, 0.8, n_executions * k)),
+            "asin": asin_pool[rng.integers(0, n_asins, n_executions * k)],
+            "gateway_asin_rank": np.tile(np.arange(1, k + 1), n_executions),
+        }
+    )
+
+    b = TIME_TO_CONVERSION_BUCKETS
+    bucket_day = np.tile(np.arange(1, b + 1), n_executions)
+    ttc_purchases = rng.poisson(1000 / bucket_day)
+    amc_time_to_conversion = pd.DataFrame(
+        {
+            "id": np.arange(1, n_executions * b + 1),
+            "amc_query_execution_id": np.repeat(exec_ids, b),
+            "campaign_id": np.repeat(rng.integers(1, n_campaigns + 1, n_executions), b),
+            "time_to_conversion_bucket": np.char.add(bucket_day.astype(str), " days").astype(object),
+            "purchases": ttc_purchases,
+            "total_brand_purchases": ttc_purchases + rng.poisson(200 / bucket_day),
+        }
+    )
+
+    m = LIFESTYLE_ROWS_PER_EXECUTION
+    # Distinct segments per execution: argsort of random keys gives a per-row permutation.
+    segments = np.argsort(rng.random((n_executions, len(LIFESTYLE_NAMES))), axis=1)[:, :m] + 1
+    amc_lifestyle_size = pd.DataFrame(
+        {
+            "amc_lifestyle_size_id": np.arange(1, n_executions * m + 1),
+            "amc_query_execution_id": np.repeat(exec_ids, m),
+            "size": rng.lognormal(9, 1, n_executions * m).astype(np.int64),
+            "amc_lifestyle_id": segments.ravel(),
+        }
+    )
+
+    g = len(EXPOSURE_GROUPS)
+    reach = rng.lognormal(10, 1, n_executions * g).astype(np.int64) + 1
+    buyers = rng.binomial(reach, rng.uniform(0.005, 0.05, n_executions * g))
+    overlap_purchases = buyers + rng.poisson(buyers * 0.3)
+    amc_sponsored_ads_dsp_overlap = pd.DataFrame(
+        {
+            "id": np.arange(1, n_executions * g + 1),
+            "amc_query_execution_id": np.repeat(exec_ids, g),
+            "exposure_group": np.tile(np.array(EXPOSURE_GROUPS, dtype=object), n_executions),
+            "users_that_purchased": buyers,
+            "unique_reach": reach,
+            "total_purchases": overlap_purchases,
+            "total_product_sales": np.round(overlap_purchases * rng.uniform(10, 80, n_executions * g), 2),
+        }
+    )
+
+    return {
+        "company": company,
+        "amc_instance": amc_instance,
+        "company_marketplace": company_marketplace,
+        "amc_campaign": amc_campaign,
+        "amc_lifestyle": amc_lifestyle,
+        "amc_query_execution": amc_query_execution,
+        "amc_query_execution_company_marketplace": amc_query_execution_company_marketplace,
+        "ads_report": ads_report,
+        "amc_ntb_gateway": amc_ntb_gateway,
+        "amc_time_to_conversion": amc_time_to_conversion,
+        "amc_lifestyle_size": amc_lifestyle_size,
+        "amc_sponsored_ads_dsp_overlap": amc_sponsored_ads_dsp_overlap,
+    }
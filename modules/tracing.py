@@ -0,0 +1,116 @@
+import contextvars
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+# When set, every finished trace is appended to this file as JSON lines (one span per line).
+TRACE_EXPORT_PATH = os.environ.get("AMC_TRACE_EXPORT_PATH")
+
+_current_tracer: contextvars.ContextVar = contextvars.ContextVar("amc_tracer", default=None)
+_current_span_id: contextvars.ContextVar = contextvars.ContextVar("amc_span_id", default=None)
+
+
+class Tracer:
+    """Collects timed spans for a single agent request.
+
+    Spans are recorded relative to the tracer's start so they can be drawn as a
+    waterfall. Safe to use from worker threads (see `bind_trace_context`).
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.trace_id = uuid.uuid4().hex
+        self.started_at = time.time()
+        self._t0 = time.perf_counter()
+        self._lock = threading.Lock()
+        self._spans: list[dict] = []
+
+    @contextmanager
+    def span(self, name: str, **attrs):
+        span_id = uuid.uuid4().hex[:12]
+        parent_id = _current_span_id.get()
+        token = _current_span_id.set(span_id)
+        start = time.perf_counter()
+        record = {
+            "span_id": span_id,
+            "parent_id": parent_id,
+            "name": name,
+            "thread": threading.current_thread().name,
+            "attrs": dict(attrs),
+        }
+        try:
+            yield record["attrs"]
+        except Exception as e:
+            record["attrs"]["error"] = str(e)
+            raise
+        finally:
+            end = time.perf_counter()
+            _current_span_id.reset(token)
+            record["start_ms"] = round((start - self._t0) * 1000, 2)
+            record["duration_ms"] = round((end - start) * 1000, 2)
+            with self._lock:
+                self._spans.append(record)
+
+    def timings(self) -> list[dict]:
+        """Return the finished spans ordered by start time."""
+        with self._lock:
+            spans = list(self._spans)
+        return sorted(spans, key=lambda s: s["start_ms"])
+
+    def total_ms(self) -> float:
+        return round((time.perf_counter() - self._t0) * 1000, 2)
+
+    def export_jsonl(self, path: str) -> None:
+        """Append every span as one JSON object per line."""
+        spans = self.timings()
+        with open(path, "a", encoding="utf-8") as fh:
+            for span in spans:
+                row = {"trace_id": self.trace_id, "trace": self.name, "trace_started_at": self.started_at, **span}
+                fh.write(json.dumps(row, default=str) + "\n")
+
+
+@contextmanager
+def start_trace(name: str):
+    """Activate a new `Tracer` for the current context and yield it."""
+    tracer = Tracer(name)
+    tracer_token = _current_tracer.set(tracer)
+    span_token = _current_span_id.set(None)
+    try:
+        yield tracer
+    finally:
+        _current_span_id.reset(span_token)
+        _current_tracer.reset(tracer_token)
+        if TRACE_EXPORT_PATH:
+            try:
+                tracer.export_jsonl(TRACE_EXPORT_PATH)
+            except OSError as e:
+                print(f"Could not export trace: {e}")
+
+
+def current_tracer():
+    return _current_tracer.get()
+
+
+@contextmanager
+def trace_span(name: str, **attrs):
+    """Record a span on the active tracer; a no-op outside of `start_trace`."""
+    tracer = _current_tracer.get()
+    if tracer is None:
+        yield dict(attrs)
+        return
+    with tracer.span(name, **attrs) as span_attrs:
+        yield span_attrs
+
+
+def bind_trace_context(fn):
+    """Wrap `fn` so it runs with the caller's tracer and parent span in a worker thread."""
+    ctx = contextvars.copy_context()
+
+    def _wrapped(*args, **kwargs):
+        # Each call gets its own copy: a Context cannot be entered by two threads at once.
+        return ctx.copy().run(fn, *args, **kwargs)
+
+    return _wrapped
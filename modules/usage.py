@@ -0,0 +1,116 @@
+import atexit
+import datetime
+import threading
+import time
+from collections import deque
+
+import pandas as pd
+
+from modules.database import init_supabase, save_usage_batch
+
+# Rows are buffered in-process and inserted into `amc_usage_log` in batches.
+USAGE_TABLE = "amc_usage_log"
+USAGE_BATCH_SIZE = 20
+USAGE_FLUSH_INTERVAL_SECONDS = 60.0
+
+# Recent entries kept in memory for the admin view (also used when the table is missing).
+USAGE_RECENT_MAX = 5000
+
+_lock = threading.Lock()
+_pending: list[dict] = []
+_recent: deque = deque(maxlen=USAGE_RECENT_MAX)
+_last_flush = time.monotonic()
+
+
+def extract_gemini_usage(response) -> dict:
+    """Read token counts from a `generate_content` response (zeros when missing)."""
+    meta = getattr(response, "usage_metadata", None)
+
+    def _count(name: str) -> int:
+        value = getattr(meta, name, None) if meta is not None else None
+        return int(value) if isinstance(value, (int, float)) else 0
+
+    return {
+        "prompt_tokens": _count("prompt_token_count"),
+        "output_tokens": _count("candidates_token_count"),
+        "cached_tokens": _count("cached_content_token_count"),
+    }
+
+
+def record_usage(entry: dict, supabase_client=None) -> None:
+    """Add one call to the ledger; flushes a batch in the background when due."""
+    row = {"created_at": datetime.datetime.now(datetime.timezone.utc).isoformat(), **entry}
+    with _lock:
+        _pending.append(row)
+        _recent.append(row)
+        due = len(_pending) >= USAGE_BATCH_SIZE or (
+            time.monotonic() - _last_flush >= USAGE_FLUSH_INTERVAL_SECONDS
+        )
+    if due:
+        threading.Thread(
+            target=flush_usage, args=(supabase_client,), name="amc-usage-flush", daemon=True
+        ).start()
+
+
+def flush_usage(supabase_client=None) -> int:
+    """Insert all pending rows in one batch. Returns the number of rows written."""
+    global _last_flush
+    with _lock:
+        batch = list(_pending)
+        _pending.clear()
+        _last_flush = time.monotonic()
+    if not batch:
+        return 0
+
+    supabase = supabase_client or init_supabase()
+    if not supabase or save_usage_batch(supabase, USAGE_TABLE, batch) is None:
+        # Keep the in-memory copy only; a missing table must not grow the buffer forever.
+        print(f"Usage ledger: could not persist {len(batch)} rows")
+        return 0
+    return len(batch)
+
+
+atexit.register(flush_usage)
+
+
+def recent_usage() -> pd.DataFrame:
+    """Entries recorded by this server process (newest last)."""
+    with _lock:
+        rows = list(_recent)
+    return pd.DataFrame(rows)
+
+
+def summarize_usage(df: pd.DataFrame, by: str = "route") -> pd.DataFrame:
+    """p50/p95 latency and token volume per `by` (scenario by default)."""
+    if df is None or df.empty or by not in df.columns:
+        return pd.DataFrame()
+
+    df = df.copy()
+    for col in ("latency_ms", "gemini_ms", "prompt_tokens", "output_tokens", "cached_tokens"):
+        if col not in df.columns:
+            df[col] = 0
+        df[col] = pd.to_numeric(df[col], errors="coerce").fillna(0)
+    if "cache_hit" not in df.columns:
+        df["cache_hit"] = False
+    df["cache_hit"] = df["cache_hit"].fillna(False).astype(bool)
+
+    grouped = df.groupby(by)
+    summary = pd.DataFrame(
+        {
+            "calls": grouped.size(),
+            "p50_latency_ms": grouped["latency_ms"].quantile(0.5),
+            "p95_latency_ms": grouped["latency_ms"].quantile(0.95),
+            "p95_gemini_ms": grouped["gemini_ms"].quantile(0.95),
+            "prompt_tokens": grouped["prompt_tokens"].sum(),
+            "output_tokens": grouped["output_tokens"].sum(),
+            "avg_prompt_tokens": grouped["prompt_tokens"].mean(),
+            "cache_hit_rate": grouped["cache_hit"].mean(),
+        }
+    )
+    if "parse_status" in df.columns:
+        # Share of Gemini responses that failed validation on the first pass / for good.
+        parsed = df[df["parse_status"].notna()].groupby(by)["parse_status"]
+        summary["parse_invalid_rate"] = parsed.apply(lambda s: (s != "ok").mean())
+        summary["parse_failure_rate"] = parsed.apply(lambda s: (s == "failed").mean())
+    summary = summary.reset_index()
+    return summary.sort_values("p95_latency_ms", ascending=False).round(1)
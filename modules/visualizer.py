@@ -3,6 +3,7 @@ import pandas as pd
 import altair as alt
 
 from modules.database import fetch_table_cached, get_instance_ids_by_names_cached
+from modules.render_costs import measured_fragment
 
 def render_visualizer(supabase, advertisers=None):
     st.title("📊 Data Explorer")
@@ -161,6 +162,13 @@ def render_visualizer(supabase, advertisers=None):
         st.error(f"Error loading data: {e}")
         return
 
+    # Chart and export panels rerun on their own, so tweaking the chart does not refetch the data.
+    _render_chart_panel(df, date_cols)
+    _render_export_panel(df, selected_table_label)
+
+
+@measured_fragment("visualizer.chart")
+def _render_chart_panel(df, date_cols):
     # --- 3. Chart Configuration & Rendering ---
     st.divider()
     
@@ -341,6 +349,9 @@ def render_visualizer(supabase, advertisers=None):
 
     st.altair_chart(chart.interactive(), use_container_width=True)
 
+
+@measured_fragment("visualizer.export")
+def _render_export_panel(df, selected_table_label):
     # --- 5. Data Export & Preview (New Feature) ---
     st.divider()
     c_action_1, c_action_2 = st.columns([1, 3])
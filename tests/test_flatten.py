@@ -0,0 +1,36 @@
+import pandas as pd
+
+from modules.flatten import flatten_records
+
+
+def test_numeric_strings_become_numbers():
+    df = flatten_records([{"spend": "12.50", "clicks": "3"}, {"spend": "0.75", "clicks": "10"}])
+    assert pd.api.types.is_float_dtype(df["spend"])
+    assert pd.api.types.is_integer_dtype(df["clicks"])
+
+
+def test_leading_zeros_are_kept():
+    df = flatten_records([{"asin": "0316769487"}])
+    assert df["asin"].tolist() == ["0316769487"]
+
+    df = flatten_records([{"zip": "02134"}, {"zip": "90210"}])
+    assert df["zip"].tolist() == ["02134", "90210"]
+
+
+def test_identifier_columns_stay_text():
+    df = flatten_records(
+        [{"advertiser_id": "123", "country_code": "44", "company": {"external_id": "987"}}]
+    )
+    assert df["advertiser_id"].tolist() == ["123"]
+    assert df["country_code"].tolist() == ["44"]
+    assert df["company.external_id"].tolist() == ["987"]
+
+
+def test_record_lists_explode_after_empty_rows():
+    df = flatten_records(
+        [
+            {"id": 1, "items": []},
+            {"id": 2, "items": [{"sku": "A1"}, {"sku": "B2"}]},
+        ]
+    )
+    assert df.loc[df["id"] == 2, "items.sku"].tolist() == ["A1", "B2"]
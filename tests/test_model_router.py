@@ -0,0 +1,54 @@
+import pytest
+
+# model_router imports the Streamlit/Supabase-backed schema module.
+pytest.importorskip("streamlit")
+pytest.importorskip("supabase")
+
+from modules.model_router import templated_query_plan  # noqa: E402
+
+REGISTRY = {
+    "marketplace": {"columns": ["id", "country", "created_at"]},
+    "ads_report": {"columns": ["date", "asin", "spend"]},
+    "amc_query_execution": {"columns": ["instance_id", "status", "created_at"]},
+    "company": {"columns": ["name"]},
+    "company_marketplace": {"columns": ["company_id", "marketplace_id"]},
+}
+
+
+@pytest.mark.parametrize(
+    "question, table",
+    [
+        ("show me the marketplace rows", "marketplace"),
+        ("List ads_report", "ads_report"),
+        ("preview amc query executions", "amc_query_execution"),
+    ],
+)
+def test_plain_lookup_uses_template(question, table):
+    query = templated_query_plan(question, REGISTRY)
+    assert query["table"] == table
+    assert query["filters"] == []
+
+
+@pytest.mark.parametrize(
+    "question",
+    [
+        "show marketplace where country is Germany",
+        "List ads_report rows for ASIN B00ABC",
+        "show the latest amc_query_execution rows for instance 5",
+        "show marketplace rows with country = 'DE'",
+        "show ads_report from last week",
+        "list the top ads_report rows",
+        "show total spend in ads report",
+        "show ads_report 2024",
+    ],
+)
+def test_qualified_questions_go_to_the_model(question):
+    assert templated_query_plan(question, REGISTRY) is None
+
+
+def test_whole_words_only():
+    assert templated_query_plan("show companyx rows", REGISTRY) is None
+
+
+def test_several_tables_go_to_the_model():
+    assert templated_query_plan("show company marketplace rows", REGISTRY) is None